@@ -0,0 +1,987 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks python-elections against large synthetic AP files.
+
+Run them all, or just the ones you name:
+
+    $ python benchmarks.py
+    $ python benchmarks.py fetch_memory
+"""
+import os
+import sys
+import time
+import inspect
+import ftplib
+import shutil
+import resource
+import tempfile
+import calculate
+from cStringIO import StringIO
+from elections import Election, clear_pools
+from elections.parsers import FlatfileParser, FlatfileRecordParser
+from elections.snapshot import Snapshot
+from elections.store import ColumnarResultStore, ResultStore
+from elections import vector
+from tests import FakeFTP, make_ap_files
+
+
+#
+# Helpers
+#
+
+class FileFTP(FakeFTP):
+    """
+    A FakeFTP that serves files out of a directory on disk, so the data
+    being served doesn't count against our own memory.
+    """
+    def _get(self, path):
+        # Returns the filename rather than the data
+        filename = os.path.join(self.files, path.lstrip('/'))
+        if not os.path.exists(filename):
+            raise ftplib.error_perm(
+                '550 The system cannot find the file specified.'
+            )
+        return filename
+
+    def size(self, path):
+        return os.path.getsize(self._get(path))
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        self.commands.append(cmd)
+        with open(self._get(cmd[len('RETR '):]), 'rb') as f:
+            while True:
+                chunk = f.read(blocksize)
+                if not chunk:
+                    break
+                callback(chunk)
+        return '226 Transfer complete.'
+
+    def transfercmd(self, cmd, rest=None):
+        self.commands.append(cmd)
+        return FileSocket(self._get(cmd[len('RETR '):]))
+
+
+class FileSocket(object):
+    """
+    Stands in for the data connection of a transfer, reading from a file.
+    """
+    def __init__(self, filename):
+        self.f = open(filename, 'rb')
+
+    def recv(self, blocksize):
+        return self.f.read(blocksize)
+
+    def close(self):
+        self.f.close()
+
+
+class FileElection(Election):
+    """
+    An Election that downloads from a FileFTP serving `directory`.
+    """
+    directory = None
+
+    def _connect(self):
+        return FileFTP(self.directory)
+
+
+def write_ap_files(directory, **kwargs):
+    """
+    Writes a set of synthetic AP files into a directory laid out like the
+    AP's FTP. Takes the same options as `make_ap_files`.
+    """
+    for path, data in make_ap_files(**kwargs).items():
+        filename = os.path.join(directory, path.lstrip('/'))
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+
+def bare_election():
+    """
+    Returns an Election that hasn't loaded anything, for calling its
+    methods directly.
+    """
+    election = Election.__new__(Election)
+    election.conditional = False
+    return election
+
+
+def peak_memory(func, *args):
+    """
+    Runs a function in a child process and returns how far it pushed the
+    peak resident memory above where it started, in megabytes.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        func(*args)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write, str(after - before))
+        os._exit(0)
+    os.close(write)
+    result = os.read(read, 100)
+    os.close(read)
+    os.waitpid(pid, 0)
+    # Linux reports kilobytes
+    return int(result) / 1024.0
+
+
+def timed(func, *args):
+    """
+    Returns how many seconds a function takes to run.
+    """
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+#
+# Benchmarks
+#
+
+def fetch_memory():
+    """
+    Peak memory used to download a large US_<date>.txt flat file, before and
+    after the fetch path was reworked to hold the data only once.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_ap_files(directory, states=50, races=4, counties=100,
+                       candidates=12)
+        election = bare_election()
+        path = "/Delegate_Tracking/US/flat/US_20160201.txt"
+        ftp = FileFTP(directory)
+        size = ftp.size(path)
+
+        def copied():
+            # How _fetch used to do it
+            buffer_ = StringIO()
+            ftp.retrbinary('RETR %s' % path, buffer_.write)
+            return StringIO(buffer_.getvalue())
+
+        print "File size: %.1f MB" % (size / 1024.0 / 1024.0)
+        print "Copied buffer: %.1f MB" % peak_memory(copied)
+        print "Rewound buffer: %.1f MB" % peak_memory(
+            election._retrieve, ftp, path
+        )
+        print "Preallocated bytearray: %.1f MB" % peak_memory(
+            election._retrieve_data, ftp, path, size
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+def results_rows_memory():
+    """
+    Peak memory used to read every row of the results flatfile, either as
+    the list _fetch_flatfile returns or one at a time from
+    iter_results_rows, for files of growing size.
+    """
+    for counties in (25, 50, 100):
+        directory = tempfile.mkdtemp()
+        try:
+            write_ap_files(directory, states=50, races=4, counties=counties,
+                           candidates=12)
+            FileElection.directory = directory
+            election = FileElection(username='bench', results=False)
+
+            def listed():
+                election._fetch_flatfile(
+                    election.results_file_path,
+                    election.results_basic_fields,
+                    election.results_candidate_fields
+                )
+
+            def iterated():
+                for row in election.iter_results_rows():
+                    pass
+
+            print "%s counties per state: list %.1f MB, iterator %.1f MB" % (
+                counties,
+                peak_memory(listed),
+                peak_memory(iterated)
+            )
+        finally:
+            shutil.rmtree(directory)
+            clear_pools()
+
+
+def flatfile_parse():
+    """
+    Time to parse a results flatfile with thousands of counties and a dozen
+    candidates per race, building dictionaries with FlatfileParser versus
+    building FlatfileRecords, and then reading the fields _get_results
+    needs out of each.
+    """
+    data = make_ap_files(states=50, races=2, counties=100, candidates=12)[
+        "/Delegate_Tracking/US/flat/US_20160201.txt"
+    ]
+    basicfields = Election.results_basic_fields
+    candidatefields = Election.results_candidate_fields
+    print "%s rows, %.1f MB" % (data.count('\n') + 1, len(data) / 1048576.0)
+
+    def dicts():
+        parser = FlatfileParser(basicfields, candidatefields)
+        for row in parser.parse(StringIO(data)):
+            row['race_number']
+            for c in row['candidates']:
+                c['candidate_number'], c['vote_count']
+
+    def records():
+        parser = FlatfileRecordParser(basicfields, candidatefields)
+        for row in parser.parse(StringIO(data)):
+            row['race_number']
+            zip(
+                row.candidate_values('candidate_number'),
+                row.candidate_values('vote_count')
+            )
+
+    before = timed(dicts)
+    after = timed(records)
+    print "Dictionaries: %.2f s" % before
+    print "Records: %.2f s (%.1fx faster)" % (after, before / after)
+
+
+def flatfile_projection():
+    """
+    Time and peak memory to parse every row of a results flatfile with
+    all of its fields, versus only the `results_required_fields` that
+    _get_results reads, as dictionaries and as records.
+    """
+    data = make_ap_files(states=50, races=2, counties=100, candidates=12)[
+        "/Delegate_Tracking/US/flat/US_20160201.txt"
+    ]
+    basicfields = Election.results_basic_fields
+    candidatefields = Election.results_candidate_fields
+
+    def parse(parser_class, fields):
+        parser = parser_class(basicfields, candidatefields, fields)
+        return parser.parse(StringIO(data))
+
+    for parser_class in (FlatfileParser, FlatfileRecordParser):
+        for label, fields in (
+            ('all fields', None),
+            ('required fields', Election.results_required_fields)
+        ):
+            print "%s, %s: %.2f s, %.1f MB" % (
+                parser_class.__name__,
+                label,
+                timed(parse, parser_class, fields),
+                peak_memory(parse, parser_class, fields)
+            )
+
+
+class ScanningIndex(object):
+    """
+    Stands in for an Election's state index, looking races up the way
+    _init_reporting_units used to by scanning all of them.
+
+    filter_races answers from an index of its own now, so this scans the
+    races the way it used to.
+    """
+    def __init__(self, election):
+        self.election = election
+
+    def get(self, statepostal, default=None):
+        return filter(
+            lambda x: getattr(x, 'statepostal') == statepostal,
+            self.election.races
+        )
+
+
+def init_reporting_units():
+    """
+    Time to build the reporting units for files with a growing number of
+    states, each with 50 counties and 4 races, looking up each row's races
+    in the state index versus scanning every race. The lookups are also
+    timed on their own, without building the units.
+    """
+    for states in (10, 20, 40, 80):
+        directory = tempfile.mkdtemp()
+        try:
+            write_ap_files(directory, states=states, races=4, counties=50)
+            FileElection.directory = directory
+            election = FileElection(username='bench', results=False)
+            rus = states * 51
+            postals = [
+                row['st_postal'] for row in election.iter_reporting_unit_rows()
+            ]
+
+            def lookups(index):
+                for postal in postals:
+                    index.get(postal, [])
+
+            state_index = election._races_by_state
+            indexed = timed(election._init_reporting_units)
+            indexed_lookups = timed(lookups, state_index)
+            election._races_by_state = ScanningIndex(election)
+            scanned = timed(election._init_reporting_units)
+            scanned_lookups = timed(lookups, election._races_by_state)
+            print (
+                "%s reporting units: indexed %.2f s (%.1f us per unit, "
+                "%.1f us looking up), scanned %.2f s (%.1f us per unit, "
+                "%.1f us looking up)" % (
+                    rus,
+                    indexed,
+                    indexed / rus * 1e6,
+                    indexed_lookups / rus * 1e6,
+                    scanned,
+                    scanned / rus * 1e6,
+                    scanned_lookups / rus * 1e6
+                )
+            )
+        finally:
+            shutil.rmtree(directory)
+            clear_pools()
+
+
+def filter_races():
+    """
+    Time to run a dashboard's worth of filter_races queries against 80
+    states with 8 races each, scanning every race for each keyword versus
+    looking them up in the query indexes.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_ap_files(directory, states=80, races=8, counties=1)
+        FileElection.directory = directory
+        election = FileElection(username='bench', results=False)
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+    states = sorted(set(r.statepostal for r in election.races))
+    queries = []
+    for state in states:
+        queries.append({'statepostal': state})
+        queries.append({'statepostal': state, 'party': 'GOP'})
+        queries.append({'officename': 'President', 'statepostal': state})
+    queries = queries * 3
+
+    def scanned():
+        for kwargs in queries:
+            races = election.races
+            for k in kwargs.keys():
+                races = filter(lambda x: getattr(x, k) == kwargs[k], races)
+
+    def indexed():
+        for kwargs in queries:
+            election.filter_races(**kwargs)
+
+    before = timed(scanned)
+    after = timed(indexed)
+    print "%s queries over %s races" % (len(queries), len(election.races))
+    print "Scanned: %.3f s" % before
+    print "Indexed: %.3f s (%.0fx faster)" % (after, before / after)
+
+    # Lookups that used to mean filtering in Python afterwards
+    pairs = [states[i:i + 2] for i in range(0, len(states), 2)] * 9
+
+    def filtered():
+        for pair in pairs:
+            [
+                r for r in election.races
+                if r.statepostal in pair and r.officename.startswith('Pres')
+            ]
+
+    def looked_up():
+        for pair in pairs:
+            election.filter_races(
+                statepostal__in=pair,
+                officename__startswith='Pres'
+            )
+
+    before = timed(filtered)
+    after = timed(looked_up)
+    print "%s __in and __startswith queries" % len(pairs)
+    print "Filtered in Python: %.3f s" % before
+    print "Lookups: %.3f s (%.0fx faster)" % (after, before / after)
+
+
+def race_results():
+    """
+    Time to pull the results of every race in turn, as a set of race pages
+    would, by scanning all of the election's results versus asking
+    get_results for each race.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_ap_files(directory, states=20, races=4, counties=50,
+                       candidates=12)
+        FileElection.directory = directory
+        election = FileElection(username='bench')
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+    races = election.races
+
+    def scanned():
+        for race in races:
+            [r for r in election.results if r.raceid == race.raceid]
+
+    def indexed():
+        for race in races:
+            election.get_results(race=race)
+
+    before = timed(scanned)
+    after = timed(indexed)
+    print "%s races, %s results" % (len(races), len(election.results))
+    print "Scanned: %.3f s" % before
+    print "Indexed: %.3f s (%.0fx faster)" % (after, before / after)
+
+
+def columnar_results():
+    """
+    Peak memory and time to load the results of 20 states with 4 races, 50
+    counties and 12 candidates each, into the _results dictionary of
+    CandidateReportingUnit objects versus the columnar store.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_ap_files(directory, states=20, races=4, counties=50,
+                       candidates=12)
+        FileElection.directory = directory
+        election = FileElection(username='bench', results=False)
+
+        def load(columnar):
+            election.columnar = columnar
+            if columnar:
+                election._result_store = ColumnarResultStore(
+                    election._make_result
+                )
+            else:
+                election._results = {}
+                election._result_store = ResultStore()
+            election._get_results()
+
+        # Measure memory first, in children, so the timing runs don't leave
+        # freed memory lying around to be reused
+        memory = [peak_memory(load, False), peak_memory(load, True)]
+        for label, columnar in (('Objects', False), ('Columnar', True)):
+            print "%s: %.2f s, %.1f MB" % (
+                label,
+                timed(load, columnar),
+                memory[columnar]
+            )
+        print "%s rows in %.1f MB of columns" % (
+            len(election._result_store),
+            election._result_store.nbytes() / 1048576.0
+        )
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def lazy_results():
+    """
+    Time to construct an Election for 20 states with 4 races, 50 counties
+    and 12 candidates each, building every result up front versus lazily,
+    next to the time it takes just to parse the results file. Then the time
+    to read a single race's results from the lazy election.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_ap_files(directory, states=20, races=4, counties=50,
+                       candidates=12)
+        FileElection.directory = directory
+
+        def parse():
+            election = FileElection(username='bench', results=False)
+            start = time.time()
+            rows = election.iter_results_rows(
+                records=True,
+                fields=election.results_required_fields
+            )
+            for row in rows:
+                pass
+            return time.time() - start
+
+        print "Parsing the results file: %.2f s" % parse()
+        print "Eager Election(): %.2f s" % timed(
+            FileElection,
+            '20160201',
+            'bench'
+        )
+        start = time.time()
+        election = FileElection(username='bench', lazy=True)
+        print "Lazy Election(): %.2f s" % (time.time() - start)
+        race = election.races[0]
+        print "First read of one race: %.4f s" % timed(
+            election.get_results,
+            race
+        )
+        print "Second read of one race: %.4f s" % timed(
+            election.get_results,
+            race
+        )
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def flyweight_results():
+    """
+    Peak memory and time to load the results of 20 states with 4 races, 50
+    counties and 12 candidates each, as CandidateReportingUnit objects
+    versus FlyweightResult objects.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_ap_files(directory, states=20, races=4, counties=50,
+                       candidates=12)
+        FileElection.directory = directory
+        election = FileElection(username='bench', results=False)
+
+        def load(flyweight):
+            election.flyweight = flyweight
+            election._results = {}
+            election._result_store = ResultStore()
+            election._get_results()
+
+        # Measure memory first, in children, so the timing runs don't leave
+        # freed memory lying around to be reused
+        memory = [peak_memory(load, False), peak_memory(load, True)]
+        for label, flyweight in (('Objects', False), ('Flyweights', True)):
+            print "%s: %.2f s, %.1f MB" % (
+                label,
+                timed(load, flyweight),
+                memory[flyweight]
+            )
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def intern_strings():
+    """
+    Peak memory to load a national-scale election of 50 states with 4
+    races, 100 counties and 6 candidates each, and to hold every record of
+    its results file, with and without interning the strings parsed out of
+    AP's files.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_ap_files(directory, states=50, races=4, counties=100,
+                       candidates=6)
+        FileElection.directory = directory
+
+        def load(intern_strings):
+            FileElection(
+                username='bench',
+                lazy=True,
+                intern_strings=intern_strings
+            )
+
+        def records(intern_strings):
+            election = FileElection(
+                username='bench',
+                results=False,
+                intern_strings=intern_strings
+            )
+            list(election.iter_results_rows(records=True))
+
+        for label, func in (('Election', load), ('Records', records)):
+            print "%s: %.1f MB plain, %.1f MB interned" % (
+                label,
+                peak_memory(func, False),
+                peak_memory(func, True)
+            )
+        election = FileElection(username='bench', lazy=True)
+        stats = election.intern_stats
+        print "%s strings, %s distinct, %.1f MB saved" % (
+            stats['lookups'],
+            stats['unique'],
+            stats['bytes_saved'] / 1048576.0
+        )
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def get_results():
+    """
+    Time for _get_results to load 20 states with 4 races, 50 counties and
+    12 candidates each, and for the decoding inside it: calling int() on
+    the numeric fields every time they're used, the way it used to, versus
+    reading values the parser has already converted once.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_ap_files(directory, states=20, races=4, counties=50,
+                       candidates=12)
+        FileElection.directory = directory
+        election = FileElection(username='bench', results=False)
+
+        def load():
+            election._results = {}
+            election._result_store = ResultStore()
+            election._get_results()
+
+        def rows(converters):
+            return list(election._iter_flatfile(
+                election.results_file_path,
+                election.results_basic_fields,
+                election.results_candidate_fields,
+                records=True,
+                fields=election.results_required_fields,
+                converters=converters
+            ))
+
+        def repeated(rows):
+            for row in rows:
+                vote_counts = row.candidate_values('vote_count')
+                sum([int(v) for v in vote_counts])
+                for v in vote_counts:
+                    int(v), int(v)
+                    int(row['precincts_reporting'])
+                    int(row['total_precincts'])
+                    int(row['precincts_reporting'])
+                    int(row['total_precincts'])
+                int(row['total_precincts'])
+                int(row['precincts_reporting'])
+
+        def typed(rows):
+            for row in rows:
+                vote_counts = row.candidate_values('vote_count')
+                sum(vote_counts)
+                for v in vote_counts:
+                    row['precincts_reporting'], row['total_precincts']
+
+        load()
+        print "_get_results: %.2f s" % timed(load)
+        untyped = timed(rows, None) + timed(repeated, rows(None))
+        converted = (
+            timed(rows, election.results_converters) +
+            timed(typed, rows(election.results_converters))
+        )
+        print "Parse and convert on every use: %.3f s" % untyped
+        print "Parse and convert once: %.3f s (%.1fx faster)" % (
+            converted,
+            untyped / converted
+        )
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def percentages():
+    """
+    Time to work out the vote and precincts reporting percentages for every
+    result of 20 states with 4 races, 50 counties and 12 candidates each:
+    calling calculate.percentage once per result, the way it used to,
+    versus a pass over whole columns, with NumPy and with the pure Python
+    fallback.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_ap_files(directory, states=20, races=4, counties=50,
+                       candidates=12)
+        FileElection.directory = directory
+        store = FileElection(username='bench', columnar=True)._result_store
+        columns = (
+            (store.votecount, store.votes_total, False),
+            (store.precinctsreporting, store.precinctstotal, True),
+        )
+
+        def one_at_a_time():
+            for values, totals, multiply in columns:
+                [
+                    calculate.percentage(v, t, multiply=multiply) or 0.0
+                    for v, t in zip(values, totals)
+                ]
+
+        def vectorized(func):
+            for values, totals, multiply in columns:
+                func(values, totals, multiply)
+
+        single = timed(one_at_a_time)
+        print "%s results" % len(store)
+        print "calculate.percentage: %.3f s" % single
+        if vector.numpy is not None:
+            fast = timed(vectorized, vector._numpy_percentages)
+            print "NumPy: %.3f s (%.1fx faster)" % (fast, single / fast)
+        fallback = timed(vectorized, vector._python_percentages)
+        print "Pure Python: %.3f s (%.1fx faster)" % (
+            fallback,
+            single / fallback
+        )
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def refresh():
+    """
+    Time to pick up new numbers for 20 states with 4 races, 50 counties
+    and 12 candidates each: loading a new Election, the only way there
+    used to be, versus refreshing the one we have, in each mode.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        options = dict(states=20, races=4, counties=50, candidates=12)
+        write_ap_files(directory, votes=0, **options)
+        FileElection.directory = directory
+        modes = (
+            ('Eager', {}),
+            ('Flyweight', {'flyweight': True}),
+            ('Lazy', {'lazy': True}),
+            ('Columnar', {'columnar': True}),
+        )
+        for label, kwargs in modes:
+
+            def load():
+                return FileElection(username='bench', **kwargs)
+
+            election = load()
+            # Build every object, as a long-running consumer would have
+            election.results
+            write_ap_files(directory, votes=1, **options)
+            reload = timed(load)
+            update = timed(election.refresh)
+            write_ap_files(directory, votes=0, **options)
+            print "%s: new Election %.2f s, refresh %.2f s (%.1fx faster)" % (
+                label,
+                reload,
+                update,
+                reload / update
+            )
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def changed_lines():
+    """
+    Time to refresh 20 states with 4 races, 50 counties and 12 candidates
+    each when 1% and 10% of the lines in the results file have changed,
+    decoding every line versus only the lines whose hashes changed.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        options = dict(states=20, races=4, counties=50, candidates=12)
+        write_ap_files(directory, votes=0, **options)
+        FileElection.directory = directory
+        old = make_ap_files(votes=0, **options)
+        new = make_ap_files(votes=1, **options)
+        path = FileElection(username='bench', results=False).results_file_path
+        filename = os.path.join(directory, path.lstrip('/'))
+        old_lines = old[path].split('\n')
+        new_lines = new[path].split('\n')
+        print "%s lines" % len(old_lines)
+
+        def write(lines):
+            with open(filename, 'wb') as f:
+                f.write('\n'.join(lines))
+
+        for percent in (1, 10):
+            # Every nth line moves
+            step = 100 // percent
+            changed = [
+                new_lines[i] if i % step == 0 else line
+                for i, line in enumerate(old_lines)
+            ]
+            times = []
+            for detect_changes in (False, True):
+                write(old_lines)
+                election = FileElection(
+                    username='bench',
+                    detect_changes=detect_changes
+                )
+                write(changed)
+                times.append(timed(election.refresh))
+            print "%s%% changed: every line %.3f s, changed lines %.3f s " \
+                "(%.1fx faster)" % (percent, times[0], times[1],
+                                    times[0] / times[1])
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def diff():
+    """
+    Time to find what changed when 1% of the lines in the results file of
+    20 states with 4 races, 50 counties and 12 candidates each move:
+    snapshotting every result before a refresh and comparing them all
+    afterwards, the way it's done by hand, versus the changes refresh
+    notes along the way.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        options = dict(states=20, races=4, counties=50, candidates=12)
+        write_ap_files(directory, votes=0, **options)
+        FileElection.directory = directory
+        old = make_ap_files(votes=0, **options)
+        new = make_ap_files(votes=1, **options)
+        path = FileElection(username='bench', results=False).results_file_path
+        filename = os.path.join(directory, path.lstrip('/'))
+        changed = [
+            line if i % 100 else new_line
+            for i, (line, new_line) in enumerate(zip(
+                old[path].split('\n'),
+                new[path].split('\n')
+            ))
+        ]
+
+        def snapshot(election):
+            return dict(
+                (r.key, (r.votecount, r.winner, r.precinctsreporting))
+                for r in election.results
+            )
+
+        def by_hand(election):
+            before = snapshot(election)
+            election.refresh()
+            after = snapshot(election)
+            return [k for k, v in after.items() if before.get(k) != v]
+
+        def noted(election):
+            return election.refresh()['changes']
+
+        times = []
+        for func in (by_hand, noted):
+            write_ap_files(directory, votes=0, **options)
+            election = FileElection(username='bench')
+            with open(filename, 'wb') as f:
+                f.write('\n'.join(changed))
+            times.append(timed(func, election))
+        print "Snapshot and compare: %.3f s" % times[0]
+        print "Noted by refresh: %.3f s (%.1fx faster)" % (
+            times[1],
+            times[0] / times[1]
+        )
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def callbacks():
+    """
+    Calls made, and time spent making them, to tell a subscriber about
+    every change when all of the results of 20 states with 4 races, 50
+    counties and 12 candidates each move: a call for each change versus
+    the batches, one per race and kind, that refresh makes.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        options = dict(states=20, races=4, counties=50, candidates=12)
+        write_ap_files(directory, votes=0, **options)
+        FileElection.directory = directory
+        election = FileElection(username='bench')
+        write_ap_files(directory, votes=1, **options)
+        changes = election.refresh()['changes']
+        calls = [0]
+
+        def callback(*args):
+            calls[0] += 1
+
+        def one_at_a_time():
+            for change in changes:
+                callback(change.race, change)
+
+        def batched():
+            for name in election._callbacks:
+                election._callbacks[name] = [callback]
+            election._dispatch(changes)
+
+        for label, func in (('Each change', one_at_a_time),
+                            ('Batched', batched)):
+            calls[0] = 0
+            seconds = timed(func)
+            print "%s: %s calls, %.3f s" % (label, calls[0], seconds)
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+def snapshots():
+    """
+    Time to publish a new snapshot of 20 states with 4 races, 50 counties
+    and 12 candidates each after a refresh in which 1% of the lines in the
+    results file changed: copying every race, versus copying only the
+    reporting units that changed and sharing the rest with the last
+    version.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        options = dict(states=20, races=4, counties=50, candidates=12)
+        write_ap_files(directory, votes=0, **options)
+        FileElection.directory = directory
+        old = make_ap_files(votes=0, **options)
+        new = make_ap_files(votes=1, **options)
+        election = FileElection(username='bench')
+        path = election.results_file_path
+        with open(os.path.join(directory, path.lstrip('/')), 'wb') as f:
+            f.write('\n'.join(
+                line if i % 100 else new_line
+                for i, (line, new_line) in enumerate(zip(
+                    old[path].split('\n'),
+                    new[path].split('\n')
+                ))
+            ))
+        first = election.snapshot()
+        changes = election.refresh()['changes']
+
+        def copy_all():
+            return Snapshot(
+                2,
+                [election._race_state(race) for race in election.races]
+            )
+
+        def shared():
+            election._snapshot = first
+            election._publish(changes.touched)
+
+        full = timed(copy_all)
+        part = timed(shared)
+        print "%s of %s races and %s of %s reporting units changed" % (
+            len(changes.races),
+            len(election.races),
+            len(changes.touched),
+            len(election.reporting_units)
+        )
+        print "Copy every race: %.3f s" % full
+        print "Share what didn't change: %.3f s (%.1fx faster)" % (
+            part,
+            full / part
+        )
+    finally:
+        shutil.rmtree(directory)
+        clear_pools()
+
+
+BENCHMARKS = [
+    fetch_memory,
+    results_rows_memory,
+    flatfile_parse,
+    flatfile_projection,
+    init_reporting_units,
+    filter_races,
+    race_results,
+    columnar_results,
+    lazy_results,
+    flyweight_results,
+    intern_strings,
+    get_results,
+    percentages,
+    refresh,
+    changed_lines,
+    diff,
+    callbacks,
+    snapshots,
+]
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    for benchmark in BENCHMARKS:
+        if names and benchmark.__name__ not in names:
+            continue
+        print "== %s ==" % benchmark.__name__
+        print inspect.getdoc(benchmark)
+        print
+        benchmark()
+        print
@@ -1,10 +1,28 @@
+import logging
 from ftp import (
     Election,
     FileDoesNotExistError,
     BadCredentialsError
 )
+from pool import (
+    FTPPool,
+    PoolTimeoutError,
+    get_pool,
+    clear_pools
+)
+# Leave it to the application to decide where our log messages go
+try:
+    logging.getLogger(__name__).addHandler(logging.NullHandler())
+except AttributeError:
+    # NullHandler is new in Python 2.7
+    pass
+
 __all__ = (
     'Election',
     'FileDoesNotExistError',
-    'BadCredentialsError'
+    'BadCredentialsError',
+    'FTPPool',
+    'PoolTimeoutError',
+    'get_pool',
+    'clear_pools',
 )
@@ -0,0 +1,269 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Caches of the files we've downloaded from the AP's FTP.
+
+Each file is remembered alongside the modification time and size the server
+reported for it, so that we only have to download it again when it changes.
+"""
+import os
+import errno
+import hashlib
+import tempfile
+import threading
+from cStringIO import StringIO
+
+
+class CacheEntry(object):
+    """
+    A copy of a file as it was when we last downloaded it.
+
+    The data can be a string or a bytearray. Anything parsed out of it can
+    be stashed in the `parsed` dictionary so that it doesn't have to be
+    parsed again while the file stays the same.
+    """
+    def __init__(self, path, modified, size, data):
+        self.path = path
+        self.modified = modified
+        self.size = size
+        self.data = data
+        self.parsed = {}
+
+    def __repr__(self):
+        return "<CacheEntry: %s (%s)>" % (self.path, self.modified)
+
+    def matches(self, modified, size):
+        """
+        Tests whether the entry is the same version of the file the server
+        is describing.
+        """
+        if modified is None:
+            return False
+        return (self.modified, self.size) == (modified, size)
+
+    def open(self):
+        """
+        Returns a file object for reading the data.
+
+        The file object reads straight out of the data rather than a copy,
+        so any number of them can be open at once cheaply.
+        """
+        return StringIO(self.data)
+
+
+class MemoryCache(object):
+    """
+    Keeps the last downloaded copy of each file in memory.
+
+    Also tallies how often each file was fetched or skipped, and how many
+    bytes that moved or saved.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, modified, size):
+        """
+        Returns the cached entry for a path if it matches the provided
+        modification time and size. Otherwise returns None.
+        """
+        entry = self._entries.get(path)
+        if entry is not None and entry.matches(modified, size):
+            return entry
+        return None
+
+    def set(self, path, modified, size, data):
+        """
+        Stores a freshly downloaded file and returns its entry.
+        """
+        entry = CacheEntry(path, modified, size, data)
+        self._entries[path] = entry
+        return entry
+
+    def record(self, path, skipped, size):
+        """
+        Tallies a fetch of the provided path, noting whether the download
+        was skipped and how many bytes were involved.
+        """
+        with self._lock:
+            try:
+                d = self._stats[path]
+            except KeyError:
+                d = self._stats[path] = {
+                    'fetched': 0,
+                    'skipped': 0,
+                    'bytes_fetched': 0,
+                    'bytes_saved': 0,
+                }
+            if skipped:
+                d['skipped'] += 1
+                d['bytes_saved'] += size
+            else:
+                d['fetched'] += 1
+                d['bytes_fetched'] += size
+
+    def stats(self):
+        """
+        Returns a dictionary of fetch counters for each path.
+        """
+        with self._lock:
+            return dict((k, dict(v)) for k, v in self._stats.items())
+
+    def clear(self):
+        """
+        Forgets every cached file and counter.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+
+
+class DiskCache(object):
+    """
+    Keeps downloaded files in a directory on disk, so they can be shared by
+    every process working on the same election.
+
+    Files are keyed by the username they were downloaded with, since AP
+    accounts can see different files at the same path, and their FTP path
+    plus the modification time and size the server reported. Writes are
+    atomic, so processes sharing the directory never see a partial file,
+    and once the directory holds more than `max_bytes` the least recently
+    used files are removed.
+    """
+    TEMP_PREFIX = '.tmp-'
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, username=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.username = username
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def __repr__(self):
+        return "<DiskCache: %s>" % self.directory
+
+    def filename(self, path, modified, size):
+        """
+        Returns where the provided version of a file is stored on disk.
+        """
+        key = hashlib.sha1('%s\n%s\n%s\n%s' % (
+            self.username,
+            path,
+            modified,
+            size
+        ))
+        return os.path.join(self.directory, key.hexdigest())
+
+    def get(self, path, modified, size):
+        """
+        Returns a CacheEntry for the provided version of a file if we have
+        it on disk. Otherwise returns None.
+        """
+        if modified is None:
+            return None
+        filename = self.filename(path, modified, size)
+        try:
+            with open(filename, 'rb') as f:
+                # Read straight into an array allocated to fit
+                data = bytearray(os.fstat(f.fileno()).st_size)
+                f.readinto(data)
+            # Mark it as recently used
+            os.utime(filename, None)
+        except (IOError, OSError):
+            return None
+        return CacheEntry(path, modified, size, data)
+
+    def set(self, path, modified, size, data):
+        """
+        Writes a freshly downloaded file to disk, if it can, and returns its
+        entry.
+
+        The data is written to a temporary file first and then renamed into
+        place, so readers never see it half written.
+        """
+        entry = CacheEntry(path, modified, size, data)
+        if modified is None:
+            return entry
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(
+                dir=self.directory,
+                prefix=self.TEMP_PREFIX
+            )
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, self.filename(path, modified, size))
+        except (IOError, OSError):
+            # Another process may have beaten us to it, or the disk may be
+            # full. Either way we've still got the data in memory.
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+        return entry
+
+    def evict(self):
+        """
+        Removes the least recently used files until the directory is back
+        under `max_bytes`.
+        """
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.startswith(self.TEMP_PREFIX):
+                continue
+            filename = os.path.join(self.directory, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, filename))
+            total += st.st_size
+        files.sort()
+        for mtime, size, filename in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+
+#
+# The process-wide registry
+#
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(host, username=None):
+    """
+    Returns the shared MemoryCache for a host and username, creating it if
+    it doesn't exist yet.
+
+    AP accounts with different levels of access can see different files at
+    the same path, so each gets a cache of its own.
+    """
+    key = (host, username)
+    with _caches_lock:
+        try:
+            return _caches[key]
+        except KeyError:
+            cache = _caches[key] = MemoryCache()
+            return cache
+
+
+def clear_caches():
+    """
+    Empties and forgets all of the caches.
+    """
+    with _caches_lock:
+        caches = _caches.values()
+        _caches.clear()
+    for cache in caches:
+        cache.clear()
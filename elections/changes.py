@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The changes an Election finds in the results file when it's refreshed.
+
+Each kind of change is its own class, with the race, reporting unit and,
+where there is one, candidate it's about. They're noted as the results are
+updated, so finding them doesn't mean comparing every result afterwards.
+"""
+
+
+class Change(object):
+    """
+    Something that changed in the results. Subclasses list the names of
+    their values in `fields`.
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self.fields):
+            raise TypeError(
+                "%s takes %s values" % (type(self).__name__, len(self.fields))
+            )
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "<%s: %s>" % (
+            type(self).__name__,
+            ", ".join(
+                "%s=%r" % (name, getattr(self, name))
+                for name in self.fields
+                if name not in ('race', 'reporting_unit', 'candidate')
+            )
+        )
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def values(self):
+        """
+        Returns a tuple of the change's values, in the order of `fields`.
+        """
+        return tuple(getattr(self, name) for name in self.fields)
+
+
+class VoteChange(Change):
+    """
+    A candidate's vote count in a reporting unit went from `before` to
+    `after`.
+    """
+    __slots__ = fields = (
+        'race',
+        'reporting_unit',
+        'candidate',
+        'before',
+        'after',
+    )
+
+
+class PrecinctChange(Change):
+    """
+    The number of precincts reporting in a reporting unit went from
+    `before` to `after`.
+    """
+    __slots__ = fields = ('race', 'reporting_unit', 'before', 'after')
+
+
+class NewWinner(Change):
+    """
+    A candidate was declared the winner in a reporting unit.
+    """
+    __slots__ = fields = ('race', 'reporting_unit', 'candidate')
+
+
+class NewReportingUnit(Change):
+    """
+    A reporting unit showed up in the results for the first time.
+    """
+    __slots__ = fields = ('race', 'reporting_unit')
+
+
+class ChangeSet(object):
+    """
+    The changes found by one pass over the results file, in the order they
+    were found.
+
+    Iterate over it for all of them, or read the list of one kind from
+    `votes`, `precincts`, `winners` or `reporting_units`.
+
+    `races` lists every race that anything changed in, and `touched` every
+    (race, reporting unit) pair, including changes, like a new vote
+    percentage, that don't have a class of their own.
+
+    `errors` lists a (callback, race, error) tuple for each callback that
+    raised an error when it was called with the changes.
+    """
+    def __init__(self, changes=None):
+        self.changes = list(changes or [])
+        self.errors = []
+        self.races = []
+        self.touched = []
+        self._races = set()
+        self._touched = set()
+        for change in self.changes:
+            self.touch(change.race, change.reporting_unit)
+
+    def __repr__(self):
+        return "<ChangeSet: %s changes>" % len(self)
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def __nonzero__(self):
+        return bool(self.changes)
+
+    def add(self, change):
+        """
+        Adds a change to the end of the set.
+        """
+        self.changes.append(change)
+        self.touch(change.race, change.reporting_unit)
+
+    def touch(self, race, reporting_unit):
+        """
+        Notes that something changed in a race's reporting unit.
+        """
+        if id(reporting_unit) in self._touched:
+            return
+        self._touched.add(id(reporting_unit))
+        self.touched.append((race, reporting_unit))
+        if id(race) not in self._races:
+            self._races.add(id(race))
+            self.races.append(race)
+
+    def of(self, kind):
+        """
+        Returns a list of the changes of the provided class.
+        """
+        return [c for c in self.changes if isinstance(c, kind)]
+
+    def batches(self):
+        """
+        Returns a list of (kind, race, changes) tuples, grouping the changes
+        by their class and race, in the order they were found.
+        """
+        batches = []
+        groups = {}
+        for change in self.changes:
+            kind = type(change)
+            key = (kind, id(change.race))
+            try:
+                groups[key].append(change)
+            except KeyError:
+                group = groups[key] = [change]
+                batches.append((kind, change.race, group))
+        return batches
+
+    def by_race(self, kind):
+        """
+        Returns a list of (race, changes) tuples, one for each race with
+        changes of the provided class, in the order they were found.
+        """
+        return [
+            (race, changes)
+            for k, race, changes in self.batches()
+            if k is kind
+        ]
+
+    @property
+    def votes(self):
+        return self.of(VoteChange)
+
+    @property
+    def precincts(self):
+        return self.of(PrecinctChange)
+
+    @property
+    def winners(self):
+        return self.of(NewWinner)
+
+    @property
+    def reporting_units(self):
+        return self.of(NewReportingUnit)
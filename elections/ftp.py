@@ -9,10 +9,34 @@ In order to use this library, you must pay AP for access to the data.
 More information can be found on the AP's web site (http://www.apdigitalnews.\
 com/ap_elections.html) or by contacting Anthony Marquez at amarquez@ap.org.
 """
-import csv
+import sys
+import copy
+import Queue
+import logging
 import itertools
+import threading
 import calculate
-from ftplib import FTP
+from ftplib import FTP, error_perm
+from pool import connection_errors, get_pool
+from cache import get_cache, DiskCache
+from changes import ChangeSet, NewReportingUnit, NewWinner, PrecinctChange
+from changes import VoteChange
+from models import FlyweightResult
+from poller import Poller
+from snapshot import RaceState, Snapshot
+from query import QueryIndex
+from store import ColumnarResultStore, LazyResultStore, ResultStore
+from vector import percentages
+from parsers import (
+    FlatfileParser,
+    FlatfileRecordParser,
+    Interner,
+    LineHashes,
+    iter_chunks,
+    iter_csv,
+    split_list,
+    strip_dict
+)
 from cStringIO import StringIO
 from dateutil.parser import parse as dateparse
 from elex.api.models import (
@@ -22,26 +46,214 @@ from elex.api.models import (
     Race
 )
 
+log = logging.getLogger(__name__)
+
 
 class Election(object):
     """
     The public client you can use to connect to AP's data feed.
+
+    By default every result is built into a CandidateReportingUnit as soon
+    as it's downloaded. Pass `columnar=True` to keep the results as columns
+    of numbers instead, building objects only when they're asked for, or
+    `lazy=True` to also hang on to each object once it's built, up to
+    `result_cache_size` of them.
+
+    Pass `flyweight=True` to build FlyweightResult objects, which read what
+    they share with their race, candidate and reporting unit from them
+    rather than keeping copies.
+
+    `refresh` only decodes the lines of the results file that have changed
+    since the last time it was read. Pass `detect_changes=False` to decode
+    every line every time.
     """
     FTP_HOSTNAME = 'electionsonline.ap.org'
     ap_number_template = '%(number)s-%(state)s'
 
+    # The basic fields that start each row of the results flatfile
+    results_basic_fields = [
+        'test',
+        'election_date',
+        'state_postal',
+        'county_number',
+        'fips',
+        'county_name',
+        'race_number',
+        'office_id',
+        'race_type_id',
+        'seat_number',
+        'office_name',
+        'seat_name',
+        'race_type_party',
+        'race_type',
+        'office_description',
+        'number_of_winners',
+        'number_in_runoff',
+        'precincts_reporting',
+        'total_precincts',
+    ]
+
+    # The Race attributes filter_races keeps indexes on
+    race_index_fields = [
+        'officename',
+        'party',
+        'statepostal',
+        'officeid',
+        'racetypeid',
+        'national',
+    ]
+
+    # The ReportingUnit attributes filter_reporting_units keeps indexes on
+    reporting_unit_index_fields = [
+        'statepostal',
+        'level',
+        'reportingunitid',
+        'fipscode',
+        'raceid',
+        'officename',
+    ]
+
+    # The CandidateReportingUnit attributes filter_results keeps indexes on
+    result_index_fields = [
+        'raceid',
+        'statepostal',
+        'level',
+        'reportingunitid',
+        'fipscode',
+        'polid',
+        'party',
+        'officename',
+        'winner',
+    ]
+
+    # The fields _get_results reads out of the flatfile
+    results_required_fields = [
+        'test',
+        'state_postal',
+        'county_number',
+        'county_name',
+        'race_number',
+        'precincts_reporting',
+        'total_precincts',
+        'candidate_number',
+        'incumbent',
+        'vote_count',
+        'is_winner',
+    ]
+
+    # The fields that identify a line of the results flatfile, so it can be
+    # compared with the same line the last time the file was read
+    results_key_fields = [
+        'state_postal',
+        'race_number',
+        'county_number',
+    ]
+
+    # The numeric fields _get_results reads, converted once as they're parsed
+    results_converters = {
+        'precincts_reporting': int,
+        'total_precincts': int,
+        'vote_count': int,
+    }
+
+    # How many lines of the results file are read before their percentages
+    # are worked out and their results built, so what's waiting on them
+    # doesn't grow with the file
+    results_batch_lines = 1000
+
+    # The CandidateReportingUnit attributes a refresh brings up to date
+    result_update_fields = [
+        'votecount',
+        'votepct',
+        'winner',
+        'runoff',
+        'precinctsreporting',
+        'precinctstotal',
+        'precinctsreportingpct',
+    ]
+
+    # The candidate fields that repeat after the basics
+    results_candidate_fields = [
+        'candidate_number',
+        'order',
+        'party',
+        'first_name',
+        'middle_name',
+        'last_name',
+        'junior',
+        'use_junior',
+        'incumbent',
+        'vote_count',
+        'is_winner',
+        'national_politician_id',
+    ]
+
     def __init__(
         self,
         electiondate='20160201',
         username=None,
         password=None,
         results=True,
+        connections=1,
+        conditional=False,
+        cache_dir=None,
+        cache_max_bytes=256 * 1024 * 1024,
+        columnar=False,
+        lazy=False,
+        result_cache_size=None,
+        flyweight=False,
+        intern_strings=True,
+        detect_changes=True,
         **kwargs
     ):
         self.username = username
         self.password = password
+        self.connections = connections
+        # Held while the results are being refreshed
+        self.lock = threading.RLock()
+        # The latest version of the results published for readers, once
+        # anyone has asked for one
+        self._snapshot = None
+        # The functions to call with each kind of change after a refresh
+        self._callbacks = {
+            'race_called': [],
+            'votes_changed': [],
+            'precincts_changed': [],
+        }
+        # Whether to hold results in columns of numbers rather than objects,
+        # and whether to hang on to the objects once they're built
+        self.lazy = lazy
+        self.columnar = columnar or lazy
+        # Whether results share their race, candidate and unit's attributes
+        self.flyweight = flyweight
+        # Repeated strings in the files we parse are shared through this
+        if intern_strings:
+            self.interner = Interner()
+        else:
+            self.interner = None
+        # Hashes of the lines of the results file, so unchanged ones can be
+        # skipped the next time it's read
+        if detect_changes:
+            self._line_hashes = LineHashes([
+                self.results_basic_fields.index(f)
+                for f in self.results_key_fields
+            ])
+        else:
+            self._line_hashes = None
+        # Files kept on disk are keyed by modification time, so using them
+        # means fetching conditionally
+        self.conditional = conditional or cache_dir is not None
+        if cache_dir is not None:
+            self.disk_cache = DiskCache(
+                cache_dir,
+                cache_max_bytes,
+                username
+            )
+        else:
+            self.disk_cache = None
         self._ftp = None
-        self._ftp_hits = 0
+        # Tallies of the connections we've borrowed from the pool
+        self.ftp_stats = {'hits': 0, 'misses': 0, 'reconnects': 0}
         try:
             dt = dateparse(electiondate)
         except ValueError:
@@ -61,18 +273,67 @@ Try submitting it in YYYY-MM-DD format."
 
         # Cache for the objects so we can grab them when we need them
         self._races = {}
+        # Reporting units are keyed by (ap_race_number, key), since each
+        # race has its own
         self._reporting_units = {}
+        # Each key's reporting units across all the races, in load order
+        self._reporting_units_by_key = {}
         self._candidates = {}
         self._results = {}
 
-        # Load initialization data
-        self._init_races()
-        self._init_reporting_units()
-        self._init_candidates()
+        # The results again, filed by race, reporting unit and candidate. In
+        # columnar mode this is the only place they're kept.
+        if lazy:
+            self._result_store = LazyResultStore(
+                self._make_result,
+                result_cache_size
+            )
+        elif columnar:
+            self._result_store = ColumnarResultStore(self._make_result)
+        else:
+            self._result_store = ResultStore()
+
+        # The races in each state, keyed by postal code
+        self._races_by_state = {}
+
+        # Indexes for the filter methods, built when they're first needed
+        self._race_index = QueryIndex(
+            lambda: self.races,
+            self.race_index_fields
+        )
+        self._reporting_unit_index = QueryIndex(
+            lambda: self.reporting_units,
+            self.reporting_unit_index_fields
+        )
+        self._result_index = QueryIndex(
+            lambda: self.results,
+            self.result_index_fields
+        )
 
-        # Load results data
-        if results:
-            self._get_results()
+        # Files downloaded ahead of time, waiting to be parsed
+        self._prefetched = {}
+        try:
+            if self.connections > 1:
+                paths = [
+                    self.race_file_path,
+                    self.reporting_unit_file_path,
+                    self.candidate_file_path,
+                ]
+                if results:
+                    paths.append(self.results_file_path)
+                self._prefetch(paths)
+
+            # Load initialization data
+            self._init_races()
+            self._init_reporting_units()
+            self._init_candidates()
+
+            # Load results data
+            if results:
+                self._get_results()
+        finally:
+            # Give our connection back so the next Election can use it
+            self.close()
 
     #
     # Public methods
@@ -82,48 +343,407 @@ Try submitting it in YYYY-MM-DD format."
     def ftp(self):
         """
         Checks if we have an active FTP connection.
-        If not, activates a new connection to the AP.
+        If not, borrows one from the pool of connections to the AP.
+
+        The connection stays ours until `close` is called to hand it back,
+        so call it when you're done.
         """
         if not self._ftp or not self._ftp.sock:
-            self._ftp = FTP(self.FTP_HOSTNAME, self.username, self.password)
-            self._ftp_hits += 1
+            if self._ftp:
+                self.pool.release(self._ftp, discard=True)
+                self._ftp = None
+            self._ftp = self._acquire()
         return self._ftp
 
+    @property
+    def pool(self):
+        """
+        The process-wide pool of connections for our host and login.
+        """
+        pool = get_pool(self.FTP_HOSTNAME, self.username, self.password)
+        # Make room for as many downloads at once as we were asked for
+        pool.grow(self.connections)
+        return pool
+
+    def close(self):
+        """
+        Returns our FTP connection to the pool.
+        """
+        if self._ftp is not None:
+            self.pool.release(self._ftp)
+            self._ftp = None
+
+    @property
+    def cache(self):
+        """
+        The process-wide cache of files downloaded from our host with our
+        username.
+        """
+        return get_cache(self.FTP_HOSTNAME, self.username)
+
+    @property
+    def intern_stats(self):
+        """
+        Returns a dictionary of how many of the strings we've parsed were
+        shared and how many bytes that saved.
+        """
+        if self.interner is None:
+            return None
+        return self.interner.stats()
+
+    @property
+    def fetch_stats(self):
+        """
+        Returns counts of how many times each file has been fetched or
+        skipped because it hadn't changed, along with the bytes involved.
+
+        Only conditional fetches are counted.
+        """
+        return self.cache.stats()
+
+    @property
+    def _ftp_hits(self):
+        """
+        The number of times we've had to log in to the AP.
+        """
+        return self.ftp_stats['misses'] + self.ftp_stats['reconnects']
+
     #
     # Private methods
     #
 
-    def _fetch(self, path):
+    def _connect(self):
         """
-        Fetch a file from the AP FTP.
+        Opens and logs in a new connection to the AP's FTP.
+        """
+        return FTP(self.FTP_HOSTNAME, self.username, self.password)
 
-        Provide a path, get back a file obj with your data.
+    def _acquire(self, fresh=False):
+        """
+        Borrows a connection from the pool, logging in with `_connect` if a
+        new one is needed.
+        """
+        return self.pool.acquire(self.ftp_stats, self._connect, fresh)
+
+    def _translate_error(self, e):
+        """
+        Converts an error raised by the FTP into one of our own, if we can.
+        """
+        message = str(e)
+        if "550 The system cannot find the" in message:
+            return FileDoesNotExistError(
+                "The file you've requested does not exist." +
+                " If you're looking for data about a state, make sure" +
+                " you input valid postal codes. If you're looking" +
+                " for a date, make sure it's correct."
+            )
+        elif "530 User cannot log in" in message:
+            return BadCredentialsError(
+                "The username and password you submitted" +
+                " are not accepted by the AP's FTP."
+            )
+        return e
+
+    def _retrieve(self, ftp, path):
+        """
+        Download a file over the provided FTP connection.
+
+        Returns a file object with the data.
         """
         # Make a file object to store our target
         buffer_ = StringIO()
         # Craft an FTP command that can pull the file
         cmd = 'RETR %s' % path
+        # Issue the command and catch the data in our buffer file object.
+        ftp.retrbinary(cmd, buffer_.write)
+        # Rewind the buffer and hand it over as is, rather than making a
+        # second copy of everything in it
+        buffer_.seek(0)
+        return buffer_
+
+    def _retrieve_data(self, ftp, path, size=None):
+        """
+        Download a file over the provided FTP connection.
+
+        If you provide the size of the file, the data is written straight
+        into a bytearray allocated to fit it, so it's only ever held in
+        memory once.
+
+        Returns the bytearray.
+        """
+        data = bytearray(size or 0)
+        received = [0]
+
+        def write(chunk):
+            start = received[0]
+            received[0] = start + len(chunk)
+            # Copy the chunk into place. If the file turns out to be bigger
+            # than we were told, this grows the array to fit.
+            data[start:received[0]] = chunk
+
+        ftp.retrbinary('RETR %s' % path, write)
+        # Trim off any room left over if the file came in smaller
+        del data[received[0]:]
+        return data
+
+    def _stat(self, ftp, path):
+        """
+        Asks the FTP when a file was last modified and how big it is.
+
+        Returns a (modified, size) tuple, or (None, None) if the server
+        doesn't support the MDTM and SIZE commands.
+        """
+        try:
+            modified = ftp.sendcmd('MDTM %s' % path)[4:].strip()
+            # SIZE only counts bytes correctly in binary mode
+            ftp.voidcmd('TYPE I')
+            size = ftp.size(path)
+        except error_perm, e:
+            # A missing file is still an error
+            if str(e).startswith('550'):
+                raise
+            return None, None
+        return modified, size
+
+    def _retrieve_entry(self, ftp, path):
+        """
+        Download a file over the provided FTP connection, unless the copy
+        in our cache, or on disk, is still current.
+
+        Returns a CacheEntry.
+        """
+        modified, size = self._stat(ftp, path)
+        entry = self.cache.get(path, modified, size)
+        if entry is None and self.disk_cache is not None:
+            entry = self.disk_cache.get(path, modified, size)
+            if entry is not None:
+                entry = self.cache.set(path, modified, size, entry.data)
+        if entry is not None:
+            self.cache.record(path, skipped=True, size=len(entry.data))
+            return entry
+        data = self._retrieve_data(ftp, path, size)
+        self.cache.record(path, skipped=False, size=len(data))
+        if self.disk_cache is not None:
+            self.disk_cache.set(path, modified, size, data)
+        return self.cache.set(path, modified, size, data)
+
+    def _download(self, ftp, path):
+        """
+        Download a file over the provided FTP connection in whatever form
+        our fetching mode calls for.
+
+        Returns a CacheEntry if we're fetching conditionally, otherwise a
+        file object.
+        """
+        if self.conditional:
+            return self._retrieve_entry(ftp, path)
+        return self._retrieve(ftp, path)
+
+    def _fetch(self, path):
+        """
+        Fetch a file from the AP FTP.
+
+        Provide a path, get back a file obj with your data.
+        """
+        if self.conditional:
+            return self._fetch_download(path).open()
+        return self._fetch_download(path)
+
+    def _iter_parsed(self, path, key, parse):
+        """
+        Fetch a file from the AP FTP and run it through a parser, which
+        takes an iterable of chunks and yields rows.
+
+        Returns an iterator over the rows. Unless the file has already been
+        downloaded, they are parsed while it's still coming in.
+
+        When we're fetching conditionally, the parsed rows are cached with the
+        file under the provided key, so an unchanged file is never parsed
+        twice. Rows parsed with a key of None aren't cached.
+        """
+        if self.conditional:
+            entry = self._fetch_download(path)
+            if key is None:
+                return parse(iter_chunks(entry.open()))
+            try:
+                rows = entry.parsed[key]
+            except KeyError:
+                rows = entry.parsed[key] = list(
+                    parse(iter_chunks(entry.open()))
+                )
+            return iter(rows)
+        if path in self._prefetched:
+            return parse(iter_chunks(self._prefetched.pop(path)))
+        return parse(self._iter_stream(path))
+
+    def _fetch_download(self, path):
+        """
+        Hands over a download of the provided path, either from the files
+        we've already downloaded or by going to the FTP.
+        """
+        # If it's already been downloaded, hand that over
+        if path in self._prefetched:
+            return self._prefetched.pop(path)
+        # Whether we were already holding on to a connection, rather than
+        # borrowing one just for this
+        held = self._ftp is not None
         # Connect to the FTP server, issue the command and catch the data
-        # in our buffer file object.
         try:
-            self.ftp.retrbinary(cmd, buffer_.write)
+            try:
+                return self._download(self.ftp, path)
+            except connection_errors:
+                # The server may have hung up on a connection while it sat
+                # in the pool, so try once more with a fresh login
+                if self._ftp is not None:
+                    self.pool.release(self._ftp, discard=True)
+                    self._ftp = None
+                self._ftp = self._acquire(fresh=True)
+                return self._download(self._ftp, path)
         except Exception, e:
-            if "550 The system cannot find the" in e.message:
-                raise FileDoesNotExistError(
-                    "The file you've requested does not exist." +
-                    " If you're looking for data about a state, make sure" +
-                    " you input valid postal codes. If you're looking" +
-                    " for a date, make sure it's correct."
-                )
-            elif "530 User cannot log in" in e.message:
-                raise BadCredentialsError(
-                    "The username and password you submitted" +
-                    " are not accepted by the AP's FTP."
-                )
-            else:
-                raise e
-        # Return the file object
-        return StringIO(buffer_.getvalue())
+            raise self._handle_error(e)
+        finally:
+            # Give back a connection we only borrowed for this, so it isn't
+            # kept out of the pool until someone thinks to close us
+            if not held:
+                self.close()
+
+    def _iter_stream(self, path, blocksize=8192):
+        """
+        Download a file from the AP FTP, yielding each chunk as soon as it
+        arrives.
+
+        The download borrows a connection of its own from the pool, so more
+        than one can be under way at once. If the connection turns out to
+        be dead before anything has arrived, it's tried once more with a
+        fresh login.
+        """
+        pool = self.pool
+        fresh = False
+        while True:
+            try:
+                ftp = self._acquire(fresh)
+            except Exception, e:
+                raise self._translate_error(e)
+            # Whether the connection can be used again when we're done, and
+            # whether any of the file has been handed over yet
+            healthy = False
+            started = False
+            try:
+                ftp.voidcmd('TYPE I')
+                conn = ftp.transfercmd('RETR %s' % path)
+                try:
+                    while True:
+                        chunk = conn.recv(blocksize)
+                        if not chunk:
+                            break
+                        started = True
+                        yield chunk
+                finally:
+                    conn.close()
+                ftp.voidresp()
+                healthy = True
+                return
+            except connection_errors, e:
+                if fresh or started:
+                    raise self._translate_error(e)
+                fresh = True
+            except Exception, e:
+                healthy = isinstance(e, error_perm)
+                raise self._translate_error(e)
+            finally:
+                # A download that broke off, or was abandoned halfway,
+                # leaves the connection in no state to be reused
+                pool.release(ftp, discard=not healthy)
+
+    def _handle_error(self, e):
+        """
+        Cleans up after an error talking to the FTP and returns the error
+        that should be raised.
+        """
+        # Don't hang on to a connection that's broken
+        if self._ftp is not None and not isinstance(e, error_perm):
+            self.pool.release(self._ftp, discard=True)
+            self._ftp = None
+        return self._translate_error(e)
+
+    def _prefetch(self, paths):
+        """
+        Download a list of files at the same time, each over its own
+        connection, up to the limit set by `self.connections`.
+
+        The results are stashed away for `_fetch` to hand out later.
+        """
+        queue = Queue.Queue()
+        for path in paths:
+            queue.put(path)
+        errors = {}
+        pool = self.pool
+
+        def worker():
+            ftp = None
+            try:
+                while True:
+                    try:
+                        path = queue.get_nowait()
+                    except Queue.Empty:
+                        return
+                    try:
+                        if ftp is None:
+                            ftp = self._acquire()
+                        try:
+                            self._prefetched[path] = self._download(ftp, path)
+                        except connection_errors:
+                            # Try once more with a fresh login, in case the
+                            # server hung up on this one while it was idle
+                            pool.release(ftp, discard=True)
+                            ftp = None
+                            ftp = self._acquire(fresh=True)
+                            self._prefetched[path] = self._download(ftp, path)
+                    except Exception, e:
+                        errors[path] = e
+                        if ftp is not None and not isinstance(e, error_perm):
+                            pool.release(ftp, discard=True)
+                            ftp = None
+            finally:
+                if ftp is not None:
+                    pool.release(ftp)
+
+        # Start up our workers and wait for them to finish
+        threads = [
+            threading.Thread(target=worker)
+            for i in range(min(self.connections, len(paths)))
+        ]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+
+        # Raise the first error in the order the files were requested
+        for path in paths:
+            if path in errors:
+                self._prefetched.clear()
+                raise self._translate_error(errors[path])
+
+    def _iter_csv(self, path, delimiter="|", fieldnames=None):
+        """
+        Fetch a pipe delimited file from the AP FTP.
+
+        Provide the path of the file you want.
+
+        Yields dictionaries that are ready to roll, one row at a time.
+        """
+        key = ('csv', delimiter, tuple(fieldnames or ()))
+        return self._iter_parsed(
+            path,
+            key,
+            lambda chunks: iter_csv(
+                chunks,
+                delimiter,
+                fieldnames,
+                interner=self.interner
+            )
+        )
 
     def _fetch_csv(self, path, delimiter="|", fieldnames=None):
         """
@@ -133,14 +753,7 @@ Try submitting it in YYYY-MM-DD format."
 
         Returns a list of dictionaries that's ready to roll.
         """
-        # Fetch the data and stuff it in a CSV DictReaddr
-        reader = csv.DictReader(
-            self._fetch(path),
-            delimiter=delimiter,
-            fieldnames=fieldnames
-        )
-        # Clean up the keys and values, since AP provides them a little messy
-        return [self._strip_dict(i) for i in reader]
+        return list(self._iter_csv(path, delimiter, fieldnames))
 
     def _strip_dict(self, d):
         """
@@ -148,18 +761,25 @@ Try submitting it in YYYY-MM-DD format."
 
         This problem is common to the AP's CSV files
         """
-        return dict(
-            (k.strip(), v.strip()) for k, v in d.items()
-            if k is not None and v is not None
-        )
+        return strip_dict(d)
 
-    def _fetch_flatfile(self, path, basicfields, candidatefields):
+    def _iter_flatfile(
+        self,
+        path,
+        basicfields,
+        candidatefields,
+        records=False,
+        fields=None,
+        converters=None,
+        intern_strings=True,
+        changes=None
+    ):
         """
         Retrive, parse and structure one of the AP's flatfiles.
 
-        Returns a list of dictionaries with the standard "basicfields" as
-        top-level keys and then a `candidates` key that contains a nested dict
-        with the candidate data inside.
+        Yields dictionaries with the standard "basicfields" as top-level keys
+        and then a `candidates` key that contains a nested dict with the
+        candidate data inside, one row at a time.
 
         AP's flatfiles are delimited by ";", do not include headers and include
         a dynamic number of fields depending on the number of candidates in the
@@ -171,37 +791,48 @@ Try submitting it in YYYY-MM-DD format."
             * The list of basic fields that start each row
             * The list of candidate fields that will repeat outwards to right
               for each candidate in the data set.
+            * Optionally, whether you'd like FlatfileRecord objects rather
+              than dictionaries.
+            * Optionally, a list of the only fields you need.
+            * Optionally, a dictionary of functions to convert the values of
+              particular fields.
+            * Optionally, whether to intern the strings, which rows that
+              won't be kept around can do without.
+            * Optionally, a LineHashes to skip the lines that haven't
+              changed since it last saw them. Rows parsed this way depend
+              on what came before, so they aren't cached.
         """
-        # Fetch the data and toss it in a CSV reader
-        reader = csv.reader(
-            self._fetch(path),
-            delimiter=";",
+        if records:
+            parser_class = FlatfileRecordParser
+        else:
+            parser_class = FlatfileParser
+        parser = parser_class(
+            basicfields,
+            candidatefields,
+            fields=fields,
+            converters=converters,
+            interner=self.interner if intern_strings else None,
+            changes=changes
         )
-        raw_data = list(reader)
-        # Loop thorugh the raw data...
-        prepped_data = []
-        for row in raw_data:
-            # Slice off the last field since it's always empty
-            row = row[:-1]
-            # Split out the basic fields
-            basic_data = row[:len(basicfields)]
-            # Load them into a new dictionary with the proper keys
-            prepped_dict = dict(
-                (basicfields[i], v) for i, v in enumerate(basic_data)
-            )
-            # Split out all the candidate sets that come after the basic fields
-            candidate_data = row[len(basicfields):]
-            candidate_sets = self._split_list(
-                candidate_data, len(candidatefields)
-            )
-            # Load candidate data into a list of dicts with the proper keys
-            prepped_dict['candidates'] = [
-                dict((candidatefields[i], v) for i, v in enumerate(cand))
-                for cand in candidate_sets
-            ]
-            prepped_data.append(prepped_dict)
-        # Pass it all out
-        return prepped_data
+        if changes is not None:
+            return self._iter_parsed(path, None, parser.iter_rows)
+        key = (
+            'flat',
+            tuple(basicfields),
+            tuple(candidatefields),
+            records,
+            fields and tuple(fields),
+            converters and tuple(sorted(converters.items())),
+        )
+        return self._iter_parsed(path, key, parser.iter_rows)
+
+    def _fetch_flatfile(self, path, basicfields, candidatefields):
+        """
+        Retrive, parse and structure one of the AP's flatfiles.
+
+        Returns a list of dictionaries, as yielded by `_iter_flatfile`.
+        """
+        return list(self._iter_flatfile(path, basicfields, candidatefields))
 
     def _split_list(self, iterable, n, fillvalue=None):
         """
@@ -220,8 +851,7 @@ Try submitting it in YYYY-MM-DD format."
         Derived from a snippet published by Stephan202
         http://stackoverflow.com/a/1625013
         """
-        args = [iter(iterable)] * n
-        return list(itertools.izip_longest(*args, fillvalue=fillvalue))
+        return split_list(iterable, n, fillvalue=fillvalue)
 
     @property
     def races(self):
@@ -245,14 +875,20 @@ Try submitting it in YYYY-MM-DD format."
         that match. Works an AND query and returns anything that matches
         all of the provided kwargs.
 
+        Attribute names can be followed by a Django-style lookup, like
+        `statepostal__in`, `officename__startswith`, `seatnum__gte` or
+        `uncontested__ne`. The full list is in `elections.query.LOOKUPS`.
+
+        Attributes listed in `race_index_fields` are looked up in hash
+        indexes rather than checked race by race.
+
         ex:
             >>> iowa.filter_races(office_name='President', party='GOP')
             [<Race: President>]
+            >>> us.filter_races(statepostal__in=['IA', 'NH'], party='Dem')
+            [<Race: President>, <Race: President>]
         """
-        races = self.races
-        for k in kwargs.keys():
-            races = filter(lambda x: getattr(x, k) == kwargs[k], races)
-        return races
+        return self._race_index.filter(**kwargs)
 
     @property
     def reporting_units(self):
@@ -261,15 +897,43 @@ Try submitting it in YYYY-MM-DD format."
         """
         return self._reporting_units.values()
 
-    def get_reporting_unit(self, fips):
+    def get_reporting_unit(self, fips, race=None):
         """
-        Get a single ReportinUnit
+        Get a single ReportinUnit by its key.
+
+        Every race has its own copy of a reporting unit, so provide the race,
+        or its ap_race_number, to get the right one. Without it you get the
+        copy belonging to the last race loaded in the state.
         """
         try:
-            return self._reporting_units[fips]
+            if race is None:
+                return self._reporting_units_by_key[fips][-1]
+            if not isinstance(race, basestring):
+                race = race.ap_race_number
+            return self._reporting_units[(race, fips)]
         except KeyError:
             raise KeyError("The reporting unit you requested does not exist.")
 
+    def get_reporting_units(self, race):
+        """
+        Get all of the ReportingUnit objects for a race, or an
+        ap_race_number.
+        """
+        if isinstance(race, basestring):
+            race = self.get_race(race)
+        return list(race.reportingunits)
+
+    def filter_reporting_units(self, **kwargs):
+        """
+        Takes a series of keyword arguments and returns any ReportingUnit
+        objects that match all of them. Supports the same lookups as
+        `filter_races`.
+
+        ex:
+            >>> iowa.filter_reporting_units(level='subunit', votecount__gt=0)
+        """
+        return self._reporting_unit_index.filter(**kwargs)
+
     @property
     def candidates(self):
         """
@@ -291,12 +955,219 @@ Try submitting it in YYYY-MM-DD format."
         """
         Get all results
         """
+        if self.columnar:
+            return self._result_store.get()
         return self._results.values()
 
     @property
     def candidate_reporting_units(self):
         return self.results
 
+    def get_results(self, race=None, reporting_unit=None, candidate=None):
+        """
+        Returns the CandidateReportingUnit objects for a race, reporting
+        unit or candidate, or any combination of them, without looking
+        through the rest of the election's results.
+
+        Each can be provided as the object or its key: the race's
+        `ap_race_number`, the reporting unit's `key` or the candidate's
+        `candidateid`. A reporting unit's key is shared by every race in
+        the state, but the object belongs to one race, so passing the
+        object without a race gets that race's results.
+
+        ex:
+            >>> iowa.get_results(race='16957-IA', reporting_unit='Polk5')
+            [<CandidateReportingUnit: ...>, ...]
+        """
+        if race is not None and not isinstance(race, basestring):
+            race = race.ap_race_number
+        if (reporting_unit is not None and
+                not isinstance(reporting_unit, basestring)):
+            if race is None:
+                race = reporting_unit.ap_race_number
+            reporting_unit = reporting_unit.key
+        if candidate is not None and not isinstance(candidate, basestring):
+            candidate = candidate.candidateid
+        return self._result_store.get(race, reporting_unit, candidate)
+
+    def filter_results(self, **kwargs):
+        """
+        Takes a series of keyword arguments and returns any
+        CandidateReportingUnit objects that match all of them. Supports the
+        same lookups as `filter_races`.
+
+        ex:
+            >>> iowa.filter_results(level='state', last__in=['Cruz', 'Rubio'])
+        """
+        return self._result_index.filter(**kwargs)
+
+    def refresh(self):
+        """
+        Downloads the results file again and brings the results and
+        reporting units we already have up to date.
+
+        They're updated in place, so anything holding on to them sees the
+        new numbers. The race, reporting unit and candidate files aren't
+        downloaded again.
+
+        Returns a dictionary counting the lines read, how many of them had
+        changed and hadn't, the results and reporting units that changed and
+        the results that are new. Only the changed lines are decoded, unless
+        the Election was made with `detect_changes=False`.
+
+        What changed is under `changes`, as a ChangeSet of VoteChange,
+        PrecinctChange, NewWinner and NewReportingUnit objects. Any
+        callbacks registered with `on_race_called`, `on_votes_changed` or
+        `on_precincts_changed` are called with them before this returns.
+        Any errors they raise are logged and listed in the ChangeSet's
+        `errors` rather than raised.
+
+        If something goes wrong partway through the file, whatever was
+        updated before it is still published and passed to the callbacks
+        before the error is raised.
+
+        ex:
+            >>> iowa.refresh()
+            {'lines': 100, 'changed_lines': 3, 'unchanged_lines': 97,
+             'results': 12, 'reporting_units': 3, 'added': 0,
+             'changes': <ChangeSet: 16 changes>}
+            >>> [c.candidate.last for c in _['changes'].winners]
+            ['Cruz']
+        """
+        with self.lock:
+            # Whether there were any results before, which is also how
+            # _load_results decides whether to look for changes
+            refreshing = len(self._result_store) > 0
+            summary = self._results_summary()
+            try:
+                self._get_results(summary)
+            except Exception:
+                error = sys.exc_info()
+                # The lines that were applied won't look changed next time,
+                # so this is the only chance to pass them on
+                self._announce(summary, refreshing)
+                raise error[0], error[1], error[2]
+            finally:
+                self.close()
+            self._announce(summary, refreshing)
+            return summary
+
+    def snapshot(self):
+        """
+        Returns the latest Snapshot of the races, reporting units and
+        results, which won't change as the Election is refreshed.
+
+        The first call makes one. After that, each refresh that changes
+        anything publishes a new version, made from copies of the races
+        that changed and sharing the rest with the version before. Reading
+        the latest version doesn't take any locks, and an old version is
+        thrown away once nobody is holding on to it.
+
+        ex:
+            >>> pinned = iowa.snapshot()
+            >>> pinned.get_results(race='16957-IA', reporting_unit='Polk5')
+            [<CandidateReportingUnit: ...>, ...]
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self.lock:
+                if self._snapshot is None:
+                    self._snapshot = Snapshot(
+                        1,
+                        [self._race_state(race) for race in self.races]
+                    )
+                snapshot = self._snapshot
+        return snapshot
+
+    def on_race_called(self, callback):
+        """
+        Registers a function to be called after each refresh for every race
+        with newly declared winners. It's passed the race and a list of its
+        NewWinner changes.
+
+        Returns the function, so this works as a decorator.
+        """
+        self._callbacks['race_called'].append(callback)
+        return callback
+
+    def on_votes_changed(self, callback):
+        """
+        Registers a function to be called after each refresh for every race
+        whose vote counts changed. It's passed the race and a list of its
+        VoteChange changes.
+
+        Returns the function, so this works as a decorator.
+        """
+        self._callbacks['votes_changed'].append(callback)
+        return callback
+
+    def on_precincts_changed(self, callback):
+        """
+        Registers a function to be called after each refresh for every race
+        with reporting units whose precincts reporting changed. It's passed
+        the race and a list of its PrecinctChange changes, which have the
+        reporting units.
+
+        Returns the function, so this works as a decorator.
+        """
+        self._callbacks['precincts_changed'].append(callback)
+        return callback
+
+    def poll(self, interval=60):
+        """
+        Starts refreshing on a background thread every `interval` seconds.
+        Returns the Poller, which you can iterate over to wait for each
+        refresh's ChangeSet.
+
+        ex:
+            >>> for changes in iowa.poll(30):
+            ...     print changes.winners
+        """
+        return Poller(self, interval).start()
+
+    def iter_race_rows(self):
+        """
+        Yields the rows of the race initialization file one at a time.
+        """
+        return self._iter_csv(self.race_file_path)
+
+    def iter_reporting_unit_rows(self):
+        """
+        Yields the rows of the reporting unit initialization file one at a
+        time.
+        """
+        return self._iter_csv(self.reporting_unit_file_path)
+
+    def iter_candidate_rows(self):
+        """
+        Yields the rows of the candidate initialization file one at a time.
+        """
+        return self._iter_csv(self.candidate_file_path)
+
+    def iter_results_rows(self, records=False, fields=None, converters=None):
+        """
+        Yields the rows of the results flatfile one at a time, as they're
+        downloaded.
+
+        Each row is a dictionary of the `results_basic_fields` with a
+        `candidates` list of dictionaries of the `results_candidate_fields`.
+
+        If `records` is set to True, the rows are FlatfileRecord objects
+        instead, which are much quicker to parse.
+
+        If you provide a list of `fields`, only those are pulled out of each
+        row. You can also provide a dictionary of `converters`, like
+        {'vote_count': int}, to change the type of fields as they're parsed.
+        """
+        return self._iter_flatfile(
+            self.results_file_path,
+            self.results_basic_fields,
+            self.results_candidate_fields,
+            records=records,
+            fields=fields,
+            converters=converters
+        )
+
     #
     # Private methods
     #
@@ -305,10 +1176,8 @@ Try submitting it in YYYY-MM-DD format."
         """
         Download all the races in the state and load the data.
         """
-        # Get the data
-        row_list = self._fetch_csv(self.race_file_path)
-        # Loop through it all
-        for row in row_list:
+        # Loop through the data as it comes in
+        for row in self.iter_race_rows():
             # Create a Race object...
             obj = Race(
                 electiondate=row['el_date'],
@@ -341,15 +1210,22 @@ Try submitting it in YYYY-MM-DD format."
             # And add it to the global store
             self._races[obj.ap_race_number] = obj
 
+        # The races have changed, so the query indexes are out of date
+        self._race_index.invalidate()
+
+        # Index the races by state so the reporting units can find theirs
+        # without scanning every race
+        self._races_by_state = {}
+        for race in self.races:
+            self._races_by_state.setdefault(race.statepostal, []).append(race)
+
     def _init_reporting_units(self):
         """
         Download all the reporting units and load the data.
         """
-        # Get the data
-        row_list = self._fetch_csv(self.reporting_unit_file_path)
-        # Loop through them all
-        for row in row_list:
-            race_list = self.filter_races(statepostal=row['st_postal'])
+        # Loop through them all as they come in
+        for row in self.iter_reporting_unit_rows():
+            race_list = self._races_by_state.get(row['st_postal'], [])
             # Create ReportingUnit objects for each race
             for race in race_list:
                 obj = ReportingUnit(
@@ -382,21 +1258,28 @@ Try submitting it in YYYY-MM-DD format."
 
                 # Add them to global store using a custom
                 # key we create here on-the-fly because
-                # we'll need it elsewhere
+                # we'll need it elsewhere, alongside the race's
                 obj.key = "%s%s" % (row['ru_name'], row['ru_number'])
-                self._reporting_units[obj.key] = obj
+                obj.ap_race_number = race.ap_race_number
+                self._reporting_units[(race.ap_race_number, obj.key)] = obj
+                self._reporting_units_by_key.setdefault(
+                    obj.key,
+                    []
+                ).append(obj)
 
                 # Add them to the race object
                 race.reportingunits.append(obj)
 
+        # The reporting units have changed, so the query indexes are out of
+        # date
+        self._reporting_unit_index.invalidate()
+
     def _init_candidates(self):
         """
         Download the state's candidate file and load the data.
         """
-        # Fetch the data from the FTP
-        row_list = self._fetch_csv(self.candidate_file_path)
-        # Loop through it...
-        for row in row_list:
+        # Loop through the data as it comes in from the FTP...
+        for row in self.iter_candidate_rows():
             # Create a Candidate...
             obj = Candidate(
                 ballotorder=row['polra_in_order'],
@@ -420,149 +1303,671 @@ Try submitting it in YYYY-MM-DD format."
             # Add the candidate to the global store
             self._candidates[obj.candidateid] = obj
 
-    def _get_results(self, ftp=None):
+    def _make_result(
+        self,
+        race,
+        reporting_unit,
+        candidate,
+        is_test,
+        incumbent,
+        vote_count,
+        votes_total,
+        is_winner,
+        precincts_reporting,
+        precincts_total,
+        votepct=None,
+        precinctsreportingpct=None
+    ):
         """
-        Download, parse and structure the state and county votes totals.
+        Creates the CandidateReportingUnit for a candidate's votes in a
+        reporting unit.
+
+        The percentages are calculated unless they're provided.
         """
-        # Download the data
-        flat_list = self._fetch_flatfile(
-            self.results_file_path,
-            [
-                # First the basic fields that will the same in each row
-                'test',
-                'election_date',
-                'state_postal',
-                'county_number',
-                'fips',
-                'county_name',
-                'race_number',
-                'office_id',
-                'race_type_id',
-                'seat_number',
-                'office_name',
-                'seat_name',
-                'race_type_party',
-                'race_type',
-                'office_description',
-                'number_of_winners',
-                'number_in_runoff',
-                'precincts_reporting',
-                'total_precincts',
-            ],
-            [
-                # Then the candidate fields that will repeat after the basics
-                'candidate_number',
-                'order',
-                'party',
-                'first_name',
-                'middle_name',
-                'last_name',
-                'junior',
-                'use_junior',
-                'incumbent',
-                'vote_count',
-                'is_winner',
-                'national_politician_id',
-            ]
+        if votepct is None:
+            votepct = calculate.percentage(
+                vote_count,
+                votes_total,
+                multiply=False
+            ) or 0.0
+        if precinctsreportingpct is None:
+            precinctsreportingpct = calculate.percentage(
+                precincts_reporting,
+                precincts_total,
+                multiply=True
+            ) or 0.0
+        if self.flyweight:
+            return FlyweightResult(
+                race,
+                candidate,
+                reporting_unit,
+                is_test,
+                incumbent,
+                vote_count,
+                votepct,
+                is_winner,
+                precincts_reporting,
+                precincts_total,
+                precinctsreportingpct,
+            )
+
+        cru = CandidateReportingUnit(
+            test=is_test,
+            initialization_data=False,
+            lastupdated=None,
+            # Race
+            electiondate=race.electiondate,
+            raceid=race.raceid,
+            statepostal=race.statepostal,
+            statename=race.statename,
+            racetype=race.racetype,
+            racetypeid=race.racetypeid,
+            officeid=race.officeid,
+            officename=race.officename,
+            seatname=race.seatname,
+            description=race.description,
+            seatnum=race.seatnum,
+            national=race.national,
+            is_ballot_measure=None,
+            uncontested=race.uncontested,
+            # Candidate
+            first=candidate.first,
+            last=candidate.last,
+            party=candidate.party,
+            candidateID=candidate.candidateid,
+            polID=candidate.polid,
+            polNum=candidate.polnum,
+            incumbent=incumbent,
+            ballotOrder=candidate.ballotorder,
+            # Results
+            voteCount=vote_count,
+            votePct=votepct,
+            winner=is_winner,
+            # Reporting unit
+            level=reporting_unit.level,
+            reportingunitname=reporting_unit.reportingunitname,
+            reportingunitid=reporting_unit.reportingunitid,
+            fipscode=reporting_unit.fipscode,
+            precinctsreporting=precincts_reporting,
+            precinctstotal=precincts_total,
+            precinctsreportingpct=precinctsreportingpct,
         )
+        cru.key = "%s%s%s" % (
+            race.raceid,
+            reporting_unit.key,
+            candidate.candidateid,
+        )
+        return cru
 
-        # Figure out if we're dealing with test data or the real thing
-        is_test = flat_list[0]['test'] == 't'
+    def _update_result(
+        self,
+        result,
+        vote_count,
+        votepct,
+        is_winner,
+        precincts_reporting,
+        precincts_total,
+        precinctsreportingpct
+    ):
+        """
+        Brings a result up to date with a new line of the results file, in
+        place. If anything changed, returns a tuple of the old values of
+        `result_update_fields`, otherwise None.
+        """
+        values = (
+            vote_count,
+            votepct,
+            # AP flags winners with an "X" and runoffs with an "R"
+            is_winner == 'X',
+            is_winner == 'R',
+            precincts_reporting,
+            precincts_total,
+            precinctsreportingpct,
+        )
+        names = self.result_update_fields
+        old = tuple(getattr(result, name) for name in names)
+        if old == values:
+            return None
+        for name, value in zip(names, values):
+            setattr(result, name, value)
+        return old
+
+    def _race_state(self, race, previous=None, changed=()):
+        """
+        Copies a race's reporting units and results into a RaceState.
 
-        # Start looping through the lines...
-        for row in flat_list:
+        Provide the race's previous RaceState and the keys of the reporting
+        units that changed since, and the others are shared with it rather
+        than copied.
+        """
+        units = []
+        for unit in self.get_reporting_units(race):
+            if previous is not None and unit.key not in changed:
+                pair = previous.get_unit(unit.key)
+                if pair is not None:
+                    units.append(pair)
+                    continue
+            results = self.get_results(race=race, reporting_unit=unit)
+            # Columnar results are built fresh each time, so they're ours
+            # already
+            if not self.columnar or self.lazy:
+                results = map(copy.copy, results)
+            units.append((copy.copy(unit), tuple(results)))
+        return RaceState(race, units)
+
+    def _publish(self, touched):
+        """
+        Makes the next Snapshot from new copies of the provided (race,
+        reporting unit) pairs, sharing everything else with the last one,
+        and makes it the latest.
+        """
+        if not touched:
+            return
+        snapshot = self._snapshot
+        races = []
+        changed = {}
+        for race, unit in touched:
+            if race.ap_race_number not in changed:
+                races.append(race)
+                changed[race.ap_race_number] = set()
+            changed[race.ap_race_number].add(unit.key)
+        states = [
+            self._race_state(
+                race,
+                snapshot.state(race.ap_race_number),
+                changed[race.ap_race_number]
+            )
+            for race in races
+        ]
+        # A single assignment, so readers see the old version or the new
+        # one and nothing in between
+        self._snapshot = snapshot.evolve(states)
 
-            # Get the race, with a special case for the presidential race
-            ap_race_number = self.ap_number_template % ({
-                'number': row['race_number'],
-                'state': row['state_postal']
-            })
-            race = self.get_race(ap_race_number)
+    def _announce(self, summary, refreshing):
+        """
+        Publishes a new Snapshot, if anyone has asked for one, and calls
+        the callbacks with what a pass over the results file changed.
+        """
+        if self._snapshot is not None:
+            if refreshing:
+                self._publish(summary['changes'].touched)
+            elif summary['lines']:
+                # The snapshot was made before there were any results, so
+                # there's nothing to share with it
+                self._snapshot = self._snapshot.evolve(
+                    [self._race_state(race) for race in self.races]
+                )
+        self._dispatch(summary['changes'])
 
-            # Pull the reporting unit
-            ru_key = "%s%s" % (row['county_name'], row['county_number'])
-            reporting_unit = self.get_reporting_unit(ru_key)
+    def _dispatch(self, changes):
+        """
+        Calls the registered callbacks with a ChangeSet's changes, once per
+        race for each kind rather than once per change.
 
-            # Total the votes
-            votes_total = sum(
-                [int(o['vote_count']) for o in row['candidates']]
-            )
+        An error raised by a callback is logged and added to the ChangeSet's
+        `errors`, and the rest of the callbacks are called all the same.
+        """
+        callbacks = {
+            NewWinner: self._callbacks['race_called'],
+            VoteChange: self._callbacks['votes_changed'],
+            PrecinctChange: self._callbacks['precincts_changed'],
+        }
+        if not any(callbacks.values()):
+            return
+        for kind, race, batch in changes.batches():
+            for callback in callbacks.get(kind, ()):
+                try:
+                    callback(race, batch)
+                except Exception, e:
+                    log.exception(
+                        "%r failed with the %s changes to %s",
+                        callback,
+                        kind.__name__,
+                        race.ap_race_number
+                    )
+                    changes.errors.append((callback, race, e))
+
+    def _note_changes(
+        self,
+        diff,
+        race,
+        reporting_unit,
+        number,
+        old_votes,
+        new_votes,
+        was_winner,
+        is_winner
+    ):
+        """
+        Adds the changes to a result, if there are any worth noting, to a
+        ChangeSet.
+        """
+        if old_votes != new_votes:
+            diff.add(VoteChange(
+                race,
+                reporting_unit,
+                self.get_candidate(number),
+                old_votes,
+                new_votes
+            ))
+        if is_winner == 'X' and not was_winner:
+            diff.add(NewWinner(
+                race,
+                reporting_unit,
+                self.get_candidate(number)
+            ))
+
+    def _extend_columns(
+        self,
+        row,
+        race,
+        reporting_unit,
+        ru_key,
+        votes_total,
+        refresh=False,
+        diff=None
+    ):
+        """
+        Adds the candidates in a line of the results file to the columnar
+        store.
 
-            # Loop through all the candidates
-            for candrow in row['candidates']:
-                # Skip it if the candidate is empty, as it sometimes is at
-                # the end of the row
-                if not candrow['candidate_number']:
+        When refreshing, candidates already in the store have their rows
+        updated instead. Returns a list of the rows that changed and the
+        number of rows added. The changes are noted in `diff`, if it's
+        provided.
+        """
+        store = self._result_store
+        numbers = row.candidate_values('candidate_number')
+        vote_counts = row.candidate_values('vote_count')
+        incumbents = row.candidate_values('incumbent')
+        winners = row.candidate_values('is_winner')
+        precincts_reporting = row['precincts_reporting']
+        precincts_total = row['total_precincts']
+
+        # Drop any empty candidates, as there sometimes are at the end of
+        # the row, and, when refreshing, any we already have
+        changed = []
+        keep = []
+        for i, number in enumerate(numbers):
+            if not number:
+                continue
+            if refresh:
+                r = store.find(race.ap_race_number, ru_key, number)
+                if r is not None:
+                    old = store.update(
+                        r,
+                        vote_counts[i],
+                        votes_total,
+                        winners[i],
+                        precincts_reporting,
+                        precincts_total
+                    )
+                    if old is not None:
+                        changed.append(r)
+                        if diff is not None:
+                            self._note_changes(
+                                diff,
+                                race,
+                                reporting_unit,
+                                number,
+                                old[0],
+                                vote_counts[i],
+                                old[2] == 'X',
+                                winners[i]
+                            )
                     continue
+            if diff is not None and winners[i] == 'X':
+                diff.add(NewWinner(
+                    race,
+                    reporting_unit,
+                    self.get_candidate(number)
+                ))
+            keep.append(i)
+        if len(keep) < len(numbers):
+            numbers = [numbers[i] for i in keep]
+            vote_counts = [vote_counts[i] for i in keep]
+            incumbents = [incumbents[i] for i in keep]
+            winners = [winners[i] for i in keep]
+        if numbers:
+            store.extend(
+                race,
+                reporting_unit,
+                map(self.get_candidate, numbers),
+                (race.ap_race_number, ru_key, numbers),
+                [i == '1' for i in incumbents],
+                vote_counts,
+                votes_total,
+                winners,
+                precincts_reporting,
+                precincts_total
+            )
+        return changed, len(numbers)
 
-                # Pull the existing candidate object
-                candidate = self.get_candidate(candrow["candidate_number"])
+    def _results_summary(self):
+        """
+        Returns an empty summary for `_get_results` to fill in.
+        """
+        return {
+            'lines': 0,
+            'results': 0,
+            'reporting_units': 0,
+            'added': 0,
+            'changes': ChangeSet(),
+        }
+
+    def _get_results(self, summary=None):
+        """
+        Download, parse and structure the state and county votes totals.
 
-                cru = CandidateReportingUnit(
-                    test=is_test,
-                    initialization_data=False,
-                    lastupdated=None,
-                    # Race
-                    electiondate=race.electiondate,
-                    raceid=race.raceid,
-                    statepostal=race.statepostal,
-                    statename=race.statename,
-                    racetype=race.racetype,
-                    racetypeid=race.racetypeid,
-                    officeid=race.officeid,
-                    officename=race.officename,
-                    seatname=race.seatname,
-                    description=race.description,
-                    seatnum=race.seatnum,
-                    national=race.national,
-                    is_ballot_measure=None,
-                    uncontested=race.uncontested,
-                    # Candidate
-                    first=candidate.first,
-                    last=candidate.last,
-                    party=candidate.party,
-                    candidateID=candidate.candidateid,
-                    polID=candidate.polid,
-                    polNum=candidate.polnum,
-                    incumbent=candrow['incumbent'] == '1',
-                    ballotOrder=candidate.ballotorder,
-                    # Results
-                    voteCount=int(candrow['vote_count']),
-                    votePct=calculate.percentage(
-                        int(candrow['vote_count']),
-                        votes_total,
-                        multiply=False
-                    ) or 0.0,
-                    winner=candrow['is_winner'],
-                    # Reporting unit
-                    level=reporting_unit.level,
-                    reportingunitname=reporting_unit.reportingunitname,
-                    reportingunitid=reporting_unit.reportingunitid,
-                    fipscode=reporting_unit.fipscode,
-                    precinctsreporting=int(row['precincts_reporting']),
-                    precinctstotal=int(row['total_precincts']),
-                    precinctsreportingpct=calculate.percentage(
-                        int(row['precincts_reporting']),
-                        int(row['total_precincts']),
-                        multiply=True
-                    ) or 0.0,
+        The lines are read in batches of `results_batch_lines`. The
+        percentages for each batch are worked out in one go, a column at a
+        time, before its results are built.
+
+        Results we already have are updated in place rather than built
+        again. If we're detecting changes, only the lines that have changed
+        since the file was last read are decoded.
+
+        Returns a dictionary counting the lines read, how many of them had
+        changed and hadn't, the results and reporting units that changed
+        and the results that were added. Under `changes` is a ChangeSet of
+        what changed, noted along the way. The first load has none.
+
+        The summary is filled in as the lines are read, so if you provide
+        one from `_results_summary`, it says what had been done if an error
+        cuts the pass short.
+        """
+        if summary is None:
+            summary = self._results_summary()
+        changes = self._line_hashes
+        if changes is None:
+            self._load_results(summary)
+            summary['changed_lines'] = summary['lines']
+            summary['unchanged_lines'] = 0
+            return summary
+        try:
+            self._load_results(summary, changes)
+        except Exception:
+            # Leave the hashes as they were, so the lines are read again
+            changes.rollback()
+            raise
+        summary['changed_lines'] = changes.changed
+        summary['unchanged_lines'] = changes.unchanged
+        summary['lines'] = changes.changed + changes.unchanged
+        changes.commit()
+        return summary
+
+    def _load_results(self, summary, changes=None):
+        """
+        Does the work of `_get_results`, filling in its summary and reading
+        only the lines that a LineHashes, if one is provided, says have
+        changed.
+        """
+        # Figure out if we're dealing with test data or the real thing
+        is_test = None
+
+        # Only look for existing results, and note changes to them, if
+        # there could be some
+        refreshing = len(self._result_store) > 0
+        diff = summary['changes'] if refreshing else None
+        # The ids of the reporting units that are new this time
+        new_units = set()
+        # The columnar rows that changed
+        changed_rows = []
+
+        # Each line's reporting unit and numbers, and each candidate's
+        # result, waiting on the percentages for the batch
+        units = []
+        pending = []
+
+        # Start looping through the lines as they're downloaded...
+        # The rows are thrown away once they're loaded, and the strings we
+        # keep come from the races, candidates and reporting units, so
+        # there's nothing worth interning
+        rows = self._iter_flatfile(
+            self.results_file_path,
+            self.results_basic_fields,
+            self.results_candidate_fields,
+            records=True,
+            fields=self.results_required_fields,
+            converters=self.results_converters,
+            intern_strings=False,
+            changes=changes
+        )
+        # Batches already applied stay applied if a later line fails, so
+        # their clean-up is done either way
+        try:
+            for row in rows:
+                if is_test is None:
+                    is_test = row['test'] == 't'
+                    if self.columnar:
+                        self._result_store.test = is_test
+                if len(units) == self.results_batch_lines:
+                    self._load_batch(
+                        units,
+                        pending,
+                        is_test,
+                        summary,
+                        diff,
+                        new_units
+                    )
+                    units = []
+                    pending = []
+
+                # Get the race, with a special case for the presidential race
+                ap_race_number = self.ap_number_template % ({
+                    'number': row['race_number'],
+                    'state': row['state_postal']
+                })
+                race = self.get_race(ap_race_number)
+
+                # Pull the reporting unit
+                ru_key = "%s%s" % (row['county_name'], row['county_number'])
+                reporting_unit = self.get_reporting_unit(ru_key, race=race)
+
+                # Read each of the candidate fields we need out of the row
+                candidate_numbers = row.candidate_values('candidate_number')
+                vote_counts = row.candidate_values('vote_count')
+                candidates = itertools.izip(
+                    candidate_numbers,
+                    vote_counts,
+                    row.candidate_values('incumbent'),
+                    row.candidate_values('is_winner'),
                 )
 
-                cru.key = "%s%s%s" % (
-                    race.raceid,
+                # The numbers come out of the parser as ints already
+                precincts_reporting = row['precincts_reporting']
+                precincts_total = row['total_precincts']
+
+                # Total the votes
+                votes_total = sum(vote_counts)
+
+                line = len(units)
+                units.append((
+                    reporting_unit,
+                    precincts_reporting,
+                    precincts_total,
+                    votes_total,
+                    race
+                ))
+                store = self._result_store
+                if (diff is not None and
+                        not store.has_reporting_unit(ap_race_number, ru_key)):
+                    diff.add(NewReportingUnit(race, reporting_unit))
+                    new_units.add(id(reporting_unit))
+
+                # In columnar mode, just keep the numbers, a row at a time
+                if self.columnar:
+                    changed, added = self._extend_columns(
+                        row,
+                        race,
+                        reporting_unit,
+                        ru_key,
+                        votes_total,
+                        refresh=refreshing,
+                        diff=diff
+                    )
+                    changed_rows.extend(changed)
+                    summary['added'] += added
+                    if diff is not None and (changed or added):
+                        diff.touch(race, reporting_unit)
+                    continue
+
+                # Loop through all the candidates
+                for number, vote_count, incumbent, is_winner in candidates:
+                    # Skip it if the candidate is empty, as it sometimes is at
+                    # the end of the row
+                    if not number:
+                        continue
+                    pending.append((
+                        line,
+                        race,
+                        ru_key,
+                        number,
+                        incumbent == '1',
+                        vote_count,
+                        is_winner,
+                    ))
+            self._load_batch(units, pending, is_test, summary, diff, new_units)
+        finally:
+            # Bring any columnar result objects that have been built up to date
+            if changed_rows:
+                store = self._result_store
+                vote_pcts, row_pcts = store.percentages()
+                for r in changed_rows:
+                    obj = store.cached(r)
+                    if obj is not None:
+                        self._update_result(
+                            obj,
+                            store.votecount[r],
+                            vote_pcts[r],
+                            store.winners.objects[store.winner[r]],
+                            store.precinctsreporting[r],
+                            store.precinctstotal[r],
+                            row_pcts[r]
+                        )
+                summary['results'] = len(changed_rows)
+
+            # The results have changed, so the query indexes are out of date
+            self._reporting_unit_index.invalidate()
+            self._result_index.invalidate()
+
+    def _load_batch(self, units, pending, is_test, summary, diff, new_units):
+        """
+        Works out the percentages for a batch of lines from the results
+        file, then builds their results, or brings the ones we have up to
+        date, and updates their reporting units.
+
+        Takes each line's (reporting unit, precincts reporting, precincts
+        total, votes total, race) and each candidate's (line, race, unit
+        key, candidate number, incumbent, votes, winner) waiting on them.
+        What it does is tallied in `_load_results`' summary, and if it's
+        refreshing, noted in the ChangeSet provided as `diff`.
+        """
+        refreshing = diff is not None
+        summary['lines'] += len(units)
+
+        # Work out the percentages for every line and candidate at once
+        precinct_pcts = percentages(
+            [u[1] for u in units],
+            [u[2] for u in units],
+            multiply=True
+        )
+        vote_pcts = percentages(
+            [p[5] for p in pending],
+            [units[p[0]][3] for p in pending],
+            multiply=False
+        )
+
+        # Build the results, or bring the ones we have up to date
+        for p, votepct in itertools.izip(pending, vote_pcts):
+            line, race, ru_key, number, incumbent, vote_count, is_winner = p
+            reporting_unit, precincts_reporting, precincts_total, \
+                votes_total = units[line][:4]
+            if refreshing:
+                cru = self._result_store.find(
+                    race.ap_race_number,
                     ru_key,
-                    candrow["candidate_number"],
+                    number
                 )
-                self._results[cru.key] = cru
-
-            # Update the reporting unit's precincts status
-            reporting_unit.precinctstotal = int(row['total_precincts'])
-            reporting_unit.precinctsreporting = int(row['precincts_reporting'])
-            reporting_unit.precinctsreportingpct = calculate.percentage(
-                reporting_unit.precinctsreporting,
+                if cru is not None:
+                    old = self._update_result(
+                        cru,
+                        vote_count,
+                        votepct,
+                        is_winner,
+                        precincts_reporting,
+                        precincts_total,
+                        precinct_pcts[line]
+                    )
+                    if old is not None:
+                        summary['results'] += 1
+                        diff.touch(race, reporting_unit)
+                        self._note_changes(
+                            diff,
+                            race,
+                            reporting_unit,
+                            number,
+                            old[0],
+                            vote_count,
+                            old[2],
+                            is_winner
+                        )
+                    continue
+                if is_winner == 'X':
+                    diff.add(NewWinner(
+                        race,
+                        reporting_unit,
+                        self.get_candidate(number)
+                    ))
+            cru = self._make_result(
+                race,
+                reporting_unit,
+                self.get_candidate(number),
+                is_test,
+                incumbent,
+                vote_count,
+                votes_total,
+                is_winner,
+                precincts_reporting,
+                precincts_total,
+                votepct,
+                precinct_pcts[line],
+            )
+            self._results[cru.key] = cru
+            self._result_store.add(
+                race.ap_race_number,
+                ru_key,
+                number,
+                cru
+            )
+            summary['added'] += 1
+            if diff is not None:
+                diff.touch(race, reporting_unit)
+
+        # Update the reporting units' precincts status
+        for unit, pct in itertools.izip(units, precinct_pcts):
+            reporting_unit, precincts_reporting, precincts_total, \
+                votes_total, race = unit
+            if (diff is not None and
+                    id(reporting_unit) not in new_units and
+                    reporting_unit.precinctsreporting != precincts_reporting):
+                diff.add(PrecinctChange(
+                    race,
+                    reporting_unit,
+                    reporting_unit.precinctsreporting,
+                    precincts_reporting
+                ))
+            if refreshing and (
                 reporting_unit.precinctstotal,
-                multiply=True
-            ) or 0.0
+                reporting_unit.precinctsreporting,
+                reporting_unit.precinctsreportingpct,
+                reporting_unit.votecount,
+            ) != (precincts_total, precincts_reporting, pct, votes_total):
+                summary['reporting_units'] += 1
+                diff.touch(race, reporting_unit)
+            reporting_unit.precinctstotal = precincts_total
+            reporting_unit.precinctsreporting = precincts_reporting
+            reporting_unit.precinctsreportingpct = pct
             reporting_unit.votecount = votes_total
 
 
@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Lightweight versions of the elex models, for elections with a lot of
+results.
+"""
+from operator import attrgetter
+from elex.api.models import CandidateReportingUnit
+
+
+def shared(path):
+    """
+    Returns a read-only property that looks up an attribute on one of the
+    objects a result shares, like "_race.officename".
+    """
+    return property(attrgetter(path), doc="The %s." % path.lstrip('_'))
+
+
+class FlyweightResult(CandidateReportingUnit):
+    """
+    A CandidateReportingUnit that holds references to its Race, Candidate
+    and ReportingUnit and reads the attributes it has in common with them
+    through properties, rather than keeping copies of its own.
+
+    Only the values that belong to the result itself, like its votes and
+    precincts, are stored on it, in slots. Everything a
+    CandidateReportingUnit has is still available, under the same names.
+    """
+    __slots__ = (
+        '_race',
+        '_candidate',
+        '_reporting_unit',
+        'test',
+        'incumbent',
+        'votecount',
+        'votepct',
+        'winner',
+        'runoff',
+        'precinctsreporting',
+        'precinctstotal',
+        'precinctsreportingpct',
+    )
+
+    # The same for every result
+    initialization_data = False
+    lastupdated = None
+    is_ballot_measure = None
+    delegatecount = 0
+    electtotal = 0
+    electwon = 0
+
+    # From the race
+    electiondate = shared('_race.electiondate')
+    raceid = shared('_race.raceid')
+    statepostal = shared('_race.statepostal')
+    statename = shared('_race.statename')
+    racetype = shared('_race.racetype')
+    racetypeid = shared('_race.racetypeid')
+    officeid = shared('_race.officeid')
+    officename = shared('_race.officename')
+    seatname = shared('_race.seatname')
+    description = shared('_race.description')
+    seatnum = shared('_race.seatnum')
+    national = shared('_race.national')
+    uncontested = shared('_race.uncontested')
+
+    # From the candidate
+    first = shared('_candidate.first')
+    last = shared('_candidate.last')
+    party = shared('_candidate.party')
+    candidateid = shared('_candidate.candidateid')
+    polnum = shared('_candidate.polnum')
+    ballotorder = shared('_candidate.ballotorder')
+
+    # From the reporting unit
+    level = shared('_reporting_unit.level')
+    reportingunitname = shared('_reporting_unit.reportingunitname')
+    reportingunitid = shared('_reporting_unit.reportingunitid')
+    fipscode = shared('_reporting_unit.fipscode')
+
+    def __init__(
+        self,
+        race,
+        candidate,
+        reporting_unit,
+        test,
+        incumbent,
+        votecount,
+        votepct,
+        winner,
+        precinctsreporting,
+        precinctstotal,
+        precinctsreportingpct
+    ):
+        self._race = race
+        self._candidate = candidate
+        self._reporting_unit = reporting_unit
+        self.test = test
+        self.incumbent = incumbent
+        self.votecount = votecount
+        self.votepct = votepct
+        # AP flags winners with an "X" and runoffs with an "R"
+        self.winner = winner == 'X'
+        self.runoff = winner == 'R'
+        self.precinctsreporting = precinctsreporting
+        self.precinctstotal = precinctstotal
+        self.precinctsreportingpct = precinctsreportingpct
+
+    @property
+    def polid(self):
+        polid = self._candidate.polid
+        if polid == "0":
+            return None
+        return polid
+
+    @property
+    def unique_id(self):
+        if self.polid:
+            return u'polid-%s' % self.polid
+        return u'polnum-%s' % self.polnum
+
+    @property
+    def id(self):
+        return u'%s-%s-%s' % (
+            self.raceid,
+            self.unique_id,
+            self.reportingunitid
+        )
+
+    @property
+    def key(self):
+        return "%s%s%s" % (
+            self.raceid,
+            self._reporting_unit.key,
+            self.candidateid
+        )
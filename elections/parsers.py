@@ -0,0 +1,603 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Parsers for the files published on the AP's FTP.
+
+They work incrementally, so data can be parsed a chunk at a time while it's
+still being downloaded.
+"""
+import csv
+import sys
+import itertools
+
+
+def split_list(iterable, n, fillvalue=None):
+    """
+    Splits the provided list into groups of n length.
+
+    You can optionally provide a value to be included if the last list
+    comes up short of the n value. By default it's none.
+
+    Example usage:
+
+        >>> split_list([1,2,3,4,5,6], 2)
+        [(1, 2), (3, 4), (5, 6)]
+        >>> split_list([1,2,3,4,5], 2, fillvalue="x")
+        [(1, 2), (3, 4), (5, "x")]
+
+    Derived from a snippet published by Stephan202
+    http://stackoverflow.com/a/1625013
+    """
+    args = [iter(iterable)] * n
+    return list(itertools.izip_longest(*args, fillvalue=fillvalue))
+
+
+def strip_dict(d):
+    """
+    Strip all leading and trailing whitespace in dictionary keys & values.
+
+    This problem is common to the AP's CSV files
+    """
+    return dict(
+        (k.strip(), v.strip()) for k, v in d.items()
+        if k is not None and v is not None
+    )
+
+
+def iter_chunks(f, blocksize=8192):
+    """
+    Reads a file object a chunk at a time.
+    """
+    return iter(lambda: f.read(blocksize), '')
+
+
+def split_line(line, delimiter=';', maxsplit=-1):
+    """
+    Splits a line of a flatfile into its fields, exactly as csv.reader
+    would.
+
+    The AP doesn't quote the fields in its flatfiles, so most of the time
+    this is a plain split, which is much quicker. A line with a quote in
+    it is handed to the csv module instead, and comes back split in full
+    whatever `maxsplit` says.
+    """
+    if '"' in line:
+        return next(csv.reader([line], delimiter=delimiter), [])
+    return line.split(delimiter, maxsplit)
+
+
+def iter_lines(chunks):
+    """
+    Takes an iterable of chunks and yields the lines inside them, without
+    their newlines.
+    """
+    splitter = LineSplitter()
+    for chunk in chunks:
+        for line in splitter.feed(chunk):
+            yield line
+    for line in splitter.close():
+        yield line
+
+
+def iter_csv(chunks, delimiter="|", fieldnames=None, interner=None):
+    """
+    Takes an iterable of chunks from one of the AP's delimited files and
+    yields a dictionary for each row, with the messy whitespace AP provides
+    stripped out.
+
+    If an Interner is provided, the keys and values are run through it.
+    """
+    reader = csv.DictReader(
+        iter_lines(chunks),
+        delimiter=delimiter,
+        fieldnames=fieldnames
+    )
+    for row in reader:
+        row = strip_dict(row)
+        if interner is not None:
+            row = dict(zip(
+                interner.many(row.keys()),
+                interner.many(row.values())
+            ))
+        yield row
+
+
+class Interner(object):
+    """
+    Hands back a single shared copy of each distinct string it's given, so
+    values that repeat throughout the AP's files only take up memory once.
+
+    Unlike the `intern` builtin, the table belongs to the Interner and goes
+    away with it. It also keeps count of how much it's saved.
+    """
+    def __init__(self):
+        self._table = {}
+        # How many strings we've been given, and how long they were
+        self.lookups = 0
+        self.length = 0
+
+    def __repr__(self):
+        return "<Interner: %s strings>" % len(self._table)
+
+    def __len__(self):
+        return len(self._table)
+
+    def __call__(self, value):
+        """
+        Returns the shared copy of a string.
+        """
+        self.lookups += 1
+        self.length += len(value)
+        return self._table.setdefault(value, value)
+
+    def many(self, values):
+        """
+        Returns a list of the shared copies of a list of strings.
+        """
+        self.lookups += len(values)
+        self.length += sum(map(len, values))
+        return map(self._table.setdefault, values, values)
+
+    def stats(self):
+        """
+        Returns a dictionary of how many strings we've been given, how many
+        were distinct and about how many bytes sharing them saved.
+        """
+        # What every string we were given would take on its own, less what
+        # the distinct ones take
+        overhead = sys.getsizeof('')
+        unique = len(self._table)
+        unique_length = sum(map(len, self._table))
+        return {
+            'lookups': self.lookups,
+            'unique': unique,
+            'shared': self.lookups - unique,
+            'bytes_saved': (
+                (self.length + self.lookups * overhead) -
+                (unique_length + unique * overhead)
+            ),
+        }
+
+
+class LineSplitter(object):
+    """
+    Breaks a stream of chunks into complete lines.
+
+    Whatever is left over after the last newline in a chunk is held on to
+    until the next chunk arrives to finish it.
+    """
+    def __init__(self):
+        self._partial = ''
+
+    def feed(self, chunk):
+        """
+        Takes the next chunk of data and returns a list of the lines it
+        completed, without their newlines.
+        """
+        lines = (self._partial + chunk).split('\n')
+        self._partial = lines.pop()
+        return lines
+
+    def close(self):
+        """
+        Returns whatever was left unfinished at the end of the stream as a
+        list of lines.
+        """
+        partial, self._partial = self._partial, ''
+        if partial:
+            return [partial]
+        return []
+
+
+class LineHashes(object):
+    """
+    Remembers a hash of each line of a flatfile, filed under the values of
+    the columns that identify it, so the next version of the file can be
+    cut down to the lines that changed before any of them are decoded.
+
+    Provide the offsets of the identifying columns and the delimiter.
+
+    The hashes of a new version only replace the old ones when `commit` is
+    called, so a pass over the file that fails partway can be run again.
+    """
+    def __init__(self, columns, delimiter=';'):
+        self.columns = list(columns)
+        self.delimiter = delimiter
+        self._split = max(self.columns) + 1
+        self._hashes = {}
+        self._pending = {}
+        # How many lines have been kept and dropped since the last commit
+        self.changed = 0
+        self.unchanged = 0
+
+    def __repr__(self):
+        return "<LineHashes: %s lines>" % len(self)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def filter(self, lines):
+        """
+        Returns a list of the lines that are new or different from the last
+        version committed. Blank lines are dropped.
+        """
+        hashes = self._hashes
+        pending = self._pending
+        columns = self.columns
+        changed = []
+        for line in lines:
+            stripped = line.rstrip('\r')
+            if not stripped:
+                continue
+            values = split_line(stripped, self.delimiter, self._split)
+            if len(values) < self._split:
+                # Too short to identify, so leave it to the parser
+                changed.append(line)
+                continue
+            key = tuple([values[i] for i in columns])
+            h = pending[key] = hash(stripped)
+            if hashes.get(key) == h:
+                self.unchanged += 1
+            else:
+                changed.append(line)
+        self.changed += len(changed)
+        return changed
+
+    def commit(self):
+        """
+        Keeps the hashes of the lines filtered since the last commit, and
+        starts the counts over.
+        """
+        self._hashes.update(self._pending)
+        self.rollback()
+
+    def rollback(self):
+        """
+        Forgets the hashes of the lines filtered since the last commit, and
+        starts the counts over.
+        """
+        self._pending = {}
+        self.changed = 0
+        self.unchanged = 0
+
+    def stats(self):
+        """
+        Returns a dictionary of how many lines have changed and how many
+        haven't since the last commit.
+        """
+        return {'changed': self.changed, 'unchanged': self.unchanged}
+
+
+class FlatfileParser(object):
+    """
+    Parses and structures one of the AP's flatfiles.
+
+    Rows come out as dictionaries with the standard "basicfields" as
+    top-level keys and then a `candidates` key that contains a nested dict
+    with the candidate data inside.
+
+    AP's flatfiles are delimited by ";", do not include headers and include
+    a dynamic number of fields depending on the number of candidates in the
+    data set.
+
+    Provide:
+
+        * The list of basic fields that start each row
+        * The list of candidate fields that will repeat outwards to right
+          for each candidate in the data set.
+        * Optionally, a list of the only fields you want, basic or
+          candidate, so the rest can be skipped.
+        * Optionally, a dictionary of functions to convert the values of
+          particular fields, like `int`.
+        * Optionally, an Interner to share repeated values through. Values
+          are interned before they're converted.
+        * Optionally, a LineHashes to skip the lines that haven't changed
+          since the last version of the file.
+
+    Then either pass chunks of the file to `feed` as they arrive and call
+    `close` once the data is finished, or hand an iterable of chunks to
+    `iter_rows`.
+    """
+    def __init__(
+        self,
+        basicfields,
+        candidatefields,
+        fields=None,
+        converters=None,
+        interner=None,
+        changes=None
+    ):
+        self.basicfields = basicfields
+        self.candidatefields = candidatefields
+        self.fields = fields
+        self.converters = converters or {}
+        self.interner = interner
+        self.changes = changes
+        self.layout = FlatfileLayout(basicfields, candidatefields)
+        if fields is None:
+            self.projection = self.layout
+        else:
+            self.projection = self.layout.project(fields)
+        self._splitter = LineSplitter()
+
+        # Work out where each of the projected fields come from up front
+        self._basic_columns = [
+            self.layout.basic_offsets[f] for f in self.projection.basicfields
+        ]
+        self._candidate_columns = [
+            self.layout.candidate_start(f)
+            for f in self.projection.candidatefields
+        ]
+        self._basic_converters = [
+            (i, self.converters[f])
+            for i, f in enumerate(self.projection.basicfields)
+            if f in self.converters
+        ]
+        self._candidate_converters = [
+            (i, self.converters[f])
+            for i, f in enumerate(self.projection.candidatefields)
+            if f in self.converters
+        ]
+
+    def feed(self, chunk):
+        """
+        Returns a list of all of the rows completed by the next chunk of the
+        file.
+        """
+        return self._parse_lines(self._filter(self._splitter.feed(chunk)))
+
+    def close(self):
+        """
+        Returns a list of whatever rows were left at the end of the file.
+        """
+        return self._parse_lines(self._filter(self._splitter.close()))
+
+    def _filter(self, lines):
+        """
+        Drops the lines that haven't changed, if we're looking for changes.
+        """
+        if self.changes is None:
+            return lines
+        return self.changes.filter(lines)
+
+    def iter_rows(self, chunks):
+        """
+        Takes an iterable of chunks and yields each row as soon as it's
+        complete.
+        """
+        for chunk in chunks:
+            for row in self.feed(chunk):
+                yield row
+        for row in self.close():
+            yield row
+
+    def parse(self, f, blocksize=8192):
+        """
+        Parses a whole file object a chunk at a time and returns the list
+        of rows.
+        """
+        return list(self.iter_rows(iter_chunks(f, blocksize)))
+
+    def _parse_lines(self, lines):
+        """
+        Splits complete lines into fields and structures them.
+        """
+        rows = []
+        for line in lines:
+            line = line.rstrip('\r')
+            rows.append(self._prep_row(split_line(line) if line else []))
+        return rows
+
+    def _project(self, values):
+        """
+        Picks the projected fields out of a split row, converting any that
+        have a converter, and returns them in a list laid out to match
+        `self.projection`.
+        """
+        if len(values) < self.layout.width:
+            return []
+        projected = [values[i] for i in self._basic_columns]
+        stride = self.layout.stride
+        columns = [values[i::stride] for i in self._candidate_columns]
+        if self.interner is not None:
+            projected = self.interner.many(projected)
+            columns = map(self.interner.many, columns)
+        for i, convert in self._basic_converters:
+            projected[i] = convert(projected[i])
+        for i, convert in self._candidate_converters:
+            columns[i] = map(convert, columns[i])
+        # Weave the candidate columns back together
+        projected.extend(
+            itertools.chain.from_iterable(itertools.izip(*columns))
+        )
+        return projected
+
+    def _prep_row(self, row):
+        """
+        Structures a single row of fields.
+        """
+        if self.fields is not None or self.converters:
+            # Slice off the last field since it's always empty
+            values = self._project(row[:-1])
+            return self.projection.record_class(values).as_dict()
+        basicfields = self.basicfields
+        candidatefields = self.candidatefields
+        # Slice off the last field since it's always empty
+        row = row[:-1]
+        if self.interner is not None:
+            row = self.interner.many(row)
+        # Split out the basic fields
+        basic_data = row[:len(basicfields)]
+        # Load them into a new dictionary with the proper keys
+        prepped_dict = dict(
+            (basicfields[i], v) for i, v in enumerate(basic_data)
+        )
+        # Split out all the candidate sets that come after the basic fields
+        candidate_data = row[len(basicfields):]
+        candidate_sets = split_list(candidate_data, len(candidatefields))
+        # Load candidate data into a list of dicts with the proper keys
+        prepped_dict['candidates'] = [
+            dict((candidatefields[i], v) for i, v in enumerate(cand))
+            for cand in candidate_sets
+        ]
+        return prepped_dict
+
+
+class FlatfileLayout(object):
+    """
+    Maps the fields of one of the AP's flatfiles to their fixed column
+    offsets, so they can be read straight out of a split row.
+
+    Provide:
+
+        * The list of basic fields that start each row
+        * The list of candidate fields that will repeat outwards to right
+          for each candidate in the data set.
+    """
+    def __init__(self, basicfields, candidatefields):
+        self.basicfields = list(basicfields)
+        self.candidatefields = list(candidatefields)
+        self.basic_offsets = dict(
+            (name, i) for i, name in enumerate(self.basicfields)
+        )
+        self.candidate_offsets = dict(
+            (name, i) for i, name in enumerate(self.candidatefields)
+        )
+        # Where the first candidate starts
+        self.width = len(self.basicfields)
+        # How far apart each candidate is from the next
+        self.stride = len(self.candidatefields)
+        # A record class of our own, bound to this layout
+        self.record_class = type(
+            'FlatfileRecord',
+            (FlatfileRecord,),
+            {'__slots__': (), 'layout': self}
+        )
+
+    def __repr__(self):
+        return "<FlatfileLayout: %s>" % ", ".join(
+            self.basicfields + self.candidatefields
+        )
+
+    def project(self, fields):
+        """
+        Returns a new layout with only the provided fields, in the order
+        they appear in this one.
+        """
+        fields = set(fields)
+        unknown = fields - set(self.basicfields + self.candidatefields)
+        if unknown:
+            raise ValueError(
+                "These fields aren't in the flatfile: %s" %
+                ", ".join(sorted(unknown))
+            )
+        return FlatfileLayout(
+            [f for f in self.basicfields if f in fields],
+            [f for f in self.candidatefields if f in fields]
+        )
+
+    def candidate_start(self, name):
+        """
+        Returns the column of the provided candidate field for the first
+        candidate in a row.
+        """
+        return self.width + self.candidate_offsets[name]
+
+
+class FlatfileRecord(object):
+    """
+    A single row of one of the AP's flatfiles.
+
+    Rather than copying the fields out into dictionaries, the record holds on
+    to the split list of values and reads fields out of it by their offsets
+    in its FlatfileLayout. Candidate fields are found by stepping across the
+    list a candidate's width at a time.
+    """
+    __slots__ = ('values',)
+    layout = None
+
+    def __init__(self, values):
+        self.values = values
+
+    def __repr__(self):
+        return "<FlatfileRecord: %s>" % ";".join(
+            v for v in self.values[:self.layout.width] if v
+        )
+
+    def __getitem__(self, name):
+        """
+        Returns the value of one of the basic fields.
+        """
+        try:
+            return self.values[self.layout.basic_offsets[name]]
+        except IndexError:
+            raise KeyError(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def candidate_values(self, name):
+        """
+        Returns a list of the provided candidate field's value for every
+        candidate in the row.
+        """
+        layout = self.layout
+        if not layout.stride:
+            return []
+        return self.values[layout.candidate_start(name)::layout.stride]
+
+    @property
+    def candidates(self):
+        """
+        Returns the candidate data as a list of dicts.
+        """
+        layout = self.layout
+        values = self.values
+        if not layout.stride:
+            return []
+        return [
+            dict(zip(layout.candidatefields, values[i:i + layout.stride]))
+            for i in range(layout.width, len(values), layout.stride)
+        ]
+
+    def as_dict(self):
+        """
+        Returns the row structured the same as FlatfileParser would have.
+        """
+        d = dict(zip(self.layout.basicfields, self.values))
+        d['candidates'] = self.candidates
+        return d
+
+
+class FlatfileRecordParser(FlatfileParser):
+    """
+    Parses one of the AP's flatfiles into FlatfileRecord objects.
+
+    It works just like FlatfileParser, but only splits each line, which is
+    much quicker than building dictionaries for every row and candidate.
+    If you ask for particular fields, the records hold only those, laid out
+    by the parser's `projection`. Blank lines are skipped.
+    """
+    def _parse_lines(self, lines):
+        """
+        Splits complete lines into records.
+        """
+        record_class = self.projection.record_class
+        project = self.fields is not None or self.converters
+        rows = []
+        for line in lines:
+            line = line.rstrip('\r')
+            if not line:
+                continue
+            values = split_line(line)
+            # Slice off the last field since it's always empty
+            del values[-1]
+            if project:
+                values = self._project(values)
+            elif self.interner is not None:
+                values = self.interner.many(values)
+            rows.append(record_class(values))
+        return rows
@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Keeps an Election up to date on a background thread, handing over what
+changed each time as it comes in.
+"""
+import Queue
+import threading
+
+
+class Poller(object):
+    """
+    Refreshes an Election every `interval` seconds on a thread of its own.
+
+    The ChangeSet from each refresh that found any changes is queued up.
+    Iterate over the Poller to wait for them, one batch per refresh:
+
+        >>> poller = Poller(iowa, interval=30).start()
+        >>> for changes in poller:
+        ...     for race, winners in changes.by_race(NewWinner):
+        ...         alert(race, winners)
+
+    An error raised by a refresh is raised by the iteration, and polling
+    carries on. Call `stop` to end it, after which the iteration finishes
+    with whatever is left in the queue.
+
+    The refreshes are made while holding the Election's `lock`, which you
+    can take too so the results don't change while you're reading them.
+    """
+    # How often a waiting iteration wakes up, so it can be interrupted
+    wait = 1
+
+    def __init__(self, election, interval=60):
+        self.election = election
+        self.interval = interval
+        self.queue = Queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return "<Poller: every %ss%s>" % (
+            self.interval,
+            "" if self.running else ", stopped"
+        )
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.wait)
+            except Queue.Empty:
+                if not self.running and self.queue.empty():
+                    return
+                continue
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    @property
+    def running(self):
+        """
+        Whether the polling thread is still going.
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Starts polling, with the first refresh right away. Returns the
+        Poller.
+        """
+        if not self.running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Stops polling once any refresh under way has finished, waiting up
+        to `timeout` seconds for it.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                changes = self.election.refresh()['changes']
+            except Exception, e:
+                self.queue.put(e)
+            else:
+                if changes:
+                    self.queue.put(changes)
+            self._stop.wait(self.interval)
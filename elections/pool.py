@@ -0,0 +1,394 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A process-wide pool of logged in connections to the AP's FTP.
+
+Logging in to the AP takes a TCP handshake plus a USER/PASS exchange, so
+rather than paying that every time an Election is created, connections are
+borrowed from a pool and handed back when the Election is done with them.
+"""
+import time
+import atexit
+import threading
+from ftplib import FTP, all_errors, error_reply, error_temp, error_proto
+
+# The errors that mean a connection has gone bad, as opposed to the server
+# turning down what we asked for
+connection_errors = (error_reply, error_temp, error_proto, IOError, EOFError)
+
+
+class FTPPool(object):
+    """
+    Keeps logged in FTP connections to a single host and account around so
+    they can be reused.
+
+    Provide:
+
+        * The FTP hostname
+        * The username and password to log in with
+        * The most connections that can be open at once
+        * How many seconds a connection can sit idle before it is closed
+        * How many seconds a connection can sit idle before it needs a NOOP
+          to prove it is still alive
+        * Whether to send those NOOPs from a background thread while
+          connections sit idle
+        * How many seconds to wait for a connection when they're all out
+          on loan before giving up
+        * Optionally, a function that opens new connections
+
+    The pool only ever logs in as its own username and password, unless
+    a function to open connections is handed to `acquire`.
+    """
+    def __init__(
+        self,
+        host,
+        username=None,
+        password=None,
+        max_connections=4,
+        max_idle=300,
+        keepalive=30,
+        ping_idle=True,
+        timeout=60,
+        connect=None
+    ):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.max_connections = max_connections
+        self.max_idle = max_idle
+        self.keepalive = keepalive
+        self.ping_idle = ping_idle
+        self.timeout = timeout
+        self.connect = connect or self._connect
+
+        # Connections waiting to be borrowed, as (connection, last used) pairs
+        self._idle = []
+        # How many connections are out on loan
+        self._in_use = 0
+        self._lock = threading.Condition()
+        self._keepalive_thread = None
+        self._keepalive_stop = threading.Event()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return "<FTPPool: %s@%s>" % (self.username, self.host)
+
+    #
+    # Public methods
+    #
+
+    def acquire(self, stats=None, connect=None, fresh=False):
+        """
+        Borrow a logged in connection from the pool.
+
+        Blocks if `max_connections` are already out on loan, for up to
+        `timeout` seconds, after which PoolTimeoutError is raised. Idle
+        connections that haven't been used in a while are checked with a
+        NOOP first and replaced if they've gone stale.
+
+        If a `stats` dictionary is provided, the hit, miss or reconnect is
+        tallied in it as well as on the pool.
+
+        New connections are opened with the `connect` function, if you
+        provide one, rather than the pool's own. Ask for a `fresh` one to
+        skip the idle connections, say because the last one you borrowed
+        turned out to be dead.
+        """
+        deadline = time.time() + self.timeout
+        # Connections that have sat idle too long, to be closed once we've
+        # let go of the lock
+        expired = []
+        timed_out = False
+        with self._lock:
+            while True:
+                expired.extend(self._evict())
+                if self._idle and not fresh:
+                    # Take the most recently used, since it's the most likely
+                    # to still be alive
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._in_use < self.max_connections:
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                self._lock.wait(remaining)
+            if not timed_out:
+                self._in_use += 1
+
+        # Talk to the server outside the lock so others aren't held up
+        self._close_all(expired)
+        if timed_out:
+            raise PoolTimeoutError(
+                "All %s connections to %s are still out on loan." % (
+                    self.max_connections,
+                    self.host
+                )
+            )
+        try:
+            if conn is None:
+                conn = (connect or self.connect)()
+                outcome = 'reconnects' if fresh else 'misses'
+            elif (time.time() - last_used >= self.keepalive and
+                    not self._healthy(conn)):
+                self._close(conn)
+                conn = (connect or self.connect)()
+                outcome = 'reconnects'
+            else:
+                outcome = 'hits'
+        except:
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            if stats is not None:
+                stats[outcome] = stats.get(outcome, 0) + 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Hand a borrowed connection back to the pool.
+
+        Connections that have been closed, or that you ask to `discard`
+        because they misbehaved, are shut down rather than reused.
+        """
+        if discard or not conn.sock:
+            self._close(conn)
+            conn = None
+        with self._lock:
+            self._in_use -= 1
+            if conn is not None:
+                self._idle.append((conn, time.time()))
+            self._lock.notify()
+        if conn is not None and self.ping_idle:
+            self.start_keepalive()
+
+    def grow(self, max_connections):
+        """
+        Raises `max_connections` to the provided number, if it's lower.
+        """
+        with self._lock:
+            if max_connections > self.max_connections:
+                self.max_connections = max_connections
+                self._lock.notify_all()
+
+    def ping(self):
+        """
+        Sends a NOOP down every idle connection that hasn't been used
+        recently so the server doesn't hang up on it.
+
+        Connections that don't answer are dropped.
+        """
+        with self._lock:
+            expired = self._evict()
+            now = time.time()
+            stale = [i for i in self._idle if now - i[1] >= self.keepalive]
+            for i in stale:
+                self._idle.remove(i)
+            # Count them as out on loan while we talk to the server
+            self._in_use += len(stale)
+        self._close_all(expired)
+        for conn, last_used in stale:
+            if self._healthy(conn):
+                self.release(conn)
+            else:
+                self.release(conn, discard=True)
+
+    def start_keepalive(self):
+        """
+        Starts a background thread that pings idle connections every
+        `keepalive` seconds.
+
+        It's started for you whenever a connection is handed back, unless
+        `ping_idle` is off, and it stops once there's nothing idle left.
+        """
+        with self._lock:
+            if self._keepalive_thread is not None:
+                return
+            self._keepalive_stop.clear()
+            _pinging.add(self)
+            self._keepalive_thread = threading.Thread(target=self._ping_loop)
+            self._keepalive_thread.daemon = True
+            self._keepalive_thread.start()
+
+    def stop_keepalive(self, timeout=None):
+        """
+        Stops the background thread that pings idle connections, waiting
+        up to `timeout` seconds for it to finish.
+        """
+        self._keepalive_stop.set()
+        thread = self._keepalive_thread
+        if thread is not None and timeout != 0:
+            thread.join(timeout)
+
+    def clear(self):
+        """
+        Closes all of the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        self._close_all(conn for conn, last_used in idle)
+
+    def stats(self):
+        """
+        Returns a dictionary of the pool's counters.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reconnects': self.reconnects,
+                'evictions': self.evictions,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+            }
+
+    #
+    # Private methods
+    #
+
+    def _connect(self):
+        """
+        Opens and logs in a new connection.
+        """
+        return FTP(self.host, self.username, self.password)
+
+    def _ping_loop(self):
+        """
+        Pings idle connections every `keepalive` seconds until there aren't
+        any left or we're asked to stop.
+        """
+        while True:
+            # Event.wait only says whether it was set on Python 2.7 and up
+            self._keepalive_stop.wait(self.keepalive)
+            if self._keepalive_stop.is_set():
+                break
+            self.ping()
+            with self._lock:
+                if not self._idle:
+                    self._end_keepalive()
+                    return
+        with self._lock:
+            self._end_keepalive()
+
+    def _end_keepalive(self):
+        """
+        Forgets the keepalive thread as it finishes.
+
+        Must be called with the lock held.
+        """
+        self._keepalive_thread = None
+        _pinging.discard(self)
+
+    def _healthy(self, conn):
+        """
+        Checks that a connection is still alive with a NOOP.
+        """
+        if not conn.sock:
+            return False
+        try:
+            conn.voidcmd('NOOP')
+        except all_errors:
+            return False
+        return True
+
+    def _close(self, conn):
+        """
+        Shuts down a connection, politely if we can.
+        """
+        try:
+            conn.quit()
+        except all_errors:
+            conn.close()
+
+    def _close_all(self, conns):
+        """
+        Shuts down each of a list of connections.
+        """
+        for conn in conns:
+            self._close(conn)
+
+    def _evict(self):
+        """
+        Takes connections that have sat idle longer than `max_idle` out of
+        the pool and returns them.
+
+        Must be called with the lock held. Close what it returns once the
+        lock is released, so nobody waits on the server while we hold it.
+        """
+        now = time.time()
+        expired = [i for i in self._idle if now - i[1] >= self.max_idle]
+        for i in expired:
+            self._idle.remove(i)
+            self.evictions += 1
+        return [conn for conn, last_used in expired]
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no connection comes free in time to be borrowed.
+    """
+    pass
+
+
+#
+# The process-wide registry
+#
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# The pools with keepalive threads running, including any that have been
+# cleared out of the registry
+_pinging = set()
+
+
+def get_pool(host, username=None, password=None, **options):
+    """
+    Returns the shared FTPPool for a host, username and password, creating
+    it if it doesn't exist yet.
+
+    Any keyword options, like `max_connections`, `max_idle` or `keepalive`,
+    are applied to the pool.
+    """
+    with _pools_lock:
+        key = (host, username, password)
+        try:
+            pool = _pools[key]
+        except KeyError:
+            pool = _pools[key] = FTPPool(host, username, password)
+        for k, v in options.items():
+            setattr(pool, k, v)
+        return pool
+
+
+def clear_pools():
+    """
+    Closes every idle connection and forgets all of the pools.
+    """
+    with _pools_lock:
+        pools = _pools.values()
+        _pools.clear()
+    for pool in pools:
+        pool.stop_keepalive(0)
+        pool.clear()
+
+
+@atexit.register
+def _stop_keepalives():
+    """
+    Stops the pools' keepalive threads before the interpreter shuts down
+    around them.
+    """
+    for pool in list(_pinging):
+        pool.stop_keepalive(1)
@@ -0,0 +1,207 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Indexes for querying the objects an Election loads.
+
+Rather than scanning every object for each filter, the values of commonly
+queried attributes are hashed into indexes the first time they're needed.
+
+Filters are written as keyword arguments, Django style. A plain attribute
+name tests for equality and a double underscore adds a lookup:
+
+    >>> iowa.filter_races(statepostal__in=['IA', 'NH'], party__ne='GOP')
+"""
+import operator
+
+
+def _in(value, arg):
+    return value in arg
+
+
+def _contains(value, arg):
+    return value is not None and arg in value
+
+
+def _startswith(value, arg):
+    return value is not None and value.startswith(arg)
+
+
+def _endswith(value, arg):
+    return value is not None and value.endswith(arg)
+
+
+def _isnull(value, arg):
+    return (value is None) == bool(arg)
+
+
+# Each lookup's test, which takes an object's value and the filter's value
+LOOKUPS = {
+    'exact': operator.eq,
+    'ne': operator.ne,
+    'in': _in,
+    'contains': _contains,
+    'startswith': _startswith,
+    'endswith': _endswith,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'isnull': _isnull,
+}
+
+
+class Lookup(object):
+    """
+    A single filter, like `statepostal__in=['IA', 'NH']`, compiled into a
+    matcher that can be run against objects or against the values in an
+    index.
+    """
+    def __init__(self, key, value):
+        attribute, sep, name = key.rpartition('__')
+        if not sep or name not in LOOKUPS:
+            attribute, name = key, 'exact'
+        self.key = key
+        self.attribute = attribute
+        self.name = name
+        self.value = value
+        if name == 'in':
+            # Freeze the choices into a set if we can, for quick tests
+            try:
+                value = frozenset(value)
+            except TypeError:
+                value = list(value)
+            self.value = value
+        test = LOOKUPS[name]
+        self.test = lambda v: test(v, value)
+
+    def __repr__(self):
+        return "<Lookup: %s=%r>" % (self.key, self.value)
+
+    def __call__(self, obj):
+        """
+        Tests whether an object matches.
+        """
+        return self.test(getattr(obj, self.attribute))
+
+    def positions(self, index):
+        """
+        Returns a set of the positions that match in the provided index of
+        our attribute.
+
+        Exact and `in` lookups go straight to their values. Anything else is
+        tested against each distinct value in the index, which is usually
+        far fewer than the objects.
+        """
+        if self.name == 'exact':
+            return set(index.get(self.value, ()))
+        positions = set()
+        if self.name == 'in' and isinstance(self.value, frozenset):
+            for v in self.value:
+                positions.update(index.get(v, ()))
+            return positions
+        for v, matches in index.iteritems():
+            if self.test(v):
+                positions.update(matches)
+        return positions
+
+
+def compile_query(kwargs):
+    """
+    Compiles a dictionary of keyword filters into a list of Lookups.
+    """
+    return [Lookup(k, v) for k, v in kwargs.items()]
+
+
+class QueryIndex(object):
+    """
+    Hash indexes on some of the attributes of a collection of objects, so
+    that filters don't have to scan all of them.
+
+    Provide:
+
+        * A function that returns the objects to index, in order
+        * The list of attributes worth indexing
+
+    Each attribute's index is built the first time a query needs it and
+    kept until `invalidate` is called, which must happen whenever the
+    objects, or any of their indexed attributes, change.
+    """
+    def __init__(self, source, attributes):
+        self.source = source
+        self.attributes = frozenset(attributes)
+        self._objects = None
+        self._indexes = {}
+
+    def __repr__(self):
+        return "<QueryIndex: %s>" % ", ".join(sorted(self.attributes))
+
+    @property
+    def objects(self):
+        """
+        Returns the list of objects being indexed.
+        """
+        if self._objects is None:
+            self._objects = list(self.source())
+        return self._objects
+
+    def invalidate(self):
+        """
+        Throws away the indexes so they're rebuilt from the source the next
+        time they're needed.
+        """
+        self._objects = None
+        self._indexes = {}
+
+    def index(self, attribute):
+        """
+        Returns a dictionary that maps each value of the provided attribute
+        to the positions of the objects that have it.
+        """
+        try:
+            return self._indexes[attribute]
+        except KeyError:
+            pass
+        index = {}
+        for i, obj in enumerate(self.objects):
+            index.setdefault(getattr(obj, attribute), []).append(i)
+        self._indexes[attribute] = index
+        return index
+
+    def filter(self, **kwargs):
+        """
+        Takes a series of keyword filters and returns the objects that
+        match all of them, in their original order.
+
+        Filters on indexed attributes are answered from the indexes and
+        intersected, smallest first. The rest are checked one object at a
+        time against whatever is left.
+        """
+        objects = self.objects
+        matches = []
+        unindexed = []
+        for lookup in compile_query(kwargs):
+            if lookup.attribute in self.attributes:
+                try:
+                    matches.append(
+                        lookup.positions(self.index(lookup.attribute))
+                    )
+                    continue
+                except TypeError:
+                    # Unhashable values can't be looked up
+                    pass
+            unindexed.append(lookup)
+
+        if matches:
+            matches.sort(key=len)
+            positions = matches[0]
+            for m in matches[1:]:
+                if not positions:
+                    break
+                positions &= m
+            results = [objects[i] for i in sorted(positions)]
+        else:
+            results = list(objects)
+
+        for lookup in unindexed:
+            results = filter(lookup, results)
+        return results
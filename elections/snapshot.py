@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Versions of an Election's results that never change once they're made.
+
+Each refresh that changes anything publishes a new Snapshot. It's made of
+one RaceState per race, and the races that didn't change carry their
+RaceState over from the last version rather than copying it. Within a race
+that did, the reporting units that didn't change, and their results, are
+carried over too. Readers hold on to whichever Snapshot they started with,
+without taking any locks, and a version is thrown away once nobody is
+holding it.
+"""
+
+
+class RaceState(object):
+    """
+    A race's reporting units and results as of one version.
+
+    The reporting units and results are copies that belong to the state
+    and must not be changed. They come as (reporting unit, results) pairs,
+    with the results in a tuple, in the race's order. A pair can be shared
+    by the states of more than one version.
+    """
+    __slots__ = ('race', 'units', '_by_key')
+
+    def __init__(self, race, units):
+        self.race = race
+        self.units = tuple(units)
+        self._by_key = dict((u.key, i) for i, (u, r) in enumerate(self.units))
+
+    def __repr__(self):
+        return "<RaceState: %s>" % self.race.ap_race_number
+
+    @property
+    def reporting_units(self):
+        return [unit for unit, results in self.units]
+
+    @property
+    def results(self):
+        results = []
+        for unit, results_ in self.units:
+            results.extend(results_)
+        return results
+
+    def get_unit(self, key):
+        """
+        Returns the (reporting unit, results) pair for the reporting unit
+        with the provided key, or None.
+        """
+        i = self._by_key.get(key)
+        if i is None:
+            return None
+        return self.units[i]
+
+    def get_reporting_unit(self, key):
+        """
+        Returns the reporting unit with the provided key, or None.
+        """
+        pair = self.get_unit(key)
+        if pair is None:
+            return None
+        return pair[0]
+
+    def get_results(self, reporting_unit=None, candidate=None):
+        """
+        Returns a list of the results for a reporting unit or candidate, by
+        key, or both. Leave them out to get all of them.
+        """
+        if reporting_unit is not None:
+            i = self._by_key.get(reporting_unit)
+            if i is None:
+                return []
+            units = [self.units[i]]
+        else:
+            units = self.units
+        results = []
+        for unit, results_ in units:
+            if candidate is None:
+                results.extend(results_)
+            else:
+                results.extend(
+                    r for r in results_ if r.candidateid == candidate
+                )
+        return results
+
+
+class Snapshot(object):
+    """
+    An Election's races, reporting units and results as of one version.
+
+    Nothing in it changes after it's made, so it can be read from any
+    thread while the Election is being refreshed. The Race objects are the
+    Election's own, which refreshes don't touch. Reporting units and
+    results are copies, so use the snapshot's methods rather than the
+    `reportingunits` lists on the races.
+    """
+    __slots__ = ('version', '_states', '_order', '__weakref__')
+
+    def __init__(self, version, states):
+        states = tuple(states)
+        set_ = super(Snapshot, self).__setattr__
+        set_('version', version)
+        set_('_states', dict(
+            (state.race.ap_race_number, state) for state in states
+        ))
+        set_('_order', states)
+
+    def __repr__(self):
+        return "<Snapshot: version %s>" % self.version
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshots can't be changed")
+
+    def evolve(self, states):
+        """
+        Returns the next version, with the provided RaceStates in place of
+        this version's for the same races. The rest are shared.
+        """
+        replaced = dict((s.race.ap_race_number, s) for s in states)
+        order = [
+            replaced.pop(s.race.ap_race_number, s) for s in self._order
+        ]
+        order.extend(s for s in states if s.race.ap_race_number in replaced)
+        return Snapshot(self.version + 1, order)
+
+    def state(self, race):
+        """
+        Returns the RaceState for a race, by its `ap_race_number`, or None.
+        """
+        return self._states.get(race)
+
+    @property
+    def races(self):
+        return [state.race for state in self._order]
+
+    @property
+    def reporting_units(self):
+        units = []
+        for state in self._order:
+            units.extend(state.reporting_units)
+        return units
+
+    @property
+    def results(self):
+        results = []
+        for state in self._order:
+            results.extend(state.results)
+        return results
+
+    def get_race(self, ap_race_number):
+        state = self._states.get(ap_race_number)
+        if state is None:
+            return None
+        return state.race
+
+    def get_reporting_units(self, race):
+        """
+        Returns a race's reporting units, by the race's `ap_race_number`.
+        """
+        state = self._states.get(race)
+        if state is None:
+            return []
+        return state.reporting_units
+
+    def get_reporting_unit(self, key, race):
+        """
+        Returns a race's reporting unit, by their keys, or None.
+        """
+        state = self._states.get(race)
+        if state is None:
+            return None
+        return state.get_reporting_unit(key)
+
+    def get_results(self, race=None, reporting_unit=None, candidate=None):
+        """
+        Returns the results for a race, reporting unit or candidate, or any
+        combination of them, by their keys.
+        """
+        if race is not None:
+            states = [self._states[race]] if race in self._states else []
+        else:
+            states = self._order
+        results = []
+        for state in states:
+            results.extend(state.get_results(reporting_unit, candidate))
+        return results
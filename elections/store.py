@@ -0,0 +1,618 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stores for the results an Election loads, organized so that the results of
+a single race, reporting unit or candidate can be found without looking at
+all of the others.
+"""
+from array import array
+from itertools import izip
+from vector import percentages
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ResultStore(object):
+    """
+    Holds CandidateReportingUnit objects in nested dictionaries.
+
+    Results are filed by race, then reporting unit, then candidate, with a
+    second index of each candidate's results across every race and
+    reporting unit. Objects are filed under whatever keys you provide.
+    """
+    def __init__(self):
+        # race -> reporting unit -> candidate -> result
+        self._by_race = {}
+        # candidate -> [result, ...]
+        self._by_candidate = {}
+
+    def __repr__(self):
+        return "<ResultStore: %s races>" % len(self._by_race)
+
+    def __len__(self):
+        return sum(len(c) for c in self._by_candidate.values())
+
+    def add(self, race, reporting_unit, candidate, result):
+        """
+        Files a result under the provided race, reporting unit and candidate
+        keys, replacing any result already filed under all three.
+        """
+        units = self._by_race.setdefault(race, {})
+        candidates = units.setdefault(reporting_unit, {})
+        previous = candidates.get(candidate)
+        candidates[candidate] = result
+        results = self._by_candidate.setdefault(candidate, [])
+        if previous is None:
+            results.append(result)
+        else:
+            results[results.index(previous)] = result
+
+    def clear(self):
+        """
+        Forgets every result.
+        """
+        self._by_race.clear()
+        self._by_candidate.clear()
+
+    def has_reporting_unit(self, race, reporting_unit):
+        """
+        Returns whether any results are filed under a race's reporting unit.
+        """
+        return reporting_unit in self._by_race.get(race, {})
+
+    def find(self, race, reporting_unit, candidate):
+        """
+        Returns the result filed under all three keys, or None.
+        """
+        units = self._by_race.get(race)
+        if units is None:
+            return None
+        return units.get(reporting_unit, {}).get(candidate)
+
+    def get(self, race=None, reporting_unit=None, candidate=None):
+        """
+        Returns a list of the results filed under all of the provided keys.
+        Leave a key out to match anything.
+        """
+        if race is not None:
+            units = self._by_race.get(race, {})
+            if reporting_unit is not None:
+                units = {reporting_unit: units.get(reporting_unit, {})}
+            if candidate is not None:
+                return [
+                    c[candidate] for c in units.values() if candidate in c
+                ]
+            results = []
+            for candidates in units.values():
+                results.extend(candidates.values())
+            return results
+
+        if candidate is not None:
+            results = self._by_candidate.get(candidate, [])
+            if reporting_unit is None:
+                return list(results)
+            return [
+                c[candidate] for c in self._iter_units(reporting_unit)
+                if candidate in c
+            ]
+
+        results = []
+        if reporting_unit is not None:
+            for candidates in self._iter_units(reporting_unit):
+                results.extend(candidates.values())
+        else:
+            for results_ in self._by_candidate.values():
+                results.extend(results_)
+        return results
+
+    def _iter_units(self, reporting_unit):
+        """
+        Yields the candidate dictionaries of a reporting unit in every race.
+        """
+        for units in self._by_race.values():
+            candidates = units.get(reporting_unit)
+            if candidates is not None:
+                yield candidates
+
+
+class CodeTable(object):
+    """
+    Numbers each distinct key in the order it's first seen, and remembers
+    an object for each number.
+    """
+    def __init__(self):
+        self.codes = {}
+        self.objects = []
+
+    def __len__(self):
+        return len(self.objects)
+
+    def code(self, key, obj=None):
+        """
+        Returns the number for a key, adding it, with its object, if it's
+        new. The key is its own object unless another is provided.
+        """
+        try:
+            return self.codes[key]
+        except KeyError:
+            code = self.codes[key] = len(self.objects)
+            self.objects.append(key if obj is None else obj)
+            return code
+
+
+class ColumnarResultStore(object):
+    """
+    Holds results as rows across columns of typed arrays, rather than as
+    objects.
+
+    Races, reporting units and candidates are numbered in CodeTables, so a
+    row is just a handful of integers. The result objects are only built,
+    by the `build` function you provide, when they're asked for. It's
+    called with the race, reporting unit and candidate objects followed by
+    the row's `test`, `incumbent`, `votecount`, `votes_total`, `winner`,
+    `precinctsreporting`, `precinctstotal`, `votepct` and
+    `precinctsreportingpct`.
+
+    The percentages are worked out for every row at once, the first time a
+    result is built after rows are added.
+
+    Rows are filed under the same keys as a ResultStore, and each race and
+    candidate keeps an array of its row numbers.
+    """
+    # The name and array typecode of each column
+    columns = (
+        ('race', 'i'),
+        ('reporting_unit', 'i'),
+        ('candidate', 'i'),
+        ('votecount', 'l'),
+        ('votes_total', 'l'),
+        ('precinctsreporting', 'l'),
+        ('precinctstotal', 'l'),
+        ('incumbent', 'b'),
+        ('winner', 'b'),
+    )
+
+    def __init__(self, build):
+        self.build = build
+        self.test = None
+        self.races = CodeTable()
+        self.reporting_units = CodeTable()
+        self.candidates = CodeTable()
+        # AP's winner flags, like "X" or "R"
+        self.winners = CodeTable()
+        for name, typecode in self.columns:
+            setattr(self, name, array(typecode))
+        # Row numbers for each race and candidate code
+        self._by_race = {}
+        self._by_candidate = {}
+        self._percentages = None
+        # The row of each reporting unit and candidate code, made the first
+        # time a row is looked up
+        self._rows = None
+
+    def __repr__(self):
+        return "<ColumnarResultStore: %s rows>" % len(self)
+
+    def __len__(self):
+        return len(self.race)
+
+    def __iter__(self):
+        for row in xrange(len(self)):
+            yield self.result(row)
+
+    def append(
+        self,
+        race,
+        reporting_unit,
+        candidate,
+        keys,
+        incumbent,
+        votecount,
+        votes_total,
+        winner,
+        precinctsreporting,
+        precinctstotal
+    ):
+        """
+        Adds a row for the provided race, reporting unit and candidate
+        objects, filed under a tuple of their keys.
+        """
+        race_key, reporting_unit_key, candidate_key = keys
+        return self.extend(
+            race,
+            reporting_unit,
+            [candidate],
+            (race_key, reporting_unit_key, [candidate_key]),
+            [incumbent],
+            [votecount],
+            votes_total,
+            [winner],
+            precinctsreporting,
+            precinctstotal
+        )[0]
+
+    def extend(
+        self,
+        race,
+        reporting_unit,
+        candidates,
+        keys,
+        incumbents,
+        votecounts,
+        votes_total,
+        winners,
+        precinctsreporting,
+        precinctstotal
+    ):
+        """
+        Adds a row for each of a list of candidates in the same race and
+        reporting unit, as they come in a line of AP's results file.
+
+        The candidate values come in parallel lists, the rest are shared.
+        Returns the list of new row numbers.
+        """
+        race_key, reporting_unit_key, candidate_keys = keys
+        count = len(candidates)
+        first = len(self)
+        rows = range(first, first + count)
+        race_code = self.races.code(race_key, race)
+        reporting_unit_code = self.reporting_units.code(
+            (race_key, reporting_unit_key),
+            reporting_unit
+        )
+        candidate_codes = map(
+            self.candidates.code,
+            candidate_keys,
+            candidates
+        )
+        self.race.extend([race_code] * count)
+        self.reporting_unit.extend([reporting_unit_code] * count)
+        self.candidate.extend(candidate_codes)
+        self.votecount.extend(votecounts)
+        self.votes_total.extend([votes_total] * count)
+        self.precinctsreporting.extend([precinctsreporting] * count)
+        self.precinctstotal.extend([precinctstotal] * count)
+        self.incumbent.extend(map(bool, incumbents))
+        self.winner.extend(map(self.winners.code, winners))
+        self._by_race.setdefault(race_code, array('i')).extend(rows)
+        self._percentages = None
+        by_candidate = self._by_candidate
+        for code, row in zip(candidate_codes, rows):
+            try:
+                by_candidate[code].append(row)
+            except KeyError:
+                by_candidate[code] = array('i', [row])
+            if self._rows is not None:
+                self._rows[(reporting_unit_code, code)] = row
+        return rows
+
+    def find(self, race_key, reporting_unit_key, candidate_key):
+        """
+        Returns the number of the row filed under all three keys, or None.
+        """
+        unit = self.reporting_units.codes.get((race_key, reporting_unit_key))
+        candidate = self.candidates.codes.get(candidate_key)
+        if unit is None or candidate is None:
+            return None
+        if self._rows is None:
+            self._rows = dict(izip(
+                izip(self.reporting_unit, self.candidate),
+                xrange(len(self))
+            ))
+        return self._rows.get((unit, candidate))
+
+    def update(
+        self,
+        row,
+        votecount,
+        votes_total,
+        winner,
+        precinctsreporting,
+        precinctstotal
+    ):
+        """
+        Replaces the numbers in a row. If any were different, returns a
+        tuple of the old `votecount`, `votes_total`, `winner`,
+        `precinctsreporting` and `precinctstotal`, otherwise None.
+        """
+        values = (
+            votecount,
+            votes_total,
+            self.winners.code(winner),
+            precinctsreporting,
+            precinctstotal,
+        )
+        columns = (
+            self.votecount,
+            self.votes_total,
+            self.winner,
+            self.precinctsreporting,
+            self.precinctstotal,
+        )
+        old = tuple(column[row] for column in columns)
+        if old == values:
+            return None
+        for column, value in zip(columns, values):
+            column[row] = value
+        self._percentages = None
+        votecount, votes_total, winner, reporting, total = old
+        return (
+            votecount,
+            votes_total,
+            self.winners.objects[winner],
+            reporting,
+            total,
+        )
+
+    def has_reporting_unit(self, race_key, reporting_unit_key):
+        """
+        Returns whether there are any rows for a race's reporting unit.
+        """
+        return (race_key, reporting_unit_key) in self.reporting_units.codes
+
+    def cached(self, row):
+        """
+        Returns the object already built for a row, if we kept it. We don't.
+        """
+        return None
+
+    def clear(self):
+        """
+        Forgets every row.
+        """
+        self.__init__(self.build)
+
+    def percentages(self):
+        """
+        Returns a tuple of two lists with each row's `votepct` and
+        `precinctsreportingpct`, computed a column at a time.
+        """
+        if self._percentages is None:
+            self._percentages = (
+                percentages(self.votecount, self.votes_total, multiply=False),
+                percentages(
+                    self.precinctsreporting,
+                    self.precinctstotal,
+                    multiply=True
+                ),
+            )
+        return self._percentages
+
+    def result(self, row):
+        """
+        Builds the result object for a row.
+        """
+        votepct, precinctsreportingpct = self.percentages()
+        return self.build(
+            self.races.objects[self.race[row]],
+            self.reporting_units.objects[self.reporting_unit[row]],
+            self.candidates.objects[self.candidate[row]],
+            self.test,
+            bool(self.incumbent[row]),
+            self.votecount[row],
+            self.votes_total[row],
+            self.winners.objects[self.winner[row]],
+            self.precinctsreporting[row],
+            self.precinctstotal[row],
+            votepct[row],
+            precinctsreportingpct[row],
+        )
+
+    def rows(self, race=None, reporting_unit=None, candidate=None):
+        """
+        Returns a list of the row numbers filed under all of the provided
+        keys. Leave a key out to match anything.
+        """
+        codes = self.races.codes
+        if race is not None:
+            race_codes = [race] if race in codes else []
+        else:
+            race_codes = codes.keys()
+        units = None
+        if reporting_unit is not None:
+            units = set()
+            for key in race_codes:
+                code = self.reporting_units.codes.get((key, reporting_unit))
+                if code is not None:
+                    units.add(code)
+            if not units:
+                return []
+        if candidate is not None:
+            try:
+                code = self.candidates.codes[candidate]
+            except KeyError:
+                return []
+            rows = self._by_candidate[code]
+            if race is not None:
+                race_code = codes.get(race)
+                rows = [r for r in rows if self.race[r] == race_code]
+        elif race is not None:
+            if not race_codes:
+                return []
+            rows = self._by_race[codes[race]]
+        else:
+            rows = xrange(len(self))
+        if units is not None:
+            column = self.reporting_unit
+            rows = [r for r in rows if column[r] in units]
+        return list(rows)
+
+    def get(self, race=None, reporting_unit=None, candidate=None):
+        """
+        Returns a list of freshly built results filed under all of the
+        provided keys. Leave a key out to match anything.
+        """
+        return [
+            self.result(row)
+            for row in self.rows(race, reporting_unit, candidate)
+        ]
+
+    def nbytes(self):
+        """
+        Returns how many bytes the columns and row indexes take up.
+        """
+        total = 0
+        arrays = [getattr(self, name) for name, typecode in self.columns]
+        arrays.extend(self._by_race.values())
+        arrays.extend(self._by_candidate.values())
+        for a in arrays:
+            total += a.itemsize * len(a)
+        return total
+
+    def to_numpy(self):
+        """
+        Returns a dictionary of NumPy arrays that share memory with each of
+        the columns. Raises ImportError if NumPy isn't installed.
+        """
+        if numpy is None:
+            raise ImportError("NumPy is required for to_numpy")
+        d = {}
+        for name, typecode in self.columns:
+            column = getattr(self, name)
+            if column:
+                d[name] = numpy.frombuffer(column, dtype=typecode)
+            else:
+                d[name] = numpy.array([], dtype=typecode)
+        return d
+
+
+class LRUCache(object):
+    """
+    A dictionary that holds at most `max_size` items, dropping the least
+    recently used once it's full. Without a `max_size` it keeps everything.
+    """
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        # key -> [previous link, next link, key, value]
+        self._links = {}
+        # The head of a circular list of links, oldest first
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return "<LRUCache: %s/%s>" % (len(self), self.max_size)
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def get(self, key, default=None):
+        """
+        Returns the value for a key, marking it as recently used, or the
+        default if it isn't cached.
+        """
+        try:
+            link = self._links[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        if self.max_size is not None:
+            self._unlink(link)
+            self._append(link)
+        return link[3]
+
+    def set(self, key, value):
+        """
+        Caches a value, dropping the least recently used if we're full.
+        """
+        try:
+            link = self._links[key]
+        except KeyError:
+            pass
+        else:
+            self._unlink(link)
+        link = self._links[key] = [None, None, key, value]
+        self._append(link)
+        if self.max_size is not None:
+            while len(self._links) > self.max_size:
+                oldest = self._root[1]
+                self._unlink(oldest)
+                del self._links[oldest[2]]
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        self.__init__(self.max_size)
+
+    def peek(self, key, default=None):
+        """
+        Returns the value for a key, or the default, without counting it as
+        a use.
+        """
+        link = self._links.get(key)
+        if link is None:
+            return default
+        return link[3]
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache's counters.
+        """
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+
+    def _unlink(self, link):
+        previous, next_ = link[0], link[1]
+        previous[1] = next_
+        next_[0] = previous
+
+
+class LazyResultStore(ColumnarResultStore):
+    """
+    A ColumnarResultStore that hangs on to the result objects it builds, so
+    each row's object is only built the first time it's asked for.
+
+    Provide a `max_size` to keep only that many objects around, dropping the
+    least recently used. A dropped object is built again, as a new object,
+    the next time it's needed.
+    """
+    def __init__(self, build, max_size=None):
+        super(LazyResultStore, self).__init__(build)
+        self.cache = LRUCache(max_size)
+
+    def clear(self):
+        """
+        Forgets every row and object.
+        """
+        self.__init__(self.build, self.cache.max_size)
+
+    def result(self, row):
+        """
+        Returns the result object for a row, building it if we don't have it.
+        """
+        obj = self.cache.get(row)
+        if obj is None:
+            obj = super(LazyResultStore, self).result(row)
+            self.cache.set(row, obj)
+        return obj
+
+    def cached(self, row):
+        """
+        Returns the object already built for a row, or None if there isn't
+        one.
+        """
+        return self.cache.peek(row)
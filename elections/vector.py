@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Math done over whole columns of results at once.
+
+NumPy is used when it's installed. Otherwise everything falls back to
+plain Python, with exactly the same results.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def percentages(values, totals, multiply=True):
+    """
+    Divides each value into its total and returns a list of the
+    percentages as floats, multiplied by 100 unless `multiply` is False.
+
+    The math is the same as `calculate.percentage`, one division and then
+    one multiplication, so the floats come out identical. Where the total
+    is zero you get 0.0, as `calculate.percentage(...) or 0.0` would.
+    """
+    if numpy is not None:
+        return _numpy_percentages(values, totals, multiply)
+    return _python_percentages(values, totals, multiply)
+
+
+def _python_percentages(values, totals, multiply=True):
+    results = []
+    append = results.append
+    for value, total in zip(values, totals):
+        if not total:
+            append(0.0)
+            continue
+        percent = value / float(total)
+        if multiply:
+            percent = percent * 100
+        # Match calculate's "or 0.0", which turns -0.0 into 0.0
+        append(percent or 0.0)
+    return results
+
+
+def _numpy_percentages(values, totals, multiply=True):
+    values = numpy.asarray(values, dtype=numpy.float64)
+    totals = numpy.asarray(totals, dtype=numpy.float64)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        percents = values / totals
+    if multiply:
+        percents *= 100
+    # Zero totals, and -0.0, become 0.0
+    percents[(totals == 0) | (percents == 0)] = 0.0
+    return percents.tolist()
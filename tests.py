@@ -9,9 +9,38 @@ access level, this will prove to be a problem.
 
 We need to work this out somehow. If you have any bright ideas let me know.
 """
+import gc
 import os
+import time
+import ftplib
+import shutil
+import socket
+import tempfile
 import unittest
-from elections import Election
+import weakref
+import threading
+import calculate
+from cStringIO import StringIO
+from elections import Election, FTPPool, PoolTimeoutError, clear_pools
+from elections.cache import clear_caches, DiskCache
+from elections.changes import NewReportingUnit, NewWinner, PrecinctChange
+from elections.parsers import (
+    FlatfileParser,
+    FlatfileRecordParser,
+    Interner,
+    LineHashes
+)
+from elections.models import FlyweightResult
+from elections.query import QueryIndex
+from elections import vector
+from elections.store import (
+    ColumnarResultStore,
+    LazyResultStore,
+    LRUCache,
+    ResultStore,
+    numpy
+)
+from elex.api.models import CandidateReportingUnit
 from datetime import date, datetime
 #from elections.ap import Nomination, StateDelegation
 #from elections.ap import Candidate, Race, ReportingUnit, Result, State
@@ -157,5 +186,1809 @@ class FTPTest(unittest.TestCase):
         # FTP hits
         self.assertEqual(self.client._ftp_hits, 1)
 
+
+#
+# Offline fixtures
+#
+
+STATES = (
+    ('IA', 'Iowa', '19'),
+    ('NH', 'New Hampshire', '33'),
+    ('CA', 'California', '06'),
+    ('TX', 'Texas', '48'),
+)
+
+
+def make_ap_files(
+    name='20160201',
+    states=2,
+    races=2,
+    counties=3,
+    candidates=3,
+    votes=0
+):
+    """
+    Creates a fake set of AP files that can be served up by FakeFTP.
+
+    Returns a dictionary keyed by FTP path.
+    """
+    race_rows = [
+        'el_date|st_postal|ra_number|race_id|office_id|ot_name|' +
+        'rt_party_name|se_name|of_description|se_number|ra_uncontested|' +
+        'ra_national_b'
+    ]
+    ru_rows = ['st_postal|rut_name|ru_name|ru_number|ru_fip|ru_precincts']
+    pol_rows = [
+        'st_postal|ra_number|polra_number|polra_in_order|pol_first_name|' +
+        'pol_last_name|polra_party|pol_nat_id|pol_number'
+    ]
+    flat_rows = []
+    polra_number = 1000
+    for s in range(states):
+        postal, state_name, fips = STATES[s % len(STATES)]
+        if s >= len(STATES):
+            postal = '%s%s' % (postal[0], s)
+        units = [('State', state_name, '1', '', 0)]
+        units.extend(
+            ('Subunit', '%s County %s' % (state_name, c), str(c + 2),
+             '%s%03d' % (fips, c + 1), 10 + c)
+            for c in range(counties)
+        )
+        for rut_name, ru_name, ru_number, ru_fip, precincts in units:
+            if rut_name == 'State':
+                precincts = sum(u[4] for u in units)
+            ru_rows.append('|'.join([
+                postal, rut_name, ru_name, ru_number, ru_fip, str(precincts)
+            ]))
+        for r in range(races):
+            ra_number = str(20000 + s * 100 + r)
+            party = ('Dem', 'GOP')[r % 2]
+            race_rows.append('|'.join([
+                name, postal, ra_number, 'R', 'P', 'President', party,
+                '', '', '', '0', '1'
+            ]))
+            cands = []
+            for c in range(candidates):
+                polra_number += 1
+                cands.append((str(polra_number), str(c + 1), party,
+                               'First%s' % c, 'Last%s' % c, str(500 + c),
+                               str(polra_number + 5000)))
+                pol_rows.append('|'.join([
+                    postal, ra_number, str(polra_number), str(c + 1),
+                    'First%s' % c, 'Last%s' % c, party, str(500 + c),
+                    str(polra_number + 5000)
+                ]))
+            for u, unit in enumerate(units):
+                rut_name, ru_name, ru_number, ru_fip, precincts = unit
+                if rut_name == 'State':
+                    precincts = sum(x[4] for x in units)
+                reporting = (precincts * (votes % 4)) // 4
+                row = [
+                    't', name, postal, ru_number, ru_fip, ru_name,
+                    ra_number, 'P', 'R', '0', 'President', '', party,
+                    'Caucus', '', '1', '0', str(reporting), str(precincts)
+                ]
+                for c, cand in enumerate(cands):
+                    polra, order, cparty, first, last, natid, polnum = cand
+                    row.extend([
+                        polra, order, cparty, first, '', last, '', '0',
+                        '0', str((votes + 1) * (u + c + 1) * 10),
+                        'X' if votes and c == 0 and u == 0 else '', natid
+                    ])
+                flat_rows.append(';'.join(row) + ';')
+    d = {'name': name}
+    return {
+        '/inits/US/US_%(name)s_race.txt' % d: '\r\n'.join(race_rows),
+        '/inits/US/US_%(name)s_ru.txt' % d: '\r\n'.join(ru_rows),
+        '/inits/US/US_%(name)s_pol.txt' % d: '\r\n'.join(pol_rows),
+        '/Delegate_Tracking/US/flat/US_%(name)s.txt' % d:
+            '\r\n'.join(flat_rows),
+    }
+
+
+class FakeSocket(object):
+    """
+    Stands in for the data connection of a transfer.
+    """
+    def __init__(self, data):
+        self.buffer = StringIO(data)
+
+    def recv(self, blocksize):
+        return self.buffer.read(blocksize)
+
+    def close(self):
+        pass
+
+
+class FakeFTP(object):
+    """
+    Stands in for ftplib.FTP, serving files out of a dictionary.
+    """
+    def __init__(self, files, user=None, passwd=None, modified=None):
+        if user == 'foo' or passwd == 'wrong':
+            raise ftplib.error_perm('530 User cannot log in.')
+        self.files = files
+        self.modified = {} if modified is None else modified
+        self.commands = []
+        self.sock = object()
+        self.alive = True
+
+    def voidcmd(self, cmd):
+        self.commands.append(cmd)
+        self._check()
+        return '200 OK.'
+
+    def _check(self):
+        if not self.alive:
+            raise ftplib.error_temp('421 Timeout.')
+
+    def _get(self, path):
+        if path not in self.files:
+            raise ftplib.error_perm(
+                '550 The system cannot find the file specified.'
+            )
+        return self.files[path]
+
+    def sendcmd(self, cmd):
+        self.commands.append(cmd)
+        self._check()
+        command, path = cmd.split(' ', 1)
+        if command != 'MDTM':
+            raise ftplib.error_perm('502 Command not implemented.')
+        self._get(path)
+        return '213 %s' % self.modified.get(path, '20160201000000')
+
+    def size(self, path):
+        self.commands.append('SIZE %s' % path)
+        self._check()
+        return len(self._get(path))
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        self.commands.append(cmd)
+        self._check()
+        data = self._get(cmd[len('RETR '):])
+        for i in range(0, len(data), blocksize):
+            callback(data[i:i + blocksize])
+        return '226 Transfer complete.'
+
+    def transfercmd(self, cmd, rest=None):
+        self.commands.append(cmd)
+        self._check()
+        return FakeSocket(self._get(cmd[len('RETR '):]))
+
+    def voidresp(self):
+        return '226 Transfer complete.'
+
+    def quit(self):
+        self.sock = None
+
+    close = quit
+
+
+class FakeElection(Election):
+    """
+    An Election that talks to a FakeFTP rather than the AP.
+    """
+    files = make_ap_files()
+    modified = {}
+
+    def _connect(self):
+        return FakeFTP(
+            self.files,
+            self.username,
+            self.password,
+            self.modified
+        )
+
+
+def flatten(value):
+    """
+    Swaps any elex objects inside of a value for their ids.
+    """
+    if isinstance(value, list):
+        return [flatten(v) for v in value]
+    if hasattr(value, '__dict__'):
+        return getattr(value, 'id', None)
+    return value
+
+
+def dump(objects):
+    """
+    Boils a list of elex objects down to something we can compare.
+    """
+    return sorted(
+        sorted((k, flatten(v)) for k, v in vars(o).items())
+        for o in objects
+    )
+
+
+class OfflineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.files = make_ap_files(states=3, races=2, counties=4)
+        FakeElection.files = self.files
+        FakeElection.modified = {}
+        clear_pools()
+        clear_caches()
+
+    def test_election(self):
+        election = FakeElection(username='user', password='pass')
+        self.assertEqual(len(election.races), 6)
+        self.assertEqual(len(election.candidates), 18)
+        self.assertEqual(len(election.results), 6 * 5 * 3)
+        self.assertEqual(election._ftp_hits, 1)
+
+    def test_reporting_units_per_race(self):
+        FakeElection.files = make_ap_files(
+            states=3, races=2, counties=4, votes=1
+        )
+        election = FakeElection(username='user')
+        # Each race has its own statewide unit and four counties
+        self.assertEqual(len(election.reporting_units), 6 * 5)
+        seen = set()
+        for race in election.races:
+            units = election.get_reporting_units(race)
+            self.assertEqual(
+                units,
+                election.get_reporting_units(race.ap_race_number)
+            )
+            self.assertEqual(len(units), 5)
+            for ru in units:
+                self.assertFalse(id(ru) in seen)
+                seen.add(id(ru))
+                self.assertEqual(ru.ap_race_number, race.ap_race_number)
+                self.assertTrue(
+                    election.get_reporting_unit(ru.key, race=race) is ru
+                )
+                # Every race's units get their results, not just the last
+                results = election.get_results(race=race, reporting_unit=ru)
+                self.assertEqual(len(results), 3)
+                # The unit on its own only gets its race's results, though
+                # its key gets every race's in the state
+                self.assertEqual(
+                    election.get_results(reporting_unit=ru),
+                    results
+                )
+                self.assertEqual(
+                    len(election.get_results(reporting_unit=ru.key)),
+                    6
+                )
+                self.assertEqual(
+                    ru.votecount,
+                    sum(r.votecount for r in results)
+                )
+                self.assertTrue(ru.votecount > 0)
+                self.assertEqual(ru.precinctsreporting, ru.precinctstotal / 4)
+        # Without a race you still get one of them
+        ru = election.races[0].reportingunits[0]
+        self.assertEqual(
+            election.get_reporting_unit(ru.key).key,
+            ru.key
+        )
+        self.assertRaises(
+            KeyError,
+            election.get_reporting_unit,
+            ru.key,
+            race='nope'
+        )
+
+    def test_intern_strings(self):
+        election = FakeElection(username='user')
+        race = election.races[0]
+        others = election.filter_races(statepostal=race.statepostal)
+        self.assertTrue(len(others) > 1)
+        for other in others:
+            self.assertTrue(other.statepostal is race.statepostal)
+            for ru in other.reportingunits:
+                self.assertTrue(ru.statepostal is race.statepostal)
+        stats = election.intern_stats
+        self.assertTrue(stats['shared'] > stats['unique'])
+        self.assertTrue(stats['bytes_saved'] > 0)
+        election = FakeElection(username='user', intern_strings=False)
+        self.assertEqual(election.interner, None)
+        self.assertEqual(election.intern_stats, None)
+
+    def test_refresh(self):
+        for kwargs in ({}, {'flyweight': True}, {'lazy': True},
+                       {'columnar': True}):
+            FakeElection.files = make_ap_files(votes=0)
+            clear_pools()
+            election = FakeElection(username='user', **kwargs)
+            results = election.results
+            units = election.reporting_units
+            self.assertEqual(election.filter_results(winner=True), [])
+
+            # Only the results file is downloaded again
+            FakeElection.files = make_ap_files(votes=1)
+            for path in (election.race_file_path,
+                         election.candidate_file_path):
+                del FakeElection.files[path]
+            clear_pools()
+            summary = election.refresh()
+            self.assertEqual(len(summary.pop('changes')), 48 + 16 + 4)
+            self.assertEqual(summary, {
+                'lines': 2 * 2 * 4,
+                'changed_lines': 2 * 2 * 4,
+                'unchanged_lines': 0,
+                'results': 2 * 2 * 4 * 3,
+                'reporting_units': 2 * 2 * 4,
+                'added': 0,
+            })
+            FakeElection.files = make_ap_files(votes=1)
+            clear_pools()
+            fresh = FakeElection(username='user', **kwargs)
+            self.assertEqual(
+                sorted(r.serialize() for r in election.results),
+                sorted(r.serialize() for r in fresh.results)
+            )
+            self.assertEqual(
+                dump(election.reporting_units),
+                dump(fresh.reporting_units)
+            )
+            self.assertEqual(len(election.filter_results(winner=True)), 4)
+            # The objects are the same ones, updated in place
+            self.assertEqual(map(id, election.reporting_units), map(id, units))
+            if kwargs != {'columnar': True}:
+                self.assertEqual(
+                    sorted(map(id, election.results)),
+                    sorted(map(id, results))
+                )
+                self.assertEqual(
+                    sorted(r.serialize() for r in results),
+                    sorted(r.serialize() for r in fresh.results)
+                )
+
+            # Nothing changes the second time, so nothing is decoded
+            summary = election.refresh()
+            self.assertEqual(list(summary.pop('changes')), [])
+            self.assertEqual(summary, {
+                'lines': 16,
+                'changed_lines': 0,
+                'unchanged_lines': 16,
+                'results': 0,
+                'reporting_units': 0,
+                'added': 0,
+            })
+
+    def test_results_batches(self):
+        class BatchedElection(FakeElection):
+            results_batch_lines = 3
+
+        for kwargs in ({}, {'lazy': True}, {'columnar': True}):
+            FakeElection.files = make_ap_files(votes=0)
+            clear_pools()
+            whole = FakeElection(username='user', **kwargs)
+            batched = BatchedElection(username='user', **kwargs)
+            self.assertEqual(dump(batched.results), dump(whole.results))
+            self.assertEqual(
+                dump(batched.reporting_units),
+                dump(whole.reporting_units)
+            )
+            # Refreshes come out the same too, give or take the order of
+            # the changes
+            FakeElection.files = make_ap_files(votes=1)
+            clear_pools()
+            expected = whole.refresh()
+            summary = batched.refresh()
+            self.assertEqual(
+                sorted(map(repr, summary.pop('changes'))),
+                sorted(map(repr, expected.pop('changes')))
+            )
+            self.assertEqual(summary, expected)
+            self.assertEqual(dump(batched.results), dump(whole.results))
+
+    def test_refresh_error(self):
+        class BatchedElection(FakeElection):
+            results_batch_lines = 2
+
+        path = '/Delegate_Tracking/US/flat/US_20160201.txt'
+        new = make_ap_files(votes=1)
+        lines = new[path].split('\n')
+        # The last line is for a race nobody has heard of
+        broken = lines[:-1] + [lines[-1].replace(';20101;', ';29999;')]
+        for kwargs in ({}, {'lazy': True}, {'columnar': True}):
+            FakeElection.files = make_ap_files(votes=0)
+            clear_pools()
+            election = BatchedElection(username='user', **kwargs)
+            election.snapshot()
+            called = []
+            election.on_votes_changed(
+                lambda race, changes: called.extend(changes)
+            )
+            FakeElection.files = dict(new)
+            FakeElection.files[path] = '\n'.join(broken)
+            clear_pools()
+            self.assertRaises(KeyError, election.refresh)
+            # What was applied before the bad line is passed on anyway. The
+            # columns are filled a line at a time, the objects a batch at a
+            # time.
+            applied = 15 if kwargs else 14
+            self.assertEqual(len(called), applied * 3)
+            self.assertEqual(
+                sorted(r.votecount for r in election.snapshot().get_results(
+                    race='20000-IA',
+                    reporting_unit='Iowa1'
+                )),
+                [20, 40, 60]
+            )
+            # And the rest comes in once the file is fixed
+            FakeElection.files = dict(new)
+            clear_pools()
+            election.refresh()
+            self.assertEqual(len(called), 16 * 3)
+            self.assertEqual(
+                sorted(r.serialize() for r in election.snapshot().results),
+                sorted(r.serialize() for r in election.results)
+            )
+
+    def test_refresh_changes(self):
+        old = make_ap_files(votes=0)
+        new = make_ap_files(votes=1)
+        path = '/Delegate_Tracking/US/flat/US_20160201.txt'
+        old_lines = old[path].split('\n')
+        new_lines = new[path].split('\n')
+        for kwargs in ({}, {'lazy': True}, {'columnar': True}):
+            # The last county of the last race hasn't come in yet
+            FakeElection.files = dict(old)
+            FakeElection.files[path] = '\n'.join(old_lines[:-1])
+            clear_pools()
+            election = FakeElection(username='user', **kwargs)
+            self.assertEqual(len(election.results), 15 * 3)
+
+            # The first line moves and the last one shows up
+            FakeElection.files = dict(old)
+            FakeElection.files[path] = '\n'.join(
+                new_lines[:1] + old_lines[1:-1] + new_lines[-1:]
+            )
+            clear_pools()
+            summary = election.refresh()
+            self.assertEqual(summary['added'], 3)
+            changes = summary['changes']
+            self.assertEqual(len(changes), 3 + 1 + 1 + 1)
+
+            race = election.get_race('20000-IA')
+            unit = election.get_reporting_unit('Iowa1', race=race)
+            self.assertEqual(
+                [(c.candidate.candidateid, c.before, c.after)
+                 for c in changes.votes],
+                [('1001', 10, 20), ('1002', 20, 40), ('1003', 30, 60)]
+            )
+            for c in changes.votes:
+                self.assertTrue(c.race is race)
+                self.assertTrue(c.reporting_unit is unit)
+            self.assertEqual(
+                changes.precincts,
+                [PrecinctChange(race, unit, 0, 8)]
+            )
+            self.assertEqual(
+                changes.winners,
+                [NewWinner(race, unit, election.get_candidate('1001'))]
+            )
+            race = election.get_race('20101-NH')
+            self.assertEqual(changes.reporting_units, [NewReportingUnit(
+                race,
+                election.get_reporting_unit(
+                    'New Hampshire County 24',
+                    race=race
+                )
+            )])
+            self.assertEqual(
+                repr(changes.precincts[0]),
+                '<PrecinctChange: before=0, after=8>'
+            )
+
+            # Nothing changes the second time
+            self.assertFalse(election.refresh()['changes'])
+
+    def test_callbacks(self):
+        FakeElection.files = make_ap_files(votes=0)
+        clear_pools()
+        election = FakeElection(username='user')
+        calls = []
+
+        @election.on_race_called
+        def called(race, winners):
+            calls.append(('called', race.ap_race_number, len(winners)))
+
+        election.on_votes_changed(
+            lambda race, changes: calls.append(
+                ('votes', race.ap_race_number, len(changes))
+            )
+        )
+        election.on_precincts_changed(
+            lambda race, changes: calls.append(
+                ('precincts', race.ap_race_number, len(changes))
+            )
+        )
+        FakeElection.files = make_ap_files(votes=1)
+        clear_pools()
+        election.refresh()
+        # One call per race for each kind, not one per change
+        races = [r.ap_race_number for r in election.races]
+        self.assertEqual(sorted(calls), sorted(
+            [('called', r, 1) for r in races] +
+            [('votes', r, 4 * 3) for r in races] +
+            [('precincts', r, 4) for r in races]
+        ))
+        del calls[:]
+        election.refresh()
+        self.assertEqual(calls, [])
+
+    def test_callback_errors(self):
+        FakeElection.files = make_ap_files(votes=0)
+        clear_pools()
+        election = FakeElection(username='user')
+        calls = []
+
+        @election.on_race_called
+        def broken(race, winners):
+            raise ValueError(race.ap_race_number)
+
+        election.on_race_called(lambda race, winners: calls.append(race))
+        FakeElection.files = make_ap_files(votes=1)
+        clear_pools()
+        summary = election.refresh()
+        # The other callbacks still hear about every race, and the changes
+        # still come back
+        self.assertEqual(calls, summary['changes'].races)
+        self.assertEqual(len(summary['changes'].winners), 4)
+        errors = summary['changes'].errors
+        self.assertEqual(len(errors), 4)
+        callback, race, error = errors[0]
+        self.assertTrue(callback is broken)
+        self.assertEqual(str(error), race.ap_race_number)
+
+    def test_poll(self):
+        FakeElection.files = make_ap_files(votes=0)
+        clear_pools()
+        election = FakeElection(username='user')
+        FakeElection.files = make_ap_files(votes=1)
+        clear_pools()
+        poller = election.poll(0.01)
+        try:
+            changes = iter(poller).next()
+        finally:
+            poller.stop()
+        self.assertFalse(poller.running)
+        self.assertEqual(len(changes.winners), 4)
+        self.assertEqual(len(election.filter_results(winner=True)), 4)
+        # Nothing else changed, so there's nothing more to wait for
+        poller.wait = 0.01
+        self.assertEqual(list(poller), [])
+
+        # Errors come out of the iteration
+        FakeElection.files = {}
+        clear_pools()
+        poller = election.poll(0.01)
+        try:
+            self.assertRaises(FileDoesNotExistError, iter(poller).next)
+        finally:
+            poller.stop()
+
+    def test_snapshot(self):
+        old = make_ap_files(votes=0)
+        new = make_ap_files(votes=1)
+        path = '/Delegate_Tracking/US/flat/US_20160201.txt'
+        old_lines = old[path].split('\n')
+        new_lines = new[path].split('\n')
+        for kwargs in ({}, {'flyweight': True}, {'lazy': True},
+                       {'columnar': True}):
+            FakeElection.files = old
+            clear_pools()
+            election = FakeElection(username='user', **kwargs)
+            first = election.snapshot()
+            self.assertTrue(election.snapshot() is first)
+            self.assertEqual(first.version, 1)
+            self.assertEqual(len(first.results), 16 * 3)
+            self.assertEqual(len(first.reporting_units), 16)
+            self.assertEqual(
+                sorted(r.serialize() for r in first.results),
+                sorted(r.serialize() for r in election.results)
+            )
+            self.assertRaises(AttributeError, setattr, first, 'version', 2)
+
+            # Only the first race changes
+            FakeElection.files = dict(old)
+            FakeElection.files[path] = '\n'.join(
+                new_lines[:1] + old_lines[1:]
+            )
+            clear_pools()
+            election.refresh()
+            second = election.snapshot()
+            self.assertEqual(second.version, 2)
+            self.assertEqual(
+                sorted(r.votecount for r in first.get_results(
+                    race='20000-IA',
+                    reporting_unit='Iowa1'
+                )),
+                [10, 20, 30]
+            )
+            self.assertEqual(
+                sorted(r.votecount for r in second.get_results(
+                    race='20000-IA',
+                    reporting_unit='Iowa1'
+                )),
+                [20, 40, 60]
+            )
+            self.assertEqual(
+                second.get_reporting_unit('Iowa1', '20000-IA')
+                .precinctsreporting,
+                8
+            )
+            self.assertEqual(
+                first.get_reporting_unit('Iowa1', '20000-IA')
+                .precinctsreporting,
+                0
+            )
+            self.assertEqual(
+                len(second.get_results(candidate='1001')),
+                len(election.get_results(candidate='1001'))
+            )
+            # The races that didn't change are shared
+            for race in election.races:
+                shared = second.state(race.ap_race_number) is \
+                    first.state(race.ap_race_number)
+                self.assertEqual(
+                    shared,
+                    race.ap_race_number != '20000-IA'
+                )
+
+            # So are the reporting units that didn't change in the race that
+            # did
+            before = first.state('20000-IA')
+            after = second.state('20000-IA')
+            for unit in election.get_reporting_units('20000-IA'):
+                self.assertEqual(
+                    after.get_unit(unit.key) is before.get_unit(unit.key),
+                    unit.key != 'Iowa1'
+                )
+
+            # Nothing new, no new version
+            election.refresh()
+            self.assertTrue(election.snapshot() is second)
+
+            # An old version goes away once nobody holds it
+            pinned = weakref.ref(first)
+            del first
+            gc.collect()
+            self.assertEqual(pinned(), None)
+
+    def test_snapshot_before_results(self):
+        for kwargs in ({}, {'lazy': True}, {'columnar': True}):
+            clear_pools()
+            election = FakeElection(username='user', results=False, **kwargs)
+            first = election.snapshot()
+            self.assertEqual(first.results, [])
+            # The first results to come in are all published
+            election.refresh()
+            second = election.snapshot()
+            self.assertEqual(second.version, 2)
+            self.assertEqual(len(second.results), 6 * 5 * 3)
+            self.assertEqual(
+                sorted(r.serialize() for r in second.results),
+                sorted(r.serialize() for r in election.results)
+            )
+            self.assertEqual(first.results, [])
+            # And stay that way when they don't change
+            election.refresh()
+            self.assertTrue(election.snapshot() is second)
+
+    def test_snapshot_readers(self):
+        versions = [make_ap_files(votes=v) for v in range(4)]
+        FakeElection.files = versions[0]
+        clear_pools()
+        election = FakeElection(username='user')
+        election.snapshot()
+        done = threading.Event()
+        errors = []
+
+        def read():
+            while not done.is_set():
+                pinned = election.snapshot()
+                for unit in pinned.reporting_units:
+                    results = pinned.get_results(
+                        race=unit.ap_race_number,
+                        reporting_unit=unit.key
+                    )
+                    # Never half of one refresh and half of another
+                    if unit.votecount != sum(r.votecount for r in results):
+                        errors.append((pinned.version, unit.key))
+
+        readers = [threading.Thread(target=read) for i in range(2)]
+        for t in readers:
+            t.start()
+        try:
+            for i in range(20):
+                FakeElection.files = versions[i % 4]
+                clear_pools()
+                election.refresh()
+        finally:
+            done.set()
+            for t in readers:
+                t.join()
+        self.assertEqual(errors, [])
+        # The first refresh changed nothing
+        self.assertEqual(election.snapshot().version, 20)
+
+    def test_refresh_changed_lines(self):
+        old = make_ap_files(votes=0)
+        new = make_ap_files(votes=1)
+        path = '/Delegate_Tracking/US/flat/US_20160201.txt'
+        old_lines = old[path].split('\n')
+        new_lines = new[path].split('\n')
+        for detect_changes in (True, False):
+            FakeElection.files = old
+            clear_pools()
+            election = FakeElection(
+                username='user',
+                detect_changes=detect_changes
+            )
+            # Only the first line moves
+            FakeElection.files = dict(old)
+            FakeElection.files[path] = '\n'.join(
+                new_lines[:1] + old_lines[1:]
+            )
+            clear_pools()
+            summary = election.refresh()
+            self.assertEqual(summary['lines'], 16)
+            if detect_changes:
+                self.assertEqual(summary['changed_lines'], 1)
+                self.assertEqual(summary['unchanged_lines'], 15)
+            else:
+                self.assertEqual(summary['changed_lines'], 16)
+                self.assertEqual(summary['unchanged_lines'], 0)
+            self.assertEqual(summary['results'], 3)
+            self.assertEqual(summary['reporting_units'], 1)
+            self.assertEqual(len(election.filter_results(winner=True)), 1)
+
+
+    def test_races_by_state(self):
+        election = FakeElection(username='user', results=False)
+        self.assertEqual(sorted(election._races_by_state), ['CA', 'IA', 'NH'])
+        for state, races in election._races_by_state.items():
+            self.assertEqual(
+                sorted(r.ap_race_number for r in races),
+                sorted(
+                    r.ap_race_number
+                    for r in election.filter_races(statepostal=state)
+                )
+            )
+            for race in races:
+                # The statewide unit and four counties
+                self.assertEqual(len(race.reportingunits), 5)
+                for ru in race.reportingunits:
+                    self.assertEqual(ru.statepostal, state)
+
+    def test_badlogin(self):
+        with self.assertRaises(BadCredentialsError):
+            FakeElection(username='foo', password='bar')
+        with self.assertRaises(BadCredentialsError):
+            FakeElection(username='foo', password='bar', connections=4)
+
+    def test_baddate(self):
+        with self.assertRaises(FileDoesNotExistError):
+            FakeElection(electiondate='20160202', username='user')
+        with self.assertRaises(FileDoesNotExistError):
+            FakeElection(
+                electiondate='20160202',
+                username='user',
+                connections=4
+            )
+
+    def test_parallel_fetch(self):
+        serial = FakeElection(username='user')
+        parallel = FakeElection(username='user', connections=4)
+        self.assertTrue(1 <= sum(parallel.ftp_stats.values()) <= 4)
+        self.assertEqual(parallel.pool.stats()['in_use'], 0)
+        self.assertEqual(parallel._prefetched, {})
+        self.assertEqual(dump(serial.races), dump(parallel.races))
+        self.assertEqual(
+            dump(serial.reporting_units),
+            dump(parallel.reporting_units)
+        )
+        self.assertEqual(dump(serial.candidates), dump(parallel.candidates))
+        self.assertEqual(dump(serial.results), dump(parallel.results))
+        # Fewer connections than files still gets everything
+        self.assertEqual(
+            dump(serial.results),
+            dump(FakeElection(username='user', connections=2).results)
+        )
+
+    def test_pooled_connections(self):
+        first = FakeElection(username='user', password='pass')
+        self.assertEqual(first.ftp_stats['misses'], 1)
+        self.assertEqual(first.pool.stats()['idle'], 1)
+        self.assertEqual(first.pool.stats()['in_use'], 0)
+        # The next Election reuses the same login for each of its files
+        second = FakeElection(username='user', password='pass')
+        self.assertEqual(second.ftp_stats, {
+            'hits': 4, 'misses': 0, 'reconnects': 0
+        })
+        self.assertEqual(second._ftp_hits, 0)
+        self.assertTrue(first.pool is second.pool)
+        # But a different user gets their own pool
+        other = FakeElection(username='other', password='pass')
+        self.assertFalse(other.pool is first.pool)
+        self.assertEqual(other.ftp_stats['misses'], 1)
+
+    def test_pool_logins(self):
+        # A bad password doesn't stick to the pool for the next Election
+        with self.assertRaises(BadCredentialsError):
+            FakeElection(username='user', password='wrong')
+        election = FakeElection(username='user', password='right')
+        self.assertEqual(election.ftp_stats['misses'], 1)
+        # And the pool doesn't hang on to the Elections that use it
+        ref = weakref.ref(election)
+        del election
+        gc.collect()
+        self.assertEqual(ref(), None)
+
+    def test_pool_stale_connection(self):
+        for kwargs in ({}, {'conditional': True}, {'connections': 4}):
+            clear_pools()
+            first = FakeElection(username='user', **kwargs)
+            # The server hangs up on the connections while they're idle
+            for conn, last_used in first.pool._idle:
+                conn.alive = False
+            second = FakeElection(username='user', **kwargs)
+            self.assertEqual(dump(first.results), dump(second.results))
+            self.assertTrue(second.ftp_stats['reconnects'] >= 1)
+
+    def test_unreachable(self):
+        class UnreachableElection(FakeElection):
+            def _connect(self):
+                raise socket.error(111, 'Connection refused')
+
+        for kwargs in ({}, {'conditional': True}, {'connections': 4}):
+            with self.assertRaises(socket.error):
+                UnreachableElection(username='user', **kwargs)
+
+    def test_pool_returned(self):
+        # Reading rows after the Election is made doesn't keep a connection
+        # out of the pool
+        elections = [
+            FakeElection(username='user', conditional=True)
+            for i in range(4)
+        ]
+        for election in elections:
+            list(election.iter_race_rows())
+        self.assertEqual(elections[0].pool.stats()['in_use'], 0)
+        FakeElection(username='user', conditional=True)
+        # Unless it was borrowed through the ftp property
+        election = elections[0]
+        ftp = election.ftp
+        list(election.iter_race_rows())
+        self.assertTrue(election._ftp is ftp)
+        self.assertEqual(election.pool.stats()['in_use'], 1)
+        election.close()
+        self.assertEqual(election.pool.stats()['in_use'], 0)
+
+    def test_pool_grows(self):
+        election = FakeElection(username='user', connections=6)
+        self.assertEqual(election.pool.max_connections, 6)
+        # But never shrinks
+        FakeElection(username='user')
+        self.assertEqual(election.pool.max_connections, 6)
+
+    def test_conditional_fetch(self):
+        first = FakeElection(username='user', conditional=True)
+        stats = first.fetch_stats
+        self.assertEqual(len(stats), 4)
+        for path, d in stats.items():
+            self.assertEqual(d['fetched'], 1)
+            self.assertEqual(d['skipped'], 0)
+            self.assertEqual(d['bytes_fetched'], len(self.files[path]))
+
+        # Nothing has changed, so nothing is downloaded or parsed again
+        first_rows = first._fetch_csv(first.race_file_path)
+        second = FakeElection(username='user', conditional=True)
+        self.assertTrue(
+            second._fetch_csv(second.race_file_path)[0] is first_rows[0]
+        )
+        self.assertEqual(dump(first.results), dump(second.results))
+
+        # Then the results change
+        results = make_ap_files(states=3, races=2, counties=4, votes=1)
+        path = first.results_file_path
+        self.files[path] = results[path]
+        FakeElection.modified[path] = '20160201120000'
+        third = FakeElection(username='user', conditional=True)
+        stats = third.fetch_stats
+        self.assertEqual(stats[path]['fetched'], 2)
+        self.assertEqual(stats[path]['skipped'], 1)
+        self.assertEqual(stats[first.race_file_path]['fetched'], 1)
+        self.assertEqual(stats[first.race_file_path]['skipped'], 4)
+        self.assertEqual(
+            stats[first.race_file_path]['bytes_saved'],
+            4 * len(self.files[first.race_file_path])
+        )
+        self.assertNotEqual(dump(first.results), dump(third.results))
+        self.assertEqual(
+            dump(third.results),
+            dump(FakeElection(username='user').results)
+        )
+        self.assertEqual(
+            dump(third.results),
+            dump(FakeElection(
+                username='user',
+                conditional=True,
+                connections=4
+            ).results)
+        )
+        with self.assertRaises(FileDoesNotExistError):
+            FakeElection(
+                electiondate='20160202',
+                username='user',
+                conditional=True
+            )
+
+    def test_cache_per_account(self):
+        # Another account sees a different file at each path, but with the
+        # same size and modification time
+        other_files = dict(
+            (path, data.replace('Last', 'Lest'))
+            for path, data in self.files.items()
+        )
+
+        class AccountElection(FakeElection):
+            def _connect(self):
+                if self.username == 'other':
+                    files = other_files
+                else:
+                    files = self.files
+                return FakeFTP(files, self.username, self.password)
+
+        user = AccountElection(username='user', conditional=True)
+        other = AccountElection(username='other', conditional=True)
+        self.assertEqual(
+            set(r.last[:4] for r in user.results),
+            set(['Last'])
+        )
+        self.assertEqual(
+            set(r.last[:4] for r in other.results),
+            set(['Lest'])
+        )
+        self.assertFalse(user.cache is other.cache)
+
+        # Or on disk
+        directory = tempfile.mkdtemp()
+        try:
+            clear_caches()
+            AccountElection(username='user', cache_dir=directory)
+            clear_caches()
+            other = AccountElection(username='other', cache_dir=directory)
+            self.assertEqual(
+                set(r.last[:4] for r in other.results),
+                set(['Lest'])
+            )
+            self.assertEqual(len(os.listdir(directory)), 8)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_retrieve_data(self):
+        election = FakeElection(username='user', results=False)
+        path = election.results_file_path
+        ftp = FakeFTP(self.files)
+        expected = self.files[path]
+        # Allocated to the right size, too small and too big
+        for size in (len(expected), 10, len(expected) * 2, None):
+            data = election._retrieve_data(ftp, path, size)
+            self.assertTrue(isinstance(data, bytearray))
+            self.assertEqual(str(data), expected)
+        # The plain download hands over its buffer rewound
+        self.assertEqual(election._retrieve(ftp, path).read(), expected)
+
+    def test_disk_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            first = FakeElection(username='user', cache_dir=directory)
+            self.assertEqual(len(os.listdir(directory)), 4)
+            # A new process starts out with nothing in memory...
+            clear_caches()
+            second = FakeElection(username='user', cache_dir=directory)
+            # ... but still doesn't download anything
+            for path, d in second.fetch_stats.items():
+                self.assertEqual(d['fetched'], 0)
+                self.assertEqual(d['skipped'], 1)
+            self.assertEqual(dump(first.results), dump(second.results))
+            self.assertEqual(dump(first.races), dump(second.races))
+            # Until the file changes
+            clear_caches()
+            FakeElection.modified[first.results_file_path] = '20160202'
+            FakeElection(username='user', cache_dir=directory)
+            self.assertEqual(len(os.listdir(directory)), 5)
+        finally:
+            shutil.rmtree(directory)
+
+
+class FlatfileParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = make_ap_files(states=2, races=2, counties=3)[
+            '/Delegate_Tracking/US/flat/US_20160201.txt'
+        ]
+        self.basicfields = ['f%s' % i for i in range(19)]
+        self.candidatefields = ['c%s' % i for i in range(12)]
+
+    def test_chunks(self):
+        expected = FlatfileParser(
+            self.basicfields,
+            self.candidatefields
+        ).parse(StringIO(self.data), blocksize=3)
+        self.assertEqual(len(expected), 16)
+        self.assertEqual(expected[0]['f0'], 't')
+        self.assertEqual(len(expected[0]['candidates']), 3)
+        self.assertEqual(expected[-1]['candidates'][-1]['c0'], '1012')
+        # No matter where the chunks break, the rows come out the same
+        for blocksize in (1, 2, 7, 100, 10000):
+            parser = FlatfileParser(self.basicfields, self.candidatefields)
+            rows = []
+            for i in range(0, len(self.data), blocksize):
+                rows.extend(parser.feed(self.data[i:i + blocksize]))
+            rows.extend(parser.close())
+            self.assertEqual(rows, expected)
+
+    def test_quoted_fields(self):
+        # A quoted county name with the delimiter in it
+        lines = self.data.split('\n')
+        lines[1] = lines[1].replace(
+            ';Iowa County 0;',
+            ';"Iowa County; 0";'
+        )
+        data = '\n'.join(lines)
+        rows = FlatfileParser(
+            self.basicfields,
+            self.candidatefields
+        ).parse(StringIO(data))
+        records = FlatfileRecordParser(
+            self.basicfields,
+            self.candidatefields
+        ).parse(StringIO(data))
+        self.assertEqual(rows[1]['f5'], 'Iowa County; 0')
+        self.assertEqual([r.as_dict() for r in records], rows)
+        # The line is still filed under the right columns
+        hashes = LineHashes([2, 6])
+        hashes.filter([lines[1]])
+        self.assertEqual(hashes._pending.keys(), [('IA', '20000')])
+
+    def test_records(self):
+        expected = FlatfileParser(
+            self.basicfields,
+            self.candidatefields
+        ).parse(StringIO(self.data))
+        records = FlatfileRecordParser(
+            self.basicfields,
+            self.candidatefields
+        ).parse(StringIO(self.data), blocksize=5)
+        self.assertEqual([r.as_dict() for r in records], expected)
+        record = records[1]
+        self.assertEqual(record['f5'], 'Iowa County 0')
+        self.assertEqual(record.get('f5'), 'Iowa County 0')
+        self.assertEqual(record.get('nope', 'x'), 'x')
+        self.assertRaises(KeyError, lambda: record['nope'])
+        self.assertEqual(record.candidate_values('c0'), [
+            '1001', '1002', '1003'
+        ])
+        self.assertEqual(
+            record.candidate_values('c9'),
+            [c['c9'] for c in expected[1]['candidates']]
+        )
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_projection(self):
+        full = FlatfileParser(
+            self.basicfields,
+            self.candidatefields
+        ).parse(StringIO(self.data))
+        fields = ['f5', 'f1', 'c9', 'c0']
+        converters = {'c0': int}
+        expected = []
+        for row in full:
+            d = {'f1': row['f1'], 'f5': row['f5']}
+            d['candidates'] = [
+                {'c0': int(c['c0']), 'c9': c['c9']} for c in row['candidates']
+            ]
+            expected.append(d)
+        rows = FlatfileParser(
+            self.basicfields,
+            self.candidatefields,
+            fields=fields,
+            converters=converters
+        ).parse(StringIO(self.data))
+        self.assertEqual(rows, expected)
+        parser = FlatfileRecordParser(
+            self.basicfields,
+            self.candidatefields,
+            fields=fields,
+            converters=converters
+        )
+        records = parser.parse(StringIO(self.data), blocksize=5)
+        self.assertEqual([r.as_dict() for r in records], expected)
+        # Fields keep the file's order, not the order they were asked for
+        self.assertEqual(parser.projection.basicfields, ['f1', 'f5'])
+        self.assertEqual(parser.projection.candidatefields, ['c0', 'c9'])
+        self.assertEqual(records[0].candidate_values('c0'), [1001, 1002, 1003])
+        self.assertEqual(len(records[0].values), 2 + 2 * 3)
+        # Only basic fields
+        records = FlatfileRecordParser(
+            self.basicfields,
+            self.candidatefields,
+            fields=['f1']
+        ).parse(StringIO(self.data))
+        self.assertEqual(records[0].as_dict(), {
+            'f1': full[0]['f1'],
+            'candidates': []
+        })
+        self.assertEqual(records[0].candidate_values('c0'), [])
+        self.assertRaises(
+            ValueError,
+            FlatfileParser,
+            self.basicfields,
+            self.candidatefields,
+            fields=['nope']
+        )
+
+    def test_line_hashes(self):
+        hashes = LineHashes([0, 2])
+        lines = ['a;x;1;', 'b;x;1;', '', 'c;x;1;']
+        self.assertEqual(hashes.filter(lines), ['a;x;1;', 'b;x;1;', 'c;x;1;'])
+        self.assertEqual(hashes.stats(), {'changed': 3, 'unchanged': 0})
+        hashes.commit()
+        self.assertEqual(len(hashes), 3)
+        # Only what's different, or new, is kept
+        lines = ['a;x;1;', 'b;y;1;', 'c;x;2;', 'd;x;1;', 'e']
+        self.assertEqual(hashes.filter(lines), lines[1:])
+        self.assertEqual(hashes.stats(), {'changed': 4, 'unchanged': 1})
+        # Until they're committed, the old hashes stand
+        hashes.rollback()
+        self.assertEqual(hashes.filter(['b;y;1;']), ['b;y;1;'])
+        hashes.commit()
+        self.assertEqual(hashes.filter(['b;y;1;']), [])
+        parser = FlatfileRecordParser(
+            ['a', 'b', 'c'],
+            [],
+            changes=LineHashes([0])
+        )
+        self.assertEqual(len(parser.parse(StringIO('1;2;3;\n4;5;6;\n'))), 2)
+        parser.changes.commit()
+        rows = parser.parse(StringIO('1;2;3;\n4;5;7;\n'))
+        self.assertEqual([r['c'] for r in rows], ['7'])
+
+    def test_interner(self):
+        interner = Interner()
+        a = interner(''.join(['Io', 'wa']))
+        b = interner(''.join(['I', 'owa']))
+        self.assertTrue(a is b)
+        values = interner.many([''.join(['Io', 'wa']), 'NH', 'NH'])
+        self.assertTrue(values[0] is a)
+        self.assertEqual(len(interner), 2)
+        stats = interner.stats()
+        self.assertEqual(stats['lookups'], 5)
+        self.assertEqual(stats['unique'], 2)
+        self.assertEqual(stats['shared'], 3)
+        self.assertTrue(stats['bytes_saved'] > 8)
+        # Parsing through one shares values across rows
+        interner = Interner()
+        records = FlatfileRecordParser(
+            self.basicfields,
+            self.candidatefields,
+            interner=interner
+        ).parse(StringIO(self.data))
+        self.assertTrue(records[0]['f2'] is records[1]['f2'])
+        self.assertEqual(
+            [r.as_dict() for r in records],
+            FlatfileParser(
+                self.basicfields,
+                self.candidatefields
+            ).parse(StringIO(self.data))
+        )
+        rows = FlatfileParser(
+            self.basicfields,
+            self.candidatefields,
+            fields=['f2', 'c2'],
+            interner=interner
+        ).parse(StringIO(self.data))
+        self.assertTrue(rows[0]['f2'] is records[0]['f2'])
+        self.assertTrue(
+            rows[0]['candidates'][0]['c2'] is rows[1]['candidates'][0]['c2']
+        )
+
+    def test_streaming(self):
+        FakeElection.files = make_ap_files(states=2, races=2, counties=3)
+        FakeElection.modified = {}
+        clear_pools()
+        election = FakeElection(username='user')
+        self.assertEqual(
+            dump(election.results),
+            dump(FakeElection(username='user', conditional=True).results)
+        )
+        # The flat file is parsed while it's downloaded
+        rows = election.iter_results_rows()
+        row = next(rows)
+        self.assertEqual(row['county_name'], 'Iowa')
+        self.assertEqual(election.pool.stats()['in_use'], 1)
+        self.assertEqual(len(list(rows)), 15)
+        self.assertEqual(election.pool.stats()['in_use'], 0)
+        self.assertEqual(election.pool.stats()['idle'], 1)
+        self.assertEqual(
+            list(election.iter_results_rows()),
+            election._fetch_flatfile(
+                election.results_file_path,
+                election.results_basic_fields,
+                election.results_candidate_fields
+            )
+        )
+        # Abandoning a download throws its connection away
+        rows = election.iter_race_rows()
+        self.assertEqual(next(rows)['st_postal'], 'IA')
+        rows.close()
+        self.assertEqual(election.pool.stats()['in_use'], 0)
+        self.assertEqual(election.pool.stats()['idle'], 0)
+        # Errors still come through
+        election.results_file_path = '/nope.txt'
+        with self.assertRaises(FileDoesNotExistError):
+            list(election.iter_results_rows())
+        self.assertEqual(election.pool.stats()['idle'], 1)
+
+
+class QueryIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeElection.files = make_ap_files(states=4, races=4, counties=1)
+        FakeElection.modified = {}
+        clear_pools()
+        self.election = FakeElection(username='user', results=False)
+
+    def scan(self, **kwargs):
+        # How filter_races used to work
+        races = self.election.races
+        for k in kwargs.keys():
+            races = filter(lambda x: getattr(x, k) == kwargs[k], races)
+        return races
+
+    def test_filter_races(self):
+        queries = [
+            {},
+            {'officename': 'President'},
+            {'officename': 'President', 'party': 'GOP'},
+            {'party': 'Dem', 'statepostal': 'NH'},
+            {'statepostal': 'TX', 'national': True, 'raceid': '20300'},
+            {'raceid': '20101'},
+            {'party': 'Nope'},
+            {'party': 'GOP', 'statepostal': 'Nope'},
+            {'officeid': 'P', 'racetypeid': 'R', 'national': 1},
+            {'party': ['unhashable']},
+        ]
+        for kwargs in queries:
+            self.assertEqual(
+                self.election.filter_races(**kwargs),
+                self.scan(**kwargs)
+            )
+        self.assertEqual(len(self.election.filter_races(party='GOP')), 8)
+        self.assertRaises(
+            AttributeError,
+            self.election.filter_races,
+            nope='x'
+        )
+
+    def test_lookups(self):
+        election = self.election
+        queries = [
+            ({'statepostal__in': ['IA', 'TX']},
+             lambda r: r.statepostal in ('IA', 'TX')),
+            ({'statepostal__in': []}, lambda r: False),
+            ({'officename__startswith': 'Pres', 'party__ne': 'GOP'},
+             lambda r: r.party != 'GOP'),
+            ({'raceid__gte': '20200', 'raceid__lt': '20300'},
+             lambda r: '20200' <= r.raceid < '20300'),
+            ({'uncontested__ne': False}, lambda r: False),
+            ({'seatnum__isnull': True, 'party': 'Dem'},
+             lambda r: r.party == 'Dem'),
+            ({'description__contains': 'x'}, lambda r: False),
+            ({'raceid__endswith': '1', 'statepostal__exact': 'NH'},
+             lambda r: r.raceid == '20101'),
+            ({'statepostal__in': [['unhashable'], 'CA']},
+             lambda r: r.statepostal == 'CA'),
+        ]
+        for kwargs, test in queries:
+            self.assertEqual(
+                election.filter_races(**kwargs),
+                filter(test, election.races)
+            )
+
+    def test_filter_results(self):
+        FakeElection.files = make_ap_files(
+            states=2, races=2, counties=3, votes=1
+        )
+        clear_pools()
+        election = FakeElection(username='user')
+        self.assertEqual(
+            election.filter_results(level='state', winner=True),
+            filter(
+                lambda r: r.level == 'state' and r.winner,
+                election.results
+            )
+        )
+        self.assertEqual(len(election.filter_results(level='state')), 12)
+        self.assertEqual(
+            election.filter_results(votecount__gte=50, polid__ne='501'),
+            filter(
+                lambda r: r.votecount >= 50 and r.polid != '501',
+                election.results
+            )
+        )
+        self.assertEqual(
+            election.filter_reporting_units(
+                statepostal='IA',
+                level__in=['county', 'township'],
+                precinctstotal__gt=10
+            ),
+            filter(
+                lambda r: (r.statepostal == 'IA' and r.level != 'state'
+                           and r.precinctstotal > 10),
+                election.reporting_units
+            )
+        )
+        self.assertEqual(election.filter_reporting_units(fipscode='nope'), [])
+
+    def test_invalidate(self):
+        election = self.election
+        race = election.filter_races(party='GOP')[0]
+        race.party = 'Libertarian'
+        # The index doesn't know yet
+        self.assertEqual(election.filter_races(party='Libertarian'), [])
+        election._race_index.invalidate()
+        self.assertEqual(election.filter_races(party='Libertarian'), [race])
+        self.assertEqual(len(election.filter_races(party='GOP')), 7)
+
+    def test_index(self):
+        index = QueryIndex(lambda: range(10), ['real'])
+        self.assertEqual(index.filter(real=3), [3])
+        self.assertEqual(sorted(index.index('real')), range(10))
+        self.assertEqual(index.filter(imag=0), range(10))
+
+
+class ResultStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeElection.files = make_ap_files(states=2, races=2, counties=3)
+        FakeElection.modified = {}
+        clear_pools()
+        self.election = FakeElection(username='user')
+
+    def keys(self, results):
+        return sorted(r.key for r in results)
+
+    def test_get_results(self):
+        election = self.election
+        results = election.results
+        self.assertEqual(self.keys(election.get_results()), self.keys(results))
+        for race in election.races:
+            expected = [r for r in results if r.raceid == race.raceid]
+            self.assertEqual(len(expected), 4 * 3)
+            self.assertEqual(
+                self.keys(election.get_results(race=race)),
+                self.keys(expected)
+            )
+            self.assertEqual(
+                self.keys(election.get_results(race=race.ap_race_number)),
+                self.keys(expected)
+            )
+            for candidate in race.candidates:
+                by_candidate = [
+                    r for r in results
+                    if r.candidateid == candidate.candidateid
+                ]
+                self.assertEqual(len(by_candidate), 4)
+                self.assertEqual(
+                    self.keys(election.get_results(candidate=candidate)),
+                    self.keys(by_candidate)
+                )
+                self.assertEqual(
+                    self.keys(election.get_results(
+                        race=race,
+                        candidate=candidate.candidateid
+                    )),
+                    self.keys(by_candidate)
+                )
+        race = election.races[0]
+        unit = race.reportingunits[0]
+        unit_results = election.get_results(race=race, reporting_unit=unit)
+        self.assertEqual(len(unit_results), 3)
+        for r in unit_results:
+            self.assertEqual(r.raceid, race.raceid)
+            self.assertEqual(r.reportingunitname, unit.reportingunitname)
+        candidate = race.candidates[0]
+        self.assertEqual(
+            election.get_results(
+                race=race,
+                reporting_unit=unit,
+                candidate=candidate
+            ),
+            election.get_results(reporting_unit=unit, candidate=candidate)
+        )
+        self.assertEqual(election.get_results(race='nope'), [])
+        self.assertEqual(election.get_results(candidate='nope'), [])
+
+    def test_columnar(self):
+        FakeElection.files = make_ap_files(
+            states=2, races=2, counties=3, votes=2
+        )
+        clear_pools()
+        election = FakeElection(username='user')
+        columnar = FakeElection(username='user', columnar=True)
+        store = columnar._result_store
+        self.assertTrue(isinstance(store, ColumnarResultStore))
+        self.assertEqual(columnar._results, {})
+        self.assertEqual(len(store), 4 * 4 * 3)
+        self.assertEqual(dump(columnar.results), dump(election.results))
+        self.assertEqual(
+            dump(columnar.reporting_units),
+            dump(election.reporting_units)
+        )
+        race = election.races[0]
+        unit = race.reportingunits[1]
+        candidate = race.candidates[2]
+        queries = [
+            {'race': race.ap_race_number},
+            {'candidate': candidate.candidateid},
+            {'reporting_unit': unit.key},
+            {'race': race.ap_race_number, 'reporting_unit': unit.key},
+            {'race': race.ap_race_number, 'candidate': candidate.candidateid},
+            {'reporting_unit': unit.key, 'candidate': candidate.candidateid},
+            {'race': 'nope'},
+            {'race': 'nope', 'candidate': candidate.candidateid},
+            {'reporting_unit': 'nope'},
+        ]
+        for kwargs in queries:
+            self.assertEqual(
+                dump(columnar.get_results(**kwargs)),
+                dump(election.get_results(**kwargs))
+            )
+        self.assertEqual(
+            dump(columnar.filter_results(winner=True)),
+            dump(election.filter_results(winner=True))
+        )
+        self.assertTrue(store.nbytes() > 0)
+        if numpy is not None:
+            columns = store.to_numpy()
+            self.assertEqual(
+                columns['votecount'].sum(),
+                sum(r.votecount for r in election.results)
+            )
+            self.assertEqual(columns['race'].dtype, numpy.dtype('i'))
+
+    def test_lazy(self):
+        election = self.election
+        lazy = FakeElection(username='user', lazy=True)
+        store = lazy._result_store
+        self.assertTrue(isinstance(store, LazyResultStore))
+        # Nothing is built until it's asked for
+        self.assertEqual(len(store.cache), 0)
+        race = lazy.races[0]
+        results = lazy.get_results(race=race)
+        self.assertEqual(len(store.cache), len(results))
+        self.assertEqual(
+            dump(results),
+            dump(election.get_results(race=race.ap_race_number))
+        )
+        # And then it's the same objects every time
+        again = lazy.get_results(race=race)
+        for a, b in zip(results, again):
+            self.assertTrue(a is b)
+        self.assertEqual(dump(lazy.results), dump(election.results))
+        self.assertEqual(
+            dump(lazy.candidate_reporting_units),
+            dump(election.results)
+        )
+        self.assertEqual(len(store.cache), len(election.results))
+
+        # With a bound, only the most recently used are kept
+        bounded = FakeElection(username='user', lazy=True, result_cache_size=5)
+        store = bounded._result_store
+        self.assertEqual(dump(bounded.results), dump(election.results))
+        self.assertEqual(len(store.cache), 5)
+        self.assertEqual(
+            store.cache.stats()['evictions'],
+            len(election.results) - 5
+        )
+
+    def test_flyweight(self):
+        FakeElection.files = make_ap_files(
+            states=2, races=2, counties=3, votes=3
+        )
+        clear_pools()
+        election = FakeElection(username='user')
+        flyweight = FakeElection(username='user', flyweight=True)
+        lazy = FakeElection(username='user', flyweight=True, lazy=True)
+
+        def attributes(results, names):
+            return sorted(
+                sorted((k, flatten(getattr(r, k))) for k in names)
+                for r in results
+            )
+
+        names = vars(election.results[0]).keys()
+        expected = attributes(election.results, names)
+        self.assertEqual(attributes(flyweight.results, names), expected)
+        self.assertEqual(attributes(lazy.results, names), expected)
+        self.assertEqual(
+            sorted(r.serialize() for r in flyweight.results),
+            sorted(r.serialize() for r in election.results)
+        )
+        result = flyweight.results[0]
+        self.assertTrue(isinstance(result, FlyweightResult))
+        self.assertTrue(isinstance(result, CandidateReportingUnit))
+        # The shared attributes come straight from the race
+        race = flyweight.get_race(
+            '%s-%s' % (result.raceid, result.statepostal)
+        )
+        self.assertTrue(result._race is race)
+        self.assertRaises(AttributeError, setattr, result, 'officename', 'x')
+        result.votecount = 5
+        self.assertEqual(result.votecount, 5)
+        self.assertEqual(
+            len(flyweight.filter_results(winner=True)),
+            len(election.filter_results(winner=True))
+        )
+
+    def test_empty_candidates(self):
+        # Rows sometimes end with an empty candidate
+        files = make_ap_files(states=2, races=2, counties=3)
+        path = '/Delegate_Tracking/US/flat/US_20160201.txt'
+        empty = ';' * 9 + '0;;;'
+        files[path] = files[path].replace(';\r\n', ';' + empty + '\r\n')
+        FakeElection.files = files
+        clear_pools()
+        election = FakeElection(username='user')
+        lazy = FakeElection(username='user', lazy=True)
+        self.assertEqual(len(lazy.results), 4 * 4 * 3)
+        self.assertEqual(dump(lazy.results), dump(election.results))
+
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get('b'), None)
+        cache.set('a', 4)
+        cache.set('d', 5)
+        self.assertEqual(sorted(cache._links), ['a', 'd'])
+        self.assertEqual(cache.get('a'), 4)
+        self.assertEqual(cache.stats(), {
+            'size': 2,
+            'max_size': 2,
+            'hits': 2,
+            'misses': 1,
+            'evictions': 2,
+        })
+        unbounded = LRUCache()
+        for i in range(100):
+            unbounded.set(i, i)
+        self.assertEqual(len(unbounded), 100)
+        unbounded.clear()
+        self.assertEqual(len(unbounded), 0)
+
+    def test_percentages(self):
+        values = [0, 1, 2, 7, 10, 3, 0, 123456789, 5]
+        totals = [0, 3, 3, 9, 0, 7, 12, 987654321, 5]
+        for multiply in (True, False):
+            expected = [
+                calculate.percentage(v, t, multiply=multiply) or 0.0
+                for v, t in zip(values, totals)
+            ]
+            self.assertEqual(
+                vector._python_percentages(values, totals, multiply),
+                expected
+            )
+            if numpy is not None:
+                # Check the very same floats come out, not just close ones
+                got = vector._numpy_percentages(values, totals, multiply)
+                self.assertEqual(map(repr, got), map(repr, expected))
+                self.assertEqual(
+                    set(map(type, got)),
+                    set([float])
+                )
+        self.assertEqual(vector.percentages([], []), [])
+
+    def test_store(self):
+        store = ResultStore()
+        store.add('r1', 'u1', 'c1', 'a')
+        store.add('r1', 'u2', 'c1', 'b')
+        store.add('r2', 'u1', 'c2', 'c')
+        store.add('r1', 'u1', 'c1', 'd')
+        self.assertEqual(len(store), 3)
+        self.assertEqual(sorted(store.get()), ['b', 'c', 'd'])
+        self.assertEqual(sorted(store.get(candidate='c1')), ['b', 'd'])
+        self.assertEqual(sorted(store.get(reporting_unit='u1')), ['c', 'd'])
+        self.assertEqual(store.get('r1', 'u2'), ['b'])
+        self.assertEqual(store.get('r1', 'u3'), [])
+        self.assertEqual(store.get(reporting_unit='u2', candidate='c1'), ['b'])
+        store.clear()
+        self.assertEqual(store.get(), [])
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = DiskCache(self.directory, max_bytes=20)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_and_set(self):
+        self.assertEqual(self.cache.get('/a.txt', '1', 5), None)
+        self.cache.set('/a.txt', '1', 5, 'aaaaa')
+        entry = self.cache.get('/a.txt', '1', 5)
+        self.assertEqual(entry.data, 'aaaaa')
+        self.assertEqual(entry.open().read(), 'aaaaa')
+        self.assertEqual(self.cache.get('/a.txt', '2', 5), None)
+        self.assertEqual(self.cache.get('/a.txt', None, None), None)
+        self.assertEqual(os.listdir(self.directory), [
+            os.path.basename(self.cache.filename('/a.txt', '1', 5))
+        ])
+
+    def test_lru_eviction(self):
+        for i, path in enumerate(['/a.txt', '/b.txt']):
+            self.cache.set(path, '1', 8, path[1] * 8)
+            os.utime(self.cache.filename(path, '1', 8), (i, i))
+        # Reading a makes b the least recently used
+        self.cache.get('/a.txt', '1', 8)
+        self.cache.set('/c.txt', '1', 8, 'c' * 8)
+        self.assertNotEqual(self.cache.get('/a.txt', '1', 8), None)
+        self.assertEqual(self.cache.get('/b.txt', '1', 8), None)
+        self.assertNotEqual(self.cache.get('/c.txt', '1', 8), None)
+
+    def test_failed_write(self):
+        class FullFile(object):
+            def __init__(self, fd, mode):
+                os.close(fd)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def write(self, data):
+                raise IOError(28, 'No space left on device')
+
+        fdopen = os.fdopen
+        os.fdopen = FullFile
+        try:
+            entry = self.cache.set('/a.txt', '1', 5, 'aaaaa')
+        finally:
+            os.fdopen = fdopen
+        # The data still comes back, but nothing is left on disk
+        self.assertEqual(entry.data, 'aaaaa')
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.cache.get('/a.txt', '1', 5), None)
+
+
+class FTPPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FTPPool(
+            'example.com',
+            connect=lambda: FakeFTP({}),
+            max_connections=2,
+            ping_idle=False
+        )
+
+    def test_hits_and_misses(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.assertTrue(self.pool.acquire() is conn)
+        stats = self.pool.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['in_use'], 1)
+
+    def test_reconnect(self):
+        self.pool.keepalive = 0
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        conn.alive = False
+        fresh = self.pool.acquire()
+        self.assertFalse(fresh is conn)
+        self.assertEqual(self.pool.reconnects, 1)
+        self.assertEqual(conn.sock, None)
+        # Closed connections aren't returned to the pool
+        fresh.quit()
+        self.pool.release(fresh)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_eviction(self):
+        self.pool.max_idle = 0
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.assertFalse(self.pool.acquire() is conn)
+        self.assertEqual(self.pool.evictions, 1)
+        self.assertEqual(self.pool.misses, 2)
+
+    def test_eviction_outside_lock(self):
+        # Closing a connection means talking to the server, so it's done
+        # without holding up everybody else
+        held = []
+        lock = self.pool._lock
+
+        class SlowFTP(FakeFTP):
+            def quit(self):
+                held.append(lock._is_owned())
+                FakeFTP.quit(self)
+
+        self.pool.connect = lambda: SlowFTP({})
+        self.pool.max_idle = 0
+        self.pool.release(self.pool.acquire())
+        self.pool.acquire()
+        self.pool.release(self.pool.acquire())
+        self.pool.ping()
+        self.pool.clear()
+        self.assertEqual(held, [False, False])
+
+    def test_keepalive(self):
+        self.pool.keepalive = 0
+        conns = [self.pool.acquire(), self.pool.acquire()]
+        for conn in conns:
+            self.pool.release(conn)
+        conns[0].alive = False
+        self.pool.ping()
+        self.assertEqual(conns[1].commands, ['NOOP'])
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    def test_ping_idle(self):
+        self.pool.ping_idle = True
+        self.pool.keepalive = 0.01
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        time.sleep(0.1)
+        self.assertTrue('NOOP' in conn.commands)
+        # The pinging stops once nothing is left idle
+        conn.alive = False
+        time.sleep(0.1)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+        self.assertEqual(self.pool._keepalive_thread, None)
+
+    def test_fresh(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        fresh = self.pool.acquire(fresh=True)
+        self.assertFalse(fresh is conn)
+        self.assertEqual(self.pool.reconnects, 1)
+        # Connections can come from somewhere other than the pool's own
+        # function, too
+        other = FakeFTP({})
+        self.assertTrue(self.pool.acquire(connect=lambda: other) is conn)
+        self.pool.release(fresh)
+        self.pool.release(conn)
+        self.assertTrue(
+            self.pool.acquire(connect=lambda: other, fresh=True) is other
+        )
+
+    def test_timeout(self):
+        self.pool.timeout = 0.05
+        conns = [self.pool.acquire(), self.pool.acquire()]
+        self.assertRaises(PoolTimeoutError, self.pool.acquire)
+        self.pool.release(conns[0])
+        self.assertTrue(self.pool.acquire() is conns[0])
+
+    def test_max_connections(self):
+        conns = [self.pool.acquire(), self.pool.acquire()]
+        borrowed = []
+        t = threading.Thread(
+            target=lambda: borrowed.append(self.pool.acquire())
+        )
+        t.start()
+        time.sleep(0.05)
+        self.assertEqual(borrowed, [])
+        self.pool.release(conns[0])
+        t.join()
+        self.assertTrue(borrowed[0] is conns[0])
+        self.assertEqual(self.pool.misses, 2)
+
+
 if __name__ == '__main__':
     unittest.main()